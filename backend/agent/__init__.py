@@ -1,6 +1,6 @@
 from .agent import EcommerceAgent
 from .tools import AGENT_TOOLS
-from .prompts import get_system_prompt, generate_catalog_prompt
+from .prompts import get_system_prompt, generate_catalog_prompt, SYSTEM_PROMPT
 from .todo_manager import TodoManager, TodoItem
 
 __all__ = [
@@ -8,6 +8,7 @@ __all__ = [
     "AGENT_TOOLS",
     "get_system_prompt",
     "generate_catalog_prompt",
+    "SYSTEM_PROMPT",
     "TodoManager",
     "TodoItem",
 ]
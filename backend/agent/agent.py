@@ -3,18 +3,56 @@ Main AI agent implementation.
 Orchestrates the customization workflow using GPT-4o.
 """
 import asyncio
+import copy
 import json
 import uuid
-from typing import Any, AsyncIterator, Optional
+from typing import Any, AsyncIterator, Iterator, Optional
 
 from models.ui_tree import UITree
+from models.tree_index import journal_changes
 from models.requests import CustomizeEvent, TodoItem, PatchOperation
 from catalog.handlers import ActionContext, execute_action
 from services.openai_client import get_openai_client
 from services.gemini import get_gemini_service
-from .tools import AGENT_TOOLS
-from .prompts import get_system_prompt, generate_catalog_prompt
+from services.screenshot_diff import ScreenshotDiff, compare_screenshots
+from .tools import AGENT_TOOLS, FAST_AGENT_TOOLS
+from .prompts import SYSTEM_PROMPT
 from .todo_manager import TodoManager
+from .streaming import ToolCallAccumulator
+from .cache import get_response_cache
+from .tokens import TokenCounter
+from .sizing import SizeCounter, deep_size
+from .memory import SessionMemory, REQUEST_PREFIX
+from .pipeline import StepPrefetch, changed_keys_from_patches, response_conflicts, placeholder_tool_messages
+from .tree_versions import TreeVersions
+from .scheduler import ToolCallScheduler, get_tool_call_keys, DEFAULT_MAX_CONCURRENT_TOOLS
+from .patch_buffer import PatchBuffer, PASSTHROUGH_EVENTS, DEFAULT_BATCH_INTERVAL
+from .operation_log import ChangeSet, OperationLog
+
+
+# Tools that are acknowledged but not executed by _process_tool_calls
+SKIPPED_TOOLS = {
+    # Already handled during planning
+    "create_plan": "plan already processed",
+    # Handled separately in verification
+    "capture_screenshot": "will be executed in verification phase",
+    "validate_changes": "will be executed in verification phase",
+}
+
+# Verify changes with screenshots from the frontend (html2canvas)
+ENABLE_SCREENSHOT_VERIFICATION = True
+
+# History token budgets per call type (system prompt and tools not included)
+PLAN_HISTORY_TOKENS = 4000
+STEP_HISTORY_TOKENS = 8000
+VERIFY_HISTORY_TOKENS = 4000
+
+# Compact stored history past this size, keeping the most recent turns raw
+COMPACTION_TRIGGER_TOKENS = STEP_HISTORY_TOKENS
+COMPACTION_KEEP_TURNS = 1
+
+# (function_name, call_id, parsed params or None if invalid, task or None if not executed)
+PendingToolCall = tuple[str, str, Optional[dict[str, Any]], Optional[asyncio.Task]]
 
 
 class EcommerceAgent:
@@ -34,6 +72,11 @@ class EcommerceAgent:
         tree: UITree,
         theme: Optional[dict[str, Any]] = None,
         session_id: Optional[str] = None,
+        max_concurrent_tools: int = DEFAULT_MAX_CONCURRENT_TOOLS,
+        stream_steps: bool = False,
+        mode: str = "standard",
+        pipeline_steps: bool = False,
+        use_cache: bool = True,
     ):
         self.tree = tree
         self.theme = theme or {}
@@ -42,36 +85,254 @@ class EcommerceAgent:
         self.openai = get_openai_client()
         self.gemini = get_gemini_service()
         self.patches: list[PatchOperation] = []
+        self.max_concurrent_tools = max_concurrent_tools
+        self.stream_steps = stream_steps
+        self.mode = mode  # "standard" (plan, then one call per step) or "fast"
+        self.pipeline_steps = pipeline_steps
+        self.use_cache = use_cache
+        self.response_cache = get_response_cache()
         
         # Conversation history for multi-turn context
         self.messages: list[dict[str, Any]] = []
+        self.token_counter = TokenCounter()
+        self.size_counter = SizeCounter()
+
+        # Summary of compacted turns, kept as the first history message
+        self.memory = SessionMemory()
+        self.memory_message: Optional[dict[str, Any]] = None
         
         # Screenshot synchronization
         self.screenshot_event = asyncio.Event()
-        self.screenshot_data: Optional[str] = None
+        # Raw bytes from the binary upload, or base64 from the JSON upload
+        self.screenshot_data: Optional[str | bytes] = None
+
+        # Pre-change screenshot, compared against during verification
+        self.baseline_request_id: Optional[str] = None
+        self.baseline_screenshot: Optional[str | bytes] = None
         
         # Original user prompt for verification context
         self.user_prompt: str = ""
 
-    async def execute(self, prompt: str) -> AsyncIterator[CustomizeEvent]:
+        # Version of the server's tree (bumped by every patch)
+        self.tree_versions = TreeVersions()
+
+        # Undo/redo stacks of request changes, and the changes of the running request
+        # (committed step by step, so a failed step can be rolled back on its own)
+        self.operation_log = OperationLog()
+        self._request_changes = ChangeSet()
+        self._step_changes = ChangeSet()
+        # Failed actions of the current step, and tool messages of its successful ones
+        self._step_errors: list[str] = []
+        self._step_tool_messages: list[dict[str, Any]] = []
+
+        # Completions are only cached for requests on a session without prior history;
+        # (key, response, replayed) of the last one waits until its actions have run
+        self._cache_completions = False
+        self._pending_cache: Optional[tuple[str, dict[str, Any], bool]] = None
+
+        # Patches waiting for a patch_batch event (None: one patch event each)
+        self.patch_buffer: Optional[PatchBuffer] = None
+
+        # Revision of the last persisted state (see services/session_backends.py)
+        self.state_revision = 0
+
+    async def execute(
+        self,
+        prompt: str,
+        patch_batching: Optional[str] = None,
+        patch_batch_interval: float = DEFAULT_BATCH_INTERVAL,
+    ) -> AsyncIterator[CustomizeEvent]:
         """
         Execute the customization request.
 
+        If the run is cancelled (or the consumer stops iterating) before it
+        completes, history is rolled back to where the request started, so
+        no tool call is left without its tool response. Tree changes that
+        were already sent stay, and become undoable like completed ones.
+
         Args:
             prompt: User's customization request
+            patch_batching: Send patches as patch_batch events, flushed per
+                "tool" call, per "step" or by "time" (None: one patch event each)
+            patch_batch_interval: Seconds between flushes with "time" batching
 
         Yields:
             CustomizeEvent objects for streaming to frontend
         """
-        # Generate catalog prompt
-        catalog_prompt = generate_catalog_prompt()
-        system_prompt = get_system_prompt(catalog_prompt)
+        history = self.messages
+        checkpoint = len(history)
+        completed = False
+
+        self.patch_buffer = PatchBuffer(patch_batching, patch_batch_interval) if patch_batching else None
+        self._request_changes = ChangeSet(prompt)
+        self._start_step()
+        self._cache_completions = not self.messages
+        self._pending_cache = None
+        events = self._run(prompt)
+        if self.patch_buffer is not None:
+            events = self._batch_patches(events, self.patch_buffer)
+
+        try:
+            async for event in events:
+                if event.type == "complete":
+                    completed = True
+                    self._log_request_changes()
+                yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            if not completed:
+                self._rollback_request(history, checkpoint)
+            raise
+        finally:
+            self._log_request_changes()
+            self._clear_screenshots()
+
+    def _clear_screenshots(self) -> None:
+        """Drop the request's baseline and verification screenshots."""
+        self.baseline_screenshot = None
+        self.screenshot_data = None
+        self.screenshot_event.clear()
+
+    def _start_step(self) -> None:
+        """Start tracking a new step's tree changes and action results."""
+        self._step_changes = ChangeSet()
+        self._step_errors = []
+        self._step_tool_messages = []
+
+    def _commit_step(self) -> None:
+        """Make the current step's tree changes part of the request."""
+        self._request_changes.merge(self._step_changes)
+        self._start_step()
+
+    def _rollback_step(self, reason: str) -> Iterator[CustomizeEvent]:
+        """
+        Revert the current step's tree changes and yield their patches.
+
+        Components a later (already dispatched) action changed since are
+        left as they are. The tool messages of the step's successful actions
+        are replaced, so history doesn't claim they took effect.
+        """
+        patches = self._step_changes.revert(self.tree, strict=False)
+        theme_change = self._step_changes.theme_change
+
+        rolled_back = {id(m): m for m in self._step_tool_messages}
+        for i, message in enumerate(self.messages):
+            if id(message) in rolled_back:
+                self.messages[i] = {
+                    "role": "tool",
+                    "tool_call_id": message["tool_call_id"],
+                    "content": json.dumps({"error": f"Rolled back because the step failed: {reason}"}),
+                }
+        self._start_step()
+
+        if patches:
+            print(f"⏪ Rolled back failed step ({len(patches)} patches)")
+            yield from self._patch_events(patches)
+        if theme_change is not None:
+            self.theme = theme_change[0]
+            yield CustomizeEvent(type="theme_update", theme=self.theme)
+
+    def undo(self, redo: bool = False) -> Optional[tuple[ChangeSet, list[PatchOperation]]]:
+        """
+        Undo (or redo) the latest request's tree and theme changes.
+
+        Returns:
+            (change set, patches for the client), or None if there is nothing to do
+
+        Raises:
+            UndoConflictError: If the tree or theme changed since
+        """
+        step = self.operation_log.redo if redo else self.operation_log.undo
+        outcome = step(self.tree, self.theme)
+        if outcome is not None and outcome[0].theme_change is not None:
+            self.theme = outcome[0].theme_change[1 if redo else 0]
+        return outcome
+
+    def _log_request_changes(self) -> None:
+        """Push the request's tree changes onto the undo stack (once)."""
+        self._commit_step()
+        self.operation_log.push(self._request_changes)
+        self._request_changes = ChangeSet()
+
+    async def _batch_patches(
+        self,
+        events: AsyncIterator[CustomizeEvent],
+        buffer: PatchBuffer,
+    ) -> AsyncIterator[CustomizeEvent]:
+        """Flush buffered patches before events that depend on them (and on time)."""
+        pending: Optional[asyncio.Task] = None
+        try:
+            while True:
+                if buffer.mode == "time":
+                    # Wait for the next event in a task, so a timed flush doesn't cancel it
+                    if pending is None:
+                        pending = asyncio.ensure_future(anext(events))
+                    done, _ = await asyncio.wait({pending}, timeout=buffer.seconds_until_due())
+                    if not done:
+                        yield self._flush_patches()
+                        continue
+                    task, pending = pending, None
+                    try:
+                        event = task.result()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    try:
+                        event = await anext(events)
+                    except StopAsyncIteration:
+                        break
+
+                if event.type not in PASSTHROUGH_EVENTS and len(buffer):
+                    yield self._flush_patches()
+                yield event
+
+            if len(buffer):
+                yield self._flush_patches()
+        finally:
+            if pending is not None:
+                pending.cancel()
+            if buffer.received:
+                print(f"📦 Batched {buffer.received} patches into {buffer.sent} ({buffer.mode} mode)")
+
+    def _flush_patches(self) -> CustomizeEvent:
+        """Send the buffered patches as one patch_batch event."""
+        patches, version = self.patch_buffer.drain()
+        return CustomizeEvent(type="patch_batch", patches=patches, version=version)
+
+    def _rollback_request(self, history: list[dict[str, Any]], checkpoint: int) -> None:
+        """Undo the history of an unfinished request and fail its open todos."""
+        if self.messages is history:
+            del self.messages[checkpoint:]
+            self.token_counter.prune(self.messages)
+
+        for todo in self.todo_manager.todos:
+            if todo.status in ("pending", "in_progress"):
+                self.todo_manager.mark_failed(todo.id, "Cancelled")
+        print(f"🛑 Request cancelled; history rolled back to {len(self.messages)} messages")
+
+    async def _run(self, prompt: str) -> AsyncIterator[CustomizeEvent]:
+        """Run the planning, execution and verification phases."""
+        # Static system prompt (compiled once at import for prompt caching)
+        system_prompt = SYSTEM_PROMPT
+
+        # Ask for a pre-change screenshot; it arrives while planning runs
+        self.baseline_screenshot = None
+        if ENABLE_SCREENSHOT_VERIFICATION:
+            self.baseline_request_id = str(uuid.uuid4())
+            yield CustomizeEvent(
+                type="screenshot_request",
+                request_id=self.baseline_request_id,
+                session_id=self.session_id,
+            )
 
         # Phase 1: Planning
         yield CustomizeEvent(type="status", message="Planning changes...")
 
         try:
-            plan = await self._generate_plan(prompt, system_prompt)
+            if self.mode == "fast":
+                # Plan and actions come back in a single response
+                fast_response = await self._generate_plan_with_actions(prompt, system_prompt)
+            else:
+                plan = await self._generate_plan(prompt, system_prompt)
             yield CustomizeEvent(
                 type="plan",
                 todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
@@ -81,43 +342,32 @@ class EcommerceAgent:
             return
 
         # Phase 2: Execute each step
-        for todo in self.todo_manager.todos:
-            # Mark in progress
-            self.todo_manager.mark_in_progress(todo.id)
-            yield CustomizeEvent(
-                type="todo_update",
-                todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
-            )
-
-            yield CustomizeEvent(type="status", message=f"Executing: {todo.task}")
-
-            try:
-                # Execute the step (uses conversation history)
-                result = await self._execute_step(todo.task, system_prompt)
+        if self.mode == "fast":
+            async for event in self._execute_fast_actions(fast_response):
+                yield event
 
-                # Process tool calls and add results to history
-                async for event in self._process_tool_calls(result):
+            # Fall back to a per-step call only for steps that failed
+            retry = [t for t in self.todo_manager.todos if t.status == "failed"]
+            self._settle_cache(succeeded=not retry)
+            if retry:
+                yield CustomizeEvent(type="status", message=f"Retrying {len(retry)} steps...")
+                async for event in self._execute_todos(retry, system_prompt):
                     yield event
-
-                # Mark completed
-                self.todo_manager.mark_completed(todo.id, result)
-
-            except Exception as e:
-                self.todo_manager.mark_failed(todo.id, str(e))
-                yield CustomizeEvent(type="error", message=f"Step failed: {str(e)}")
-
-            yield CustomizeEvent(
-                type="todo_update",
-                todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
-            )
+        else:
+            async for event in self._execute_todos(self.todo_manager.todos, system_prompt):
+                yield event
 
         # Phase 3: Screenshot verification
-        # Enabled - using html2canvas with dynamic import
-        ENABLE_SCREENSHOT_VERIFICATION = True
-        
         if ENABLE_SCREENSHOT_VERIFICATION:
             MAX_VERIFY_ITERATIONS = 3
             yield CustomizeEvent(type="status", message="Verifying changes...")
+
+            # Pick up a baseline sent without a request_id, then start clean
+            if self.baseline_screenshot is None and self.screenshot_event.is_set():
+                self.baseline_screenshot = self.screenshot_data
+            self.screenshot_event.clear()
+            self.screenshot_data = None
+            previous_screenshot: Optional[str] = None
             
             for iteration in range(MAX_VERIFY_ITERATIONS):
                 # Request screenshot from frontend
@@ -133,7 +383,7 @@ class EcommerceAgent:
                     print(f"⏳ Waiting for screenshot (iteration {iteration + 1})...")
                     await asyncio.wait_for(self.screenshot_event.wait(), timeout=10.0)
                     self.screenshot_event.clear()
-                    print(f"✅ Screenshot received: {len(self.screenshot_data or '')} chars")
+                    print(f"✅ Screenshot received: {len(self.screenshot_data or '')} {'chars' if isinstance(self.screenshot_data, str) else 'bytes'}")
                 except asyncio.TimeoutError:
                     print("⏱️ Screenshot timeout")
                     yield CustomizeEvent(type="status", message="Screenshot timeout, skipping verification")
@@ -144,6 +394,22 @@ class EcommerceAgent:
                     yield CustomizeEvent(type="status", message="Screenshot unavailable, skipping verification")
                     self.screenshot_data = None
                     break
+
+                # Compare with the previous iteration (or the pre-change baseline)
+                reference = previous_screenshot or self.baseline_screenshot
+                previous_screenshot = self.screenshot_data
+                diff = None
+                if reference:
+                    diff = await self._diff_screenshots(reference, self.screenshot_data)
+                    if diff:
+                        yield CustomizeEvent(type="screenshot_diff", diff=diff.to_dict())
+                        if diff.unchanged and (iteration > 0 or not self.patches):
+                            # Nothing new to look at - skip the vision call
+                            reason = "No visible change since last check" if iteration > 0 else "No changes to verify"
+                            print(f"⏭️ {reason}, skipping vision analysis")
+                            yield CustomizeEvent(type="status", message=f"{reason}, skipping analysis")
+                            self.screenshot_data = None
+                            break
                 
                 # Analyze screenshot with vision
                 print(f"🔍 Calling OpenAI analyze_screenshot...")
@@ -151,12 +417,13 @@ class EcommerceAgent:
                 
                 try:
                     # Use trimmed messages to avoid token limit
-                    trimmed = self._trim_messages(max_messages=10)
+                    trimmed = self._trim_messages(VERIFY_HISTORY_TOKENS)
                     analysis_result = await self.openai.analyze_screenshot(
                         base64_image=self.screenshot_data,
                         original_prompt=self.user_prompt,
-                        messages=[{"role": "system", "content": get_system_prompt(catalog_prompt)}] + trimmed,
+                        messages=[{"role": "system", "content": system_prompt}] + trimmed,
                         tools=AGENT_TOOLS,
+                        diff=diff,
                     )
                     self.screenshot_data = None  # Clear for next iteration
                     
@@ -198,14 +465,306 @@ class EcommerceAgent:
                 except Exception as e:
                     yield CustomizeEvent(type="error", message=f"Screenshot analysis failed: {str(e)}")
                     break
+
+            # Don't hold the images until the next request
+            previous_screenshot = reference = None
+            self._clear_screenshots()
         
         # Phase 4: Complete
+        # Fold older turns into session memory once this response is flushed
+        asyncio.get_running_loop().call_soon(self.compact_history)
+
         summary = self.todo_manager.get_summary()
         yield CustomizeEvent(
             type="complete",
             message=f"Completed {summary['completed']}/{summary['total']} tasks",
             todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
+            version=self.tree_versions.version,
+        )
+
+    def compact_history(self) -> int:
+        """
+        Fold all but the most recent turns into session memory.
+
+        Runs once the stored history exceeds COMPACTION_TRIGGER_TOKENS. Whole
+        turns (from one request's user message to the next) are summarized
+        and their raw messages dropped, so tool call sequences stay intact.
+
+        Returns:
+            Number of raw messages removed
+        """
+        raw = self.messages
+        if raw and raw[0] is self.memory_message:
+            raw = raw[1:]
+
+        if sum(self.token_counter.count(m) for m in raw) <= COMPACTION_TRIGGER_TOKENS:
+            return 0
+
+        turn_starts = [
+            i for i, m in enumerate(raw)
+            if m.get("role") == "user"
+            and isinstance(m.get("content"), str)
+            and m["content"].startswith(REQUEST_PREFIX)
+        ]
+        if len(turn_starts) <= COMPACTION_KEEP_TURNS:
+            return 0
+
+        cut = turn_starts[-COMPACTION_KEEP_TURNS]
+        self.memory.absorb(raw[:cut], self.theme)
+        self.memory_message = self.memory.to_message()
+        self.messages = [self.memory_message] + raw[cut:]
+        self.token_counter.prune(self.messages)
+
+        print(f"🗜️ Compacted {cut} messages into session memory ({len(self.messages)} remain)")
+        return cut
+
+    def estimate_size(self) -> int:
+        """Rough memory footprint of the session in bytes."""
+        return sum(self.memory_breakdown().values())
+
+    def memory_breakdown(self) -> dict[str, int]:
+        """
+        Estimated bytes held by the session, by component.
+
+        Returns:
+            Bytes for the tree, undo log, history, patches, pending screenshots and
+            everything else (theme, memory, todos)
+        """
+        history = sum(self.size_counter.count(m) for m in self.messages)
+        if len(self.size_counter) > 2 * len(self.messages) + 64:
+            self.size_counter.prune(self.messages)
+
+        # The version log shares most patch objects with self.patches
+        listed = {id(p) for p in self.patches}
+        logged = [p for p in self.tree_versions.logged_patches() if id(p) not in listed]
+
+        return {
+            "tree": deep_size(self.tree),
+            "undo": deep_size(self.operation_log.retained(self.tree)),
+            "history": history,
+            "patches": deep_size(self.patches) + deep_size(logged),
+            "screenshots": len(self.screenshot_data or "") + len(self.baseline_screenshot or ""),
+            "other": deep_size(self.theme) + deep_size(self.memory.to_dict()) + deep_size(self.todo_manager.to_dict_list()),
+        }
+
+    def to_state(self) -> dict[str, Any]:
+        """
+        Serialize the session state needed to resume the conversation.
+
+        Screenshots and in-flight synchronization are not included; they only
+        matter while a request is running. The result is a snapshot: later
+        runs don't change it, so it can be encoded in another thread.
+        """
+        return {
+            "session_id": self.session_id,
+            "tree": self.tree.model_dump(),
+            "theme": copy.deepcopy(self.theme),
+            # Messages are replaced, never changed in place
+            "messages": list(self.messages),
+            "has_memory_message": bool(self.messages) and self.messages[0] is self.memory_message,
+            "memory": copy.deepcopy(self.memory.to_dict()),
+            "todos": self.todo_manager.to_dict_list(),
+            "user_prompt": self.user_prompt,
+            "mode": self.mode,
+            "stream_steps": self.stream_steps,
+            "pipeline_steps": self.pipeline_steps,
+            "use_cache": self.use_cache,
+            "max_concurrent_tools": self.max_concurrent_tools,
+            "state_revision": self.state_revision,
+            "tree_version": self.tree_versions.version,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> "EcommerceAgent":
+        """Rebuild an agent from to_state output."""
+        agent = cls(
+            tree=UITree(**state["tree"]),
+            theme=state.get("theme"),
+            session_id=state.get("session_id"),
+            max_concurrent_tools=state.get("max_concurrent_tools", DEFAULT_MAX_CONCURRENT_TOOLS),
+            stream_steps=state.get("stream_steps", False),
+            mode=state.get("mode", "standard"),
+            pipeline_steps=state.get("pipeline_steps", False),
+            use_cache=state.get("use_cache", True),
         )
+        agent.messages = state.get("messages", [])
+        agent.memory = SessionMemory.from_dict(state.get("memory", {}))
+        if state.get("has_memory_message") and agent.messages:
+            agent.memory_message = agent.messages[0]
+        agent.todo_manager.load_dict_list(state.get("todos", []))
+        agent.user_prompt = state.get("user_prompt", "")
+        agent.state_revision = state.get("state_revision", 0)
+        agent.tree_versions = TreeVersions(state.get("tree_version", 0))
+        return agent
+
+    async def _execute_todos(
+        self,
+        todos: list,
+        system_prompt: str,
+    ) -> AsyncIterator[CustomizeEvent]:
+        """
+        Execute todos one at a time, one GPT-4o call per step.
+
+        With pipeline_steps, the next step's completion is requested while the
+        current step's actions run, and used only if still valid afterwards.
+        """
+        prefetch: Optional[StepPrefetch] = None
+
+        try:
+            for index, todo in enumerate(todos):
+                # Mark in progress
+                self.todo_manager.mark_in_progress(todo.id)
+                yield CustomizeEvent(
+                    type="todo_update",
+                    todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
+                )
+
+                yield CustomizeEvent(type="status", message=f"Executing: {todo.task}")
+
+                try:
+                    if self.stream_steps:
+                        # Execute actions while the response is still streaming
+                        result: dict[str, Any] = {}
+                        async for event in self._execute_step_streaming(todo.task, system_prompt, result):
+                            yield event
+                    else:
+                        result = None
+                        if prefetch and prefetch.todo_id == todo.id:
+                            result = await self._use_prefetch(prefetch)
+                        prefetch = None
+                        if result is None:
+                            # Execute the step (uses conversation history)
+                            result = await self._execute_step(todo.task, system_prompt)
+
+                        # Overlap the next step's LLM call with this step's actions
+                        next_todo = todos[index + 1] if index + 1 < len(todos) else None
+                        if self.pipeline_steps and next_todo:
+                            prefetch = self._prefetch_step(next_todo.id, next_todo.task, system_prompt, result)
+
+                        # Process tool calls and add results to history
+                        async for event in self._process_tool_calls(result):
+                            yield event
+
+                    # Action failures come back as results, not exceptions
+                    failure = "; ".join(self._step_errors)
+                    if not failure:
+                        self.todo_manager.mark_completed(todo.id, result)
+                        self._settle_cache(succeeded=True)
+                        self._commit_step()
+
+                except Exception as e:
+                    failure = str(e) or type(e).__name__
+
+                if failure:
+                    self._settle_cache(succeeded=False)
+                    self.todo_manager.mark_failed(todo.id, failure)
+                    yield CustomizeEvent(type="error", message=f"Step failed: {failure}")
+                    # Don't leave the step half applied
+                    for event in self._rollback_step(failure):
+                        yield event
+                    # The speculative call assumed this step succeeded
+                    if prefetch:
+                        prefetch.cancel()
+                        prefetch = None
+
+                yield CustomizeEvent(
+                    type="todo_update",
+                    todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
+                )
+        finally:
+            if prefetch:
+                prefetch.cancel()
+
+    async def _execute_fast_actions(
+        self,
+        response: dict[str, Any],
+    ) -> AsyncIterator[CustomizeEvent]:
+        """
+        Execute the actions returned alongside the plan in fast mode.
+
+        Actions are grouped by their `step` index and reported step by step
+        as todo updates. A step fails if any of its actions fails or if the
+        model emitted no actions for it.
+        """
+        message = response.get("choices", [{}])[0].get("message", {})
+        todos = self.todo_manager.todos
+
+        # Group action calls by plan step; untagged calls follow the previous one
+        by_step: list[list[dict[str, Any]]] = [[] for _ in todos]
+        current = 0
+        for call in message.get("tool_calls") or []:
+            if call.get("function", {}).get("name") == "create_plan":
+                continue
+            step = self._pop_step_index(call)
+            if step is not None and 0 <= step < len(todos):
+                current = step
+            if by_step:
+                by_step[current].append(call)
+
+        # Dispatch everything up front so independent work overlaps across steps
+        scheduler = ToolCallScheduler(self.max_concurrent_tools)
+        pending = [
+            [self._dispatch_tool_call(call, scheduler) for call in calls]
+            for calls in by_step
+        ]
+
+        try:
+            for todo, step_pending in zip(todos, pending):
+                self.todo_manager.mark_in_progress(todo.id)
+                yield CustomizeEvent(
+                    type="todo_update",
+                    todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
+                )
+
+                for item in step_pending:
+                    async for event in self._report_tool_call(item, self.messages):
+                        yield event
+
+                if not step_pending:
+                    self.todo_manager.mark_failed(todo.id, "No actions generated for this step")
+                elif self._step_errors:
+                    failure = "; ".join(self._step_errors)
+                    self.todo_manager.mark_failed(todo.id, failure)
+                    # Retried from a clean state by the per-step fallback
+                    for event in self._rollback_step(failure):
+                        yield event
+                else:
+                    self.todo_manager.mark_completed(todo.id, {"actions": len(step_pending)})
+                self._commit_step()
+
+                yield CustomizeEvent(
+                    type="todo_update",
+                    todos=[TodoItem(**t) for t in self.todo_manager.to_dict_list()],
+                )
+        finally:
+            for step_pending in pending:
+                self._cancel_pending(step_pending)
+
+    def _patch_events(self, patches: list[PatchOperation]) -> Iterator[CustomizeEvent]:
+        """Record server patches and yield their events (versions are recorded even if batched)."""
+        for patch in patches:
+            self.patches.append(patch)
+            version = self.tree_versions.record(patch)
+            if self.patch_buffer is None:
+                yield CustomizeEvent(type="patch", patch=patch, version=version)
+            else:
+                self.patch_buffer.add(patch, version)
+        if self.patch_buffer is not None and self.patch_buffer.mode == "tool" and len(self.patch_buffer):
+            yield self._flush_patches()
+
+    @staticmethod
+    def _pop_step_index(call: dict[str, Any]) -> Optional[int]:
+        """Remove the fast mode `step` argument from a tool call and return it."""
+        function = call.get("function", {})
+        try:
+            params = json.loads(function.get("arguments", "{}"))
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(params, dict) or "step" not in params:
+            return None
+        step = params.pop("step")
+        function["arguments"] = json.dumps(params)
+        return step if isinstance(step, int) else None
 
     async def _generate_plan(self, prompt: str, system_prompt: str) -> dict[str, Any]:
         """Generate a plan using GPT-4o with conversation history for context."""
@@ -214,20 +773,28 @@ class EcommerceAgent:
         
         # Pass trimmed history (from previous requests in this session) for context
         # This allows "move it to left" to understand what "it" refers to
-        existing_history = self._trim_messages(max_messages=10) if self.messages else None
+        existing_history = self._trim_messages(PLAN_HISTORY_TOKENS) if self.messages else None
         
-        response = await self.openai.generate_plan(
-            user_prompt=prompt,
-            current_tree=self.tree.model_dump(),
-            system_prompt=system_prompt,
-            tools=AGENT_TOOLS,
-            conversation_history=existing_history,
-        )
+        # Plans only depend on prompt + tree when there is no prior history
+        cache_key = self._cache_key("plan", prompt) if not self.messages else None
+        response = self.response_cache.get(cache_key) if cache_key else None
+        if response is None:
+            response = await self.openai.generate_plan(
+                user_prompt=prompt,
+                current_tree=self.tree.model_dump(),
+                system_prompt=system_prompt,
+                tools=AGENT_TOOLS,
+                conversation_history=existing_history,
+            )
+            if cache_key:
+                self.response_cache.put(cache_key, response)
+        else:
+            print("♻️ Replaying cached plan")
         
         # Add this request to history for future context
         self.messages.append({
             "role": "user",
-            "content": f"Customize this e-commerce app: {prompt}\n\nUI Tree has {len(self.tree.elements)} elements.",
+            "content": f"{REQUEST_PREFIX}{prompt}\n\nUI Tree has {len(self.tree.elements)} elements.",
         })
 
         # Extract plan from tool call
@@ -261,32 +828,123 @@ class EcommerceAgent:
 
         raise ValueError("No plan generated")
 
+    async def _generate_plan_with_actions(self, prompt: str, system_prompt: str) -> dict[str, Any]:
+        """
+        Generate the plan and all of its actions in a single GPT-4o call (fast mode).
+
+        Creates the todos from the create_plan call and returns the response
+        so the action calls can be executed.
+        """
+        # Store original prompt for verification context
+        self.user_prompt = prompt
+
+        existing_history = self._trim_messages(PLAN_HISTORY_TOKENS) if self.messages else None
+
+        cache_key = self._cache_key("fast_plan", prompt) if not self.messages else None
+        response = self.response_cache.get(cache_key) if cache_key else None
+        replayed = response is not None
+        if response is None:
+            response = await self.openai.generate_plan_with_actions(
+                user_prompt=prompt,
+                current_tree=self.tree.model_dump(),
+                system_prompt=system_prompt,
+                tools=FAST_AGENT_TOOLS,
+                conversation_history=existing_history,
+            )
+        else:
+            print("♻️ Replaying cached plan and actions")
+        self._defer_cache(cache_key, response, replayed)
+
+        message = response.get("choices", [{}])[0].get("message", {})
+        tool_calls = message.get("tool_calls") or []
+
+        plan_call = next(
+            (c for c in tool_calls if c.get("function", {}).get("name") == "create_plan"),
+            None,
+        )
+        if not plan_call:
+            raise ValueError("No plan generated")
+
+        args = json.loads(plan_call["function"]["arguments"])
+        steps = args.get("steps", [])
+        if not steps:
+            raise ValueError("No plan generated")
+        self.todo_manager.create_from_plan(steps)
+
+        # Add this request to history for future context
+        self.messages.append({
+            "role": "user",
+            "content": f"{REQUEST_PREFIX}{prompt}\n\nUI Tree has {len(self.tree.elements)} elements.",
+        })
+        self.messages.append({
+            "role": "assistant",
+            "content": message.get("content"),
+            "tool_calls": tool_calls,
+        })
+        self.messages.append({
+            "role": "tool",
+            "tool_call_id": plan_call.get("id", ""),
+            "content": json.dumps({"status": "plan created", "steps": len(steps)}),
+        })
+
+        return response
+
     async def _execute_step(
         self,
         step: str,
         system_prompt: str,
     ) -> dict[str, Any]:
         """Execute a single step using GPT-4o with conversation history."""
-        # Summarize tree (just keys and types, not full props)
-        tree_summary = self._summarize_tree_for_step()
-        
-        # Add user message to history (keep it short)
-        self.messages.append({
-            "role": "user",
-            "content": f"Execute: {step}\n\nTree keys: {tree_summary}"
-        })
+        # Step history only matches a cached one if the session started empty
+        cache_key = self._cache_key("step", step) if self._cache_completions else None
+        messages = self._build_step_messages(step, system_prompt)
         
-        # Trim history if too long (keep last 20 messages)
-        trimmed_messages = self._trim_messages(max_messages=20)
-        
-        # Call with trimmed conversation history
-        response = await self.openai.chat_completion(
-            messages=[{"role": "system", "content": system_prompt}] + trimmed_messages,
-            tools=AGENT_TOOLS,
-            temperature=0.7,
-        )
-        
-        # Add assistant response to history
+        response = self.response_cache.get(cache_key) if cache_key else None
+        replayed = response is not None
+        if response is None:
+            # Call with trimmed conversation history
+            response = await self.openai.chat_completion(
+                messages=messages,
+                tools=AGENT_TOOLS,
+                temperature=0.7,
+            )
+        else:
+            print(f"♻️ Replaying cached step: {step[:60]}")
+        self._defer_cache(cache_key, response, replayed)
+        self._record_step_response(response)
+
+        return response
+
+    def _cache_key(self, kind: str, prompt: str) -> Optional[str]:
+        """Build a replay cache key for the current tree and theme (None if disabled)."""
+        if not self.use_cache:
+            return None
+        return self.response_cache.make_key(kind, prompt, self.tree, self.theme)
+
+    def _defer_cache(self, cache_key: Optional[str], response: dict[str, Any], replayed: bool) -> None:
+        """Hold a completion until its actions have run (see _settle_cache)."""
+        if cache_key and not replayed:
+            # Running the actions edits the tool calls in place (fast mode pops `step`)
+            response = copy.deepcopy(response)
+        self._pending_cache = (cache_key, response, replayed) if cache_key else None
+
+    def _settle_cache(self, succeeded: bool) -> None:
+        """
+        Cache the held completion if all of its actions succeeded, or evict
+        it if it was a replay whose actions failed.
+        """
+        if self._pending_cache is None:
+            return
+        cache_key, response, replayed = self._pending_cache
+        self._pending_cache = None
+        if succeeded and not replayed:
+            self.response_cache.put(cache_key, response)
+        elif not succeeded and replayed:
+            print("🗑️ Evicting cached completion whose actions failed")
+            self.response_cache.discard(cache_key)
+
+    def _record_step_response(self, response: dict[str, Any]) -> None:
+        """Add a step's assistant response to history."""
         assistant_msg = response.get("choices", [{}])[0].get("message", {})
         msg = {
             "role": "assistant",
@@ -297,8 +955,152 @@ class EcommerceAgent:
             msg["tool_calls"] = assistant_msg["tool_calls"]
         self.messages.append(msg)
 
+    def _prefetch_step(
+        self,
+        todo_id: str,
+        step: str,
+        system_prompt: str,
+        current_response: dict[str, Any],
+    ) -> StepPrefetch:
+        """
+        Speculatively request the next step's completion.
+
+        The current step's tool results are not known yet, so they are sent
+        as placeholders. Nothing is added to history until the prefetch is used.
+        """
+        tree_summary = self._summarize_tree_for_step()
+        user_message = self._step_user_message(step, tree_summary)
+        history = self.messages + placeholder_tool_messages(current_response) + [user_message]
+        messages = [{"role": "system", "content": system_prompt}] + self._trim_messages(STEP_HISTORY_TOKENS, history)
+
+        task = asyncio.create_task(self.openai.chat_completion(
+            messages=messages,
+            tools=AGENT_TOOLS,
+            temperature=0.7,
+        ))
+        return StepPrefetch(todo_id, user_message, tree_summary, len(self.patches), task)
+
+    async def _use_prefetch(self, prefetch: StepPrefetch) -> Optional[dict[str, Any]]:
+        """
+        Validate a prefetched completion against what the previous step changed.
+
+        Returns:
+            The response (recorded in history), or None if it must be re-issued
+        """
+        changed = changed_keys_from_patches(self.patches[prefetch.patch_start:])
+        if self._summarize_tree_for_step() != prefetch.tree_summary:
+            # Components were added or removed since the speculative call
+            prefetch.cancel()
+            return None
+
+        try:
+            response = await prefetch.task
+        except Exception as e:
+            print(f"⚠️ Prefetched step failed, re-issuing: {e}")
+            return None
+
+        if response_conflicts(response, changed):
+            print(f"🔁 Prefetched step references changed keys {sorted(changed)}, re-issuing")
+            return None
+
+        self.messages.append(prefetch.user_message)
+        self._record_step_response(response)
         return response
 
+    async def _execute_step_streaming(
+        self,
+        step: str,
+        system_prompt: str,
+        response: dict[str, Any],
+    ) -> AsyncIterator[CustomizeEvent]:
+        """
+        Execute a single step with a streamed completion.
+
+        Each tool call is dispatched as soon as its arguments are complete,
+        so patches reach the client while later calls are still generated.
+        The assembled response is written into `response` for the caller.
+        """
+        messages = self._build_step_messages(step, system_prompt)
+
+        accumulator = ToolCallAccumulator()
+        scheduler = ToolCallScheduler(self.max_concurrent_tools)
+        pending: list[PendingToolCall] = []
+        tool_messages: list[dict[str, Any]] = []
+        reported = 0
+
+        stream = self.openai.chat_completion_stream(
+            messages=messages,
+            tools=AGENT_TOOLS,
+            temperature=0.7,
+        )
+        next_chunk = asyncio.ensure_future(anext(stream))
+
+        try:
+            while True:
+                # Wake up on the next chunk or when the oldest unreported call finishes
+                waiting = {next_chunk}
+                if reported < len(pending) and not self._is_finished(pending[reported]):
+                    waiting.add(pending[reported][3])
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                # Report calls that already finished, keeping call order
+                while reported < len(pending) and self._is_finished(pending[reported]):
+                    async for event in self._report_tool_call(pending[reported], tool_messages):
+                        yield event
+                    reported += 1
+
+                if not next_chunk.done():
+                    continue
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+
+                for call in accumulator.add_chunk(chunk):
+                    pending.append(self._dispatch_tool_call(call, scheduler))
+                next_chunk = asyncio.ensure_future(anext(stream))
+
+            for call in accumulator.finish():
+                pending.append(self._dispatch_tool_call(call, scheduler))
+
+            while reported < len(pending):
+                async for event in self._report_tool_call(pending[reported], tool_messages):
+                    yield event
+                reported += 1
+        finally:
+            next_chunk.cancel()
+            self._cancel_pending(pending)
+
+            # Only keep tool calls that have a tool response in history
+            assistant_msg = accumulator.to_message(max_tool_calls=reported)
+            self.messages.append(assistant_msg)
+            self.messages.extend(tool_messages)
+
+            response["choices"] = [{
+                "message": assistant_msg,
+                "finish_reason": accumulator.finish_reason,
+            }]
+
+    def _build_step_messages(self, step: str, system_prompt: str) -> list[dict[str, Any]]:
+        """Record the step request in history and build the messages to send."""
+        # Summarize tree (just keys and types, not full props)
+        tree_summary = self._summarize_tree_for_step()
+        
+        # Add user message to history (keep it short)
+        self.messages.append(self._step_user_message(step, tree_summary))
+        
+        # Trim history to the step budget
+        trimmed_messages = self._trim_messages(STEP_HISTORY_TOKENS)
+        return [{"role": "system", "content": system_prompt}] + trimmed_messages
+
+    @staticmethod
+    def _step_user_message(step: str, tree_summary: str) -> dict[str, Any]:
+        """Build the user message that requests a step."""
+        return {
+            "role": "user",
+            "content": f"Execute: {step}\n\nTree keys: {tree_summary}"
+        }
+
     def _summarize_tree_for_step(self) -> str:
         """Create a compact tree summary for step execution."""
         elements = self.tree.elements
@@ -315,143 +1117,242 @@ class EcommerceAgent:
             lines.append(f"{t}: {', '.join(keys[:10])}" + (f"... +{len(keys)-10}" if len(keys) > 10 else ""))
         return "\n".join(lines)
 
-    def _trim_messages(self, max_messages: int = 20) -> list[dict[str, Any]]:
-        """Trim conversation history to avoid token limits.
+    def _trim_messages(
+        self,
+        max_tokens: int = STEP_HISTORY_TOKENS,
+        messages: Optional[list[dict[str, Any]]] = None,
+    ) -> list[dict[str, Any]]:
+        """Trim conversation history to a token budget, keeping the most recent turns.
         
         IMPORTANT: Must keep tool call sequences together - an assistant message
-        with tool_calls MUST be followed by all its tool responses.
+        with tool_calls MUST be followed by all its tool responses. The history
+        is walked once from the end in units (a single message, or an assistant
+        message with its tool results), so trimming is O(n).
+
+        Trims `messages` if given, otherwise the agent's history. The most
+        recent unit is always kept, even if it exceeds the budget. The session
+        memory message is outside the budget and always kept first: it stands
+        in for everything compacted, so dropping it would lose the most.
         """
-        if len(self.messages) <= max_messages:
-            return self.messages
-        
-        # Find safe trim point - don't cut inside a tool call sequence
-        # Start from the end and find where we can safely cut
-        messages_to_keep = []
-        pending_tool_ids: set[str] = set()
-        
-        for msg in reversed(self.messages):
-            # Add message
-            messages_to_keep.insert(0, msg)
-            
-            # Track tool responses we've seen
+        if messages is None:
+            messages = self.messages
+
+        memory: list[dict[str, Any]] = []
+        if messages and self.memory_message is not None and messages[0] is self.memory_message:
+            memory = [messages[0]]
+            messages = messages[1:]
+
+        kept: list[dict[str, Any]] = []  # Reversed
+        unit: list[dict[str, Any]] = []  # Reversed, current tool call sequence
+        unit_tokens = 0
+        used_tokens = 0
+
+        for msg in reversed(messages):
+            tokens = self.token_counter.count(msg)
+
             if msg.get("role") == "tool":
-                pending_tool_ids.add(msg.get("tool_call_id", ""))
-            
-            # When we see an assistant with tool_calls, remove those IDs from pending
-            if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                for tc in msg["tool_calls"]:
-                    pending_tool_ids.discard(tc.get("id", ""))
-            
-            # Once we have enough messages AND no pending tool calls, we can stop
-            if len(messages_to_keep) >= max_messages and not pending_tool_ids:
+                unit.append(msg)
+                unit_tokens += tokens
+                continue
+
+            if unit and not (msg.get("role") == "assistant" and msg.get("tool_calls")):
+                # Tool responses without their assistant message - drop them
+                unit = []
+                unit_tokens = 0
+
+            unit.append(msg)
+            unit_tokens += tokens
+
+            if kept and used_tokens + unit_tokens > max_tokens:
                 break
-        
-        # If we still have messages but no clean break, just return recent ones
-        if len(messages_to_keep) > max_messages * 2:
-            # Too many - just keep the last max_messages, removing any orphaned tool messages
-            messages_to_keep = messages_to_keep[-max_messages:]
-            # Filter out tool messages without a preceding assistant message
-            clean_messages = []
-            for msg in messages_to_keep:
-                if msg.get("role") == "tool":
-                    # Only keep if we have a matching assistant message
-                    continue  # Skip orphaned tool messages
-                clean_messages.append(msg)
-            messages_to_keep = clean_messages
-        
-        return messages_to_keep
+
+            kept.extend(unit)
+            used_tokens += unit_tokens
+            unit = []
+            unit_tokens = 0
+
+        # Keep the per-message token cache bounded to the live history
+        if len(self.token_counter) > 2 * len(self.messages) + 64:
+            self.token_counter.prune(self.messages)
+
+        kept.reverse()
+        return memory + kept
 
     async def _process_tool_calls(
         self,
         response: dict[str, Any],
     ) -> AsyncIterator[CustomizeEvent]:
-        """Process tool calls from GPT-4o response and add results to history."""
+        """
+        Process tool calls from GPT-4o response and add results to history.
+
+        Independent calls run concurrently (see ToolCallScheduler); tool
+        messages and patch events are still emitted in the original call order.
+        """
         message = response.get("choices", [{}])[0].get("message", {})
         tool_calls = message.get("tool_calls") or []  # Handle None case
 
-        # Create action context
-        ctx = ActionContext(
+        scheduler = ToolCallScheduler(self.max_concurrent_tools)
+        pending = [self._dispatch_tool_call(call, scheduler) for call in tool_calls]
+
+        try:
+            for item in pending:
+                async for event in self._report_tool_call(item, self.messages):
+                    yield event
+        finally:
+            self._cancel_pending(pending)
+
+    def _dispatch_tool_call(
+        self,
+        call: dict[str, Any],
+        scheduler: ToolCallScheduler,
+    ) -> PendingToolCall:
+        """Parse a tool call and submit it to the scheduler if it is executable."""
+        function_name = call.get("function", {}).get("name")
+        arguments = call.get("function", {}).get("arguments", "{}")
+        call_id = call.get("id", "")
+
+        try:
+            params = json.loads(arguments)
+        except json.JSONDecodeError:
+            return (function_name, call_id, None, None)
+        if not isinstance(params, dict):
+            # e.g. "[]" or "null": reported as invalid arguments
+            return (function_name, call_id, None, None)
+
+        if function_name in SKIPPED_TOOLS:
+            return (function_name, call_id, params, None)
+
+        keys = get_tool_call_keys(function_name, params)
+        task = scheduler.submit(keys, self._make_action_runner(function_name, params))
+        return (function_name, call_id, params, task)
+
+    async def _report_tool_call(
+        self,
+        pending: PendingToolCall,
+        tool_messages: list[dict[str, Any]],
+    ) -> AsyncIterator[CustomizeEvent]:
+        """Wait for a dispatched call, record its tool message and yield its events."""
+        function_name, call_id, params, task = pending
+
+        if params is None:
+            # Add error to history
+            tool_messages.append({
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": json.dumps({"error": f"Invalid JSON arguments for {function_name}"}),
+            })
+            self._step_errors.append(f"Invalid arguments for {function_name}")
+            yield CustomizeEvent(
+                type="error",
+                message=f"Invalid arguments for {function_name}",
+            )
+            return
+
+        if task is None:
+            tool_messages.append({
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": json.dumps({"status": SKIPPED_TOOLS[function_name]}),
+            })
+            return
+
+        result, error, patches, changes = await task
+
+        if error is None:
+            # Add tool result to conversation history (truncate large values)
+            tool_message = {
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": self._truncate_result(result),
+            }
+            tool_messages.append(tool_message)
+            self._step_tool_messages.append(tool_message)
+
+            self._step_changes.merge(changes)
+            for event in self._patch_events(patches):
+                yield event
+
+            # Yield theme update if changed
+            if function_name == "apply_theme":
+                yield CustomizeEvent(type="theme_update", theme=self.theme)
+        else:
+            # Add error to history - MUST respond to every tool_call_id
+            tool_messages.append({
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": json.dumps({"error": error}),
+            })
+            self._step_errors.append(f"Action {function_name} failed: {error}")
+            yield CustomizeEvent(
+                type="error",
+                message=f"Action {function_name} failed: {error}",
+            )
+
+    @staticmethod
+    def _is_finished(pending: PendingToolCall) -> bool:
+        """Check whether a dispatched call can be reported without waiting."""
+        task = pending[3]
+        return task is None or task.done()
+
+    @staticmethod
+    def _cancel_pending(pending: list[PendingToolCall]) -> None:
+        """Cancel dispatched calls that have not finished yet."""
+        for _, _, _, task in pending:
+            if task and not task.done():
+                task.cancel()
+
+    def _make_action_context(self) -> ActionContext:
+        """Create an action context bound to this agent's tree and theme."""
+        return ActionContext(
             tree=self.tree,
             theme=self.theme,
-            on_patch=lambda p: self.patches.append(p),
             on_theme_change=lambda t: self._handle_theme_change(t),
             generate_image_fn=self._generate_image,
             edit_image_fn=self._edit_image,
         )
 
-        for call in tool_calls:
-            function_name = call.get("function", {}).get("name")
-            arguments = call.get("function", {}).get("arguments", "{}")
-            call_id = call.get("id", "")
-
-            try:
-                params = json.loads(arguments)
-            except json.JSONDecodeError:
-                # Add error to history
-                self.messages.append({
-                    "role": "tool",
-                    "tool_call_id": call_id,
-                    "content": json.dumps({"error": f"Invalid JSON arguments for {function_name}"}),
-                })
-                yield CustomizeEvent(
-                    type="error",
-                    message=f"Invalid arguments for {function_name}",
-                )
-                continue
+    def _make_action_runner(self, function_name: str, params: dict[str, Any]):
+        """
+        Build a coroutine factory that executes one action.
 
-            # Skip create_plan (already handled)
-            if function_name == "create_plan":
-                self.messages.append({
-                    "role": "tool",
-                    "tool_call_id": call_id,
-                    "content": json.dumps({"status": "plan already processed"}),
-                })
-                continue
+        The coroutine never raises for action failures; it returns
+        (result, error_message, patches, changes) so results can be reported
+        in order. A failed action's partial tree changes are reverted (and
+        its patches dropped), so actions apply all or nothing.
+        """
+        async def run() -> tuple[Optional[dict[str, Any]], Optional[str], list[PatchOperation], ChangeSet]:
+            # Each call gets its own context so patches don't interleave
+            ctx = self._make_action_context()
+            changes = ChangeSet(function_name)
+            theme = self.theme
+            with journal_changes(self.tree.elements) as before:
+                try:
+                    print(f"🔧 Executing action: {function_name} with params: {str(params)[:200]}")
+                    result = await execute_action(function_name, params, ctx)
+                    print(f"✅ Action {function_name} completed: {str(result)[:100]}")
+                    changes.record(before, self.tree)
+                    if self.theme is not theme:
+                        changes.record_theme(theme, self.theme)
+                    return result, None, list(ctx.patches), changes
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"❌ Action {function_name} failed: {error_msg}")
+                    changes.record(before, self.tree)
+                    changes.revert(self.tree, strict=False)
+                    self.theme = theme
+                    return None, error_msg, [], ChangeSet(function_name)
 
-            # Skip capture_screenshot and validate_changes (handled separately in verification)
-            if function_name in ("capture_screenshot", "validate_changes"):
-                self.messages.append({
-                    "role": "tool",
-                    "tool_call_id": call_id,
-                    "content": json.dumps({"status": "will be executed in verification phase"}),
-                })
-                continue
+        return run
 
-            try:
-                # Execute the action
-                print(f"🔧 Executing action: {function_name} with params: {str(params)[:200]}")
-                result = await execute_action(function_name, params, ctx)
-                print(f"✅ Action {function_name} completed: {str(result)[:100]}")
-                
-                # Add tool result to conversation history (truncate large values)
-                self.messages.append({
-                    "role": "tool",
-                    "tool_call_id": call_id,
-                    "content": self._truncate_result(result),
-                })
-
-                # Yield patches
-                for patch in ctx.patches:
-                    yield CustomizeEvent(type="patch", patch=patch)
-                ctx.patches.clear()
-
-                # Yield theme update if changed
-                if function_name == "apply_theme":
-                    yield CustomizeEvent(type="theme_update", theme=self.theme)
-
-            except Exception as e:
-                error_msg = str(e)
-                print(f"❌ Action {function_name} failed: {error_msg}")
-                # Add error to history - MUST respond to every tool_call_id
-                self.messages.append({
-                    "role": "tool",
-                    "tool_call_id": call_id,
-                    "content": json.dumps({"error": error_msg}),
-                })
-                yield CustomizeEvent(
-                    type="error",
-                    message=f"Action {function_name} failed: {error_msg}",
-                )
+    async def _diff_screenshots(self, before: str | bytes, after: str | bytes) -> Optional[ScreenshotDiff]:
+        """Compare two screenshots off the event loop; None if they can't be decoded."""
+        try:
+            diff = await asyncio.to_thread(compare_screenshots, before, after)
+        except Exception as e:
+            print(f"⚠️ Screenshot diff failed: {e}")
+            return None
+        print(f"🖼️ Screenshot diff: {diff.to_dict()}")
+        return diff
 
     def _handle_theme_change(self, theme: dict[str, Any]):
         """Handle theme change."""
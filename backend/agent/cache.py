@@ -0,0 +1,251 @@
+"""
+Replay cache for planning and step completions.
+
+Many storefronts send the same prompts against identical trees. Responses
+are cached by normalized prompt + tree fingerprint + theme + tool schema
+version; on a hit the recorded tool calls are replayed through
+execute_action without contacting OpenAI.
+
+Persisted entries go to an append-only JSON lines log, written in a worker
+thread; the log is rewritten compactly once it has grown to a few times
+the number of live entries.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from models.ui_tree import UITree
+from .tools import AGENT_TOOLS_JSON
+
+
+# Changes whenever the tool definitions change, invalidating old entries
+TOOL_SCHEMA_VERSION = hashlib.sha256(AGENT_TOOLS_JSON.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so trivial differences share a cache entry."""
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return prompt.rstrip(".!?")
+
+
+def fingerprint(value: Any) -> str:
+    """Content hash of a JSON-serializable value."""
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def tree_fingerprint(tree: UITree) -> str:
+    """Content hash of a UI tree (cached by the tree until it changes)."""
+    return tree.content_digest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of completion responses with optional JSON lines persistence."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 24 * 60 * 60,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = Path(path) if path else None
+        # key -> (stored_at, response JSON)
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Log lines waiting to be written (or a compacted log replacing the file)
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+        self._rewrite: Optional[list[str]] = None
+        self._writing = False
+        self._log_lines = 0
+        self._load()
+
+    def make_key(
+        self,
+        kind: str,
+        prompt: str,
+        tree: UITree,
+        theme: Optional[dict[str, Any]],
+    ) -> str:
+        """
+        Build a cache key.
+
+        Args:
+            kind: Which call is cached ("plan", "fast_plan", "step")
+            prompt: User prompt or step description
+            tree: Tree the call was made against
+            theme: Current theme
+        """
+        return fingerprint([
+            kind,
+            normalize_prompt(prompt),
+            tree_fingerprint(tree),
+            fingerprint(theme or {}),
+            TOOL_SCHEMA_VERSION,
+        ])
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        """Get a fresh copy of a cached response, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, data = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return json.loads(data)
+
+    def put(self, key: str, response: dict[str, Any]) -> None:
+        """Cache the assistant message of a response."""
+        if self.max_entries <= 0:
+            return
+
+        message = response.get("choices", [{}])[0].get("message", {})
+        if not message.get("tool_calls"):
+            # Nothing to replay
+            return
+
+        record = {"choices": [{"message": {
+            "role": "assistant",
+            "content": message.get("content"),
+            "tool_calls": message["tool_calls"],
+        }}]}
+        stored_at, data = time.time(), json.dumps(record)
+        self._entries[key] = (stored_at, data)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        if self._log_lines >= 2 * self.max_entries + 64:
+            self._save(rewrite=True)
+        else:
+            self._save([json.dumps([key, stored_at, data])])
+
+    def discard(self, key: str) -> None:
+        """Remove an entry (e.g. a response whose actions failed)."""
+        if self._entries.pop(key, None) is not None:
+            self._save(rewrite=True)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+        self._save(rewrite=True)
+
+    def stats(self) -> dict[str, Any]:
+        """Get hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits / lookups) if lookups else 0,
+        }
+
+    def _load(self) -> None:
+        """Load persisted entries (later lines win), dropping expired ones."""
+        if not self.path or not self.path.exists():
+            return
+        try:
+            text = self.path.read_text()
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Failed to load response cache: {e}")
+            return
+
+        now = time.time()
+        for key, stored_at, data in records:
+            if now - stored_at <= self.ttl_seconds:
+                self._entries[key] = (stored_at, data)
+                self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        self._log_lines = len(records)
+        if self._log_lines > len(self._entries):
+            self._save(rewrite=True)
+
+    def _save(self, lines: Optional[list[str]] = None, rewrite: bool = False) -> None:
+        """
+        Queue log lines to append, or a compact rewrite of the whole log.
+
+        Writes happen in a worker thread when called from the event loop
+        (inline otherwise); one writer at a time drains the queue.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if rewrite:
+                self._rewrite = [json.dumps([k, t, d]) for k, (t, d) in self._entries.items()]
+                self._pending = []
+                self._log_lines = len(self._rewrite)
+            else:
+                self._pending.extend(lines or [])
+                self._log_lines += len(lines or [])
+            if self._writing:
+                return
+            self._writing = True
+
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write_pending)
+        except RuntimeError:
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Write queued log lines until none are left."""
+        while True:
+            with self._lock:
+                rewrite, lines = self._rewrite, self._pending
+                self._rewrite, self._pending = None, []
+                if rewrite is None and not lines:
+                    self._writing = False
+                    return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if rewrite is not None:
+                    tmp = self.path.with_suffix(".tmp")
+                    tmp.write_text("".join(line + "\n" for line in rewrite + lines))
+                    tmp.replace(self.path)
+                else:
+                    with self.path.open("a") as f:
+                        f.write("".join(line + "\n" for line in lines))
+            except OSError as e:
+                print(f"⚠️ Failed to save response cache: {e}")
+
+
+# Singleton instance
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Get or create the response cache singleton (configured from env)."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60))),
+            path=os.getenv("RESPONSE_CACHE_PATH") or None,
+        )
+    return _response_cache
@@ -0,0 +1,154 @@
+"""
+Session memory for long-lived conversations.
+
+Older turns of a session are folded into a compact record (earlier requests,
+components changed, current palette, what "it" last referred to) and the raw
+messages are dropped, so history size stays flat however many prompts a
+merchant sends.
+"""
+import json
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .scheduler import KEY_PARAMS
+
+
+# Prefix of the user message that starts each request in history
+REQUEST_PREFIX = "Customize this e-commerce app: "
+
+# Bounds on what the memory keeps
+MAX_REQUESTS = 5
+MAX_COMPONENTS = 30
+
+
+class SessionMemory:
+    """Compact summary of compacted conversation turns."""
+
+    def __init__(self):
+        self.requests: list[str] = []
+        # component key -> {"actions": [...], "props": [...]}, most recent last
+        self.components: OrderedDict[str, dict[str, list[str]]] = OrderedDict()
+        self.last_referenced: list[str] = []
+        self.palette: Optional[dict[str, Any]] = None
+        self.theme_name: Optional[str] = None
+        self.compacted_messages = 0
+
+    def absorb(self, messages: list[dict[str, Any]], theme: Optional[dict[str, Any]] = None) -> None:
+        """
+        Fold messages that are about to be dropped into the memory.
+
+        Args:
+            messages: Raw messages being compacted (whole turns, oldest first)
+            theme: The agent's current theme
+        """
+        turn_keys: list[str] = []
+
+        for msg in messages:
+            role = msg.get("role")
+            content = msg.get("content")
+
+            if role == "user" and isinstance(content, str) and content.startswith(REQUEST_PREFIX):
+                prompt = content[len(REQUEST_PREFIX):].split("\n", 1)[0].strip()
+                self.requests = (self.requests + [prompt])[-MAX_REQUESTS:]
+                if turn_keys:
+                    self.last_referenced = turn_keys
+                turn_keys = []
+
+            elif role == "assistant":
+                for call in msg.get("tool_calls") or []:
+                    for key in self._record_call(call):
+                        if key not in turn_keys:
+                            turn_keys.append(key)
+
+            self.compacted_messages += 1
+
+        if turn_keys:
+            self.last_referenced = turn_keys
+
+        if theme:
+            self.palette = theme.get("palette") or self.palette
+            self.theme_name = theme.get("name") or self.theme_name
+
+    def _record_call(self, call: dict[str, Any]) -> list[str]:
+        """Record one tool call; returns the component keys it touched."""
+        function = call.get("function", {})
+        name = function.get("name", "")
+        if name in ("create_plan", "capture_screenshot", "validate_changes"):
+            return []
+
+        try:
+            params = json.loads(function.get("arguments") or "{}")
+        except json.JSONDecodeError:
+            return []
+        if not isinstance(params, dict):
+            return []
+
+        keys = [params[p] for p in KEY_PARAMS if isinstance(params.get(p), str)]
+        keys += [k for k in params.get("targetComponents") or [] if isinstance(k, str)]
+
+        for key in keys:
+            entry = self.components.pop(key, None) or {"actions": [], "props": []}
+            if name not in entry["actions"]:
+                entry["actions"].append(name)
+            for prop in (params.get("props") or {}):
+                if prop not in entry["props"]:
+                    entry["props"].append(prop)
+            self.components[key] = entry
+
+        while len(self.components) > MAX_COMPONENTS:
+            self.components.popitem(last=False)
+
+        return keys
+
+    def is_empty(self) -> bool:
+        """Check whether anything has been compacted yet."""
+        return self.compacted_messages == 0
+
+    def to_message(self) -> dict[str, Any]:
+        """Render the memory as a system message for the conversation history."""
+        lines = ["Session memory (summary of earlier requests in this session):"]
+
+        if self.requests:
+            lines.append("- Earlier requests: " + "; ".join(f'"{r}"' for r in self.requests))
+        if self.components:
+            changed = []
+            for key, entry in reversed(self.components.items()):
+                detail = ", ".join(entry["actions"])
+                if entry["props"]:
+                    detail += f": {', '.join(entry['props'])}"
+                changed.append(f"{key} ({detail})")
+            lines.append("- Components changed (most recent first): " + "; ".join(changed))
+        if self.theme_name:
+            lines.append(f"- Current theme: {self.theme_name}")
+        if self.palette:
+            lines.append("- Current palette: " + ", ".join(f"{k} {v}" for k, v in self.palette.items()))
+        if self.last_referenced:
+            lines.append(
+                '- Most recently changed (what "it"/"that" likely refers to): '
+                + ", ".join(self.last_referenced)
+            )
+
+        return {"role": "system", "content": "\n".join(lines)}
+
+    def to_dict(self) -> dict[str, Any]:
+        """Serialize the memory."""
+        return {
+            "requests": self.requests,
+            "components": [[k, v] for k, v in self.components.items()],
+            "last_referenced": self.last_referenced,
+            "palette": self.palette,
+            "theme_name": self.theme_name,
+            "compacted_messages": self.compacted_messages,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SessionMemory":
+        """Restore a memory serialized with to_dict."""
+        memory = cls()
+        memory.requests = data.get("requests", [])
+        memory.components = OrderedDict((k, v) for k, v in data.get("components", []))
+        memory.last_referenced = data.get("last_referenced", [])
+        memory.palette = data.get("palette")
+        memory.theme_name = data.get("theme_name")
+        memory.compacted_messages = data.get("compacted_messages", 0)
+        return memory
@@ -0,0 +1,208 @@
+"""
+Undoable tree changes.
+
+Actions change the tree by storing new element objects (elements are never
+changed in place), so a change set only keeps the element before and after
+for each changed key. Rolling back a failed step or undoing a request puts
+the old objects back, which costs O(changed elements) rather than O(tree
+size); the patches sent to clients are diffs of just those elements.
+Theme changes are kept alongside, as the theme before and after.
+
+The log lives in memory with the session's agent and is not persisted.
+"""
+import os
+from collections import deque
+from typing import Any, Optional
+
+from models.ui_tree import UITree, UIElement
+from models.requests import PatchOperation
+from models.json_patch import diff, join_pointer
+
+
+# Requests kept for /api/undo per session
+MAX_UNDO_STEPS = int(os.getenv("MAX_UNDO_STEPS", "20"))
+
+
+class UndoConflictError(Exception):
+    """The tree changed since a change set was recorded, so it can't be reverted cleanly."""
+
+
+class ChangeSet:
+    """Elements before and after a group of changes (None: not in the tree)."""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.before: dict[str, Optional[UIElement]] = {}
+        self.after: dict[str, Optional[UIElement]] = {}
+        # (theme before, theme after), if the changes include a theme change
+        self.theme_change: Optional[tuple[dict[str, Any], dict[str, Any]]] = None
+
+    def __bool__(self) -> bool:
+        if self.theme_change is not None and self.theme_change[0] != self.theme_change[1]:
+            return True
+        return any(self.before[key] is not element for key, element in self.after.items())
+
+    def record_theme(self, before: dict[str, Any], after: dict[str, Any]) -> None:
+        """Add a theme change."""
+        if self.theme_change is not None:
+            before = self.theme_change[0]
+        self.theme_change = (before, after)
+
+    def record(self, before: dict[str, Optional[UIElement]], tree: UITree) -> None:
+        """
+        Add changes journaled by journal_changes (see models/tree_index.py).
+
+        Args:
+            before: Key -> element before the changes
+            tree: Tree the changes were made to
+        """
+        for key, element in before.items():
+            self.before.setdefault(key, element)
+            self.after[key] = tree.elements.get(key)
+
+    def merge(self, other: "ChangeSet") -> None:
+        """Append a later change set."""
+        for key, element in other.after.items():
+            self.before.setdefault(key, other.before[key])
+            self.after[key] = element
+        if other.theme_change is not None:
+            self.record_theme(*other.theme_change)
+
+    def revert(self, tree: UITree, strict: bool = True) -> list[PatchOperation]:
+        """
+        Put the elements back as they were before the changes.
+
+        Args:
+            tree: Tree to restore (modified in place)
+            strict: Raise if an element changed since; otherwise leave it as is
+
+        Returns:
+            Patches taking a client's tree from after to before
+
+        Raises:
+            UndoConflictError: If strict and the tree changed since
+        """
+        return _restore(tree, self.after, self.before, strict)
+
+    def reapply(self, tree: UITree, strict: bool = True) -> list[PatchOperation]:
+        """Redo reverted changes (same arguments and return value as revert)."""
+        return _restore(tree, self.before, self.after, strict)
+
+
+class OperationLog:
+    """Per-session undo and redo stacks of request change sets."""
+
+    def __init__(self, max_entries: int = MAX_UNDO_STEPS):
+        self._undo: deque[ChangeSet] = deque(maxlen=max_entries)
+        self._redo: list[ChangeSet] = []
+
+    def push(self, changes: ChangeSet) -> None:
+        """Record a new change set (empty ones are ignored); clears redo."""
+        if not changes:
+            return
+        self._undo.append(changes)
+        self._redo.clear()
+
+    def undo(
+        self,
+        tree: UITree,
+        theme: Optional[dict[str, Any]] = None,
+    ) -> Optional[tuple[ChangeSet, list[PatchOperation]]]:
+        """
+        Revert the latest change set's elements.
+
+        The caller restores the theme (from theme_change) on success.
+
+        Args:
+            tree: Tree to restore (modified in place)
+            theme: Current theme, checked against the change set's
+
+        Returns:
+            (change set, patches), or None if there is nothing to undo
+
+        Raises:
+            UndoConflictError: If the tree or theme changed since (the entry is kept)
+        """
+        if not self._undo:
+            return None
+        _check_theme(self._undo[-1], theme, after=True)
+        patches = self._undo[-1].revert(tree)
+        changes = self._undo.pop()
+        self._redo.append(changes)
+        return changes, patches
+
+    def redo(
+        self,
+        tree: UITree,
+        theme: Optional[dict[str, Any]] = None,
+    ) -> Optional[tuple[ChangeSet, list[PatchOperation]]]:
+        """Reapply the latest undone change set (see undo)."""
+        if not self._redo:
+            return None
+        _check_theme(self._redo[-1], theme, after=False)
+        patches = self._redo[-1].reapply(tree)
+        changes = self._redo.pop()
+        self._undo.append(changes)
+        return changes, patches
+
+    def clear(self) -> None:
+        """Forget everything (the tree was replaced)."""
+        self._undo.clear()
+        self._redo.clear()
+
+    def retained(self, tree: UITree) -> list[UIElement]:
+        """Elements kept alive only by the log."""
+        current = set(map(id, tree.elements.values()))
+        seen: dict[int, UIElement] = {}
+        for changes in [*self._undo, *self._redo]:
+            for element in [*changes.before.values(), *changes.after.values()]:
+                if element is not None and id(element) not in current:
+                    seen[id(element)] = element
+        return list(seen.values())
+
+    def stats(self) -> dict[str, Any]:
+        """Undo and redo depths."""
+        return {"undo": len(self._undo), "redo": len(self._redo)}
+
+
+def _check_theme(changes: ChangeSet, theme: Optional[dict[str, Any]], after: bool) -> None:
+    """Raise if the theme isn't what the change set left (after) or started from."""
+    if changes.theme_change is None:
+        return
+    expected = changes.theme_change[1 if after else 0]
+    if theme != expected:
+        raise UndoConflictError("Theme changed since")
+
+
+def _restore(
+    tree: UITree,
+    expected: dict[str, Optional[UIElement]],
+    target: dict[str, Optional[UIElement]],
+    strict: bool,
+) -> list[PatchOperation]:
+    """Replace elements that are still `expected` with `target`; returns the patches."""
+    conflicts = {key for key, element in expected.items() if tree.elements.get(key) is not element}
+    if conflicts and strict:
+        raise UndoConflictError(f"Components changed since: {', '.join(sorted(conflicts))}")
+
+    added: list[PatchOperation] = []
+    changed: list[PatchOperation] = []
+    removed: list[PatchOperation] = []
+    for key, element in target.items():
+        current = expected[key]
+        if element is current or key in conflicts:
+            continue
+        path = join_pointer("elements", key)
+        if element is None:
+            del tree.elements[key]
+            removed.append(PatchOperation(op="remove", path=path))
+        elif current is None:
+            tree.elements[key] = element
+            added.append(PatchOperation(op="add", path=path, value=element.model_dump()))
+        else:
+            tree.elements[key] = element
+            for op, op_path, value in diff(current.model_dump(), element.model_dump(), path):
+                changed.append(PatchOperation(op=op, path=op_path, value=value))
+
+    # Elements exist before anything refers to them, and go after nothing does
+    return added + changed + removed
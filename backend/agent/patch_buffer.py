@@ -0,0 +1,129 @@
+"""
+Patch coalescing for batched patch events.
+
+Clients that opt in (CustomizeRequest.patch_batching) receive patch_batch
+events instead of one patch event per operation. Patches are buffered
+until a flush boundary, and successive ops on the same path are merged:
+
+- tool: after each tool call's patches
+- step: before the next event that depends on the client's tree (todo
+  updates, screenshot requests, completion), i.e. about once per step
+- time: once the oldest buffered patch is interval seconds old, and at
+  step boundaries
+"""
+import os
+import time
+from typing import Optional
+
+from models.requests import PatchOperation
+
+
+PATCH_BATCHING_MODES = ("tool", "step", "time")
+
+DEFAULT_BATCH_INTERVAL = float(os.getenv("PATCH_BATCH_INTERVAL_MS", "100")) / 1000
+
+# Events that don't depend on the client's tree, so may overtake buffered patches
+PASSTHROUGH_EVENTS = frozenset({"status", "theme_update", "error", "validation_warning", "screenshot_diff"})
+
+# (earlier op, later op) on one path -> the single equivalent op (missing: keep both)
+_MERGED_OPS = {
+    ("add", "add"): "add",
+    ("add", "replace"): "add",
+    ("replace", "add"): "replace",
+    ("replace", "replace"): "replace",
+    ("replace", "remove"): "remove",
+    ("remove", "add"): "replace",
+}
+
+
+class PatchBuffer:
+    """Patches waiting to be sent as one patch_batch event."""
+
+    def __init__(self, mode: str = "step", interval: float = DEFAULT_BATCH_INTERVAL):
+        """
+        Args:
+            mode: Flush boundary ("tool", "step" or "time")
+            interval: Seconds between flushes in time mode
+
+        Raises:
+            ValueError: If mode is unknown
+        """
+        if mode not in PATCH_BATCHING_MODES:
+            raise ValueError(f"Unknown patch batching mode: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self._patches: list[PatchOperation] = []
+        # path -> index of the buffered op a later op on that path can merge into
+        self._mergeable: dict[str, int] = {}
+        self._version: Optional[int] = None
+        self._first_at: Optional[float] = None
+        self.received = 0
+        self.sent = 0
+
+    def __len__(self) -> int:
+        return len(self._patches)
+
+    def add(self, patch: PatchOperation, version: Optional[int] = None) -> None:
+        """
+        Buffer a patch, merging it into an earlier op on the same path.
+
+        Ops are only merged when nothing buffered in between touched the
+        path's ancestors or descendants, so the batch applies to the same
+        result as the individual patches.
+
+        Args:
+            patch: Patch already applied to the server tree
+            version: Tree version after the patch
+        """
+        self.received += 1
+        self._version = version
+        if self._first_at is None:
+            self._first_at = time.monotonic()
+
+        op = "replace" if patch.op == "set" else patch.op
+        if op != patch.op:
+            patch = PatchOperation(op=op, path=patch.path, value=patch.value)
+        tokens = patch.path.split("/")  # still escaped, so no token contains "/"
+
+        if len(tokens) <= 3 or (len(tokens) == 4 and tokens[3] == "props"):
+            # Whole elements and merging props replaces act as barriers
+            self._mergeable.clear()
+            self._patches.append(patch)
+            return
+
+        index = self._mergeable.get(patch.path)
+        if index is not None:
+            merged = _MERGED_OPS.get((self._patches[index].op, op))
+            if merged is not None:
+                self._patches[index] = PatchOperation(op=merged, path=patch.path, value=patch.value)
+                return
+
+        for depth in range(2, len(tokens)):
+            self._mergeable.pop("/".join(tokens[:depth]), None)
+        prefix = patch.path + "/"
+        for path in [p for p in self._mergeable if p.startswith(prefix)]:
+            del self._mergeable[path]
+
+        self._mergeable[patch.path] = len(self._patches)
+        self._patches.append(patch)
+
+    def seconds_until_due(self) -> Optional[float]:
+        """Time left before a time-based flush (None if not time-based or empty)."""
+        if self.mode != "time" or self._first_at is None:
+            return None
+        return max(0.0, self._first_at + self.interval - time.monotonic())
+
+    def drain(self) -> tuple[list[PatchOperation], Optional[int]]:
+        """
+        Take the buffered patches.
+
+        Returns:
+            (merged patches, tree version after the last one)
+        """
+        patches, version = self._patches, self._version
+        self._patches = []
+        self._mergeable.clear()
+        self._version = None
+        self._first_at = None
+        self.sent += len(patches)
+        return patches, version
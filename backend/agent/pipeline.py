@@ -0,0 +1,86 @@
+"""
+Speculative prefetch of the next step's completion.
+
+While step N's actions run (often a multi-second image generation), step
+N+1's completion is requested with placeholder tool results for step N.
+Once step N finishes, the speculative response is only used if it does not
+reference components that step N changed or removed.
+"""
+import asyncio
+import json
+from typing import Any, Optional
+
+from models.requests import PatchOperation
+from .scheduler import get_tool_call_keys
+from .tree_versions import patch_key
+
+
+class StepPrefetch:
+    """A speculative completion for an upcoming step."""
+
+    def __init__(
+        self,
+        todo_id: str,
+        user_message: dict[str, Any],
+        tree_summary: str,
+        patch_start: int,
+        task: asyncio.Task,
+    ):
+        self.todo_id = todo_id
+        self.user_message = user_message  # Step request sent with the speculative call
+        self.tree_summary = tree_summary  # Tree summary the speculative call saw
+        self.patch_start = patch_start  # Index into agent.patches where step N began
+        self.task = task
+
+    def cancel(self) -> None:
+        """Discard the speculative call."""
+        if not self.task.done():
+            self.task.cancel()
+
+
+def changed_keys_from_patches(patches: list[PatchOperation]) -> set[str]:
+    """Get the element keys touched by a list of patches."""
+    keys = set()
+    for patch in patches:
+        key = patch_key(patch)
+        if key is not None:
+            keys.add(key)
+    return keys
+
+
+def response_conflicts(response: dict[str, Any], changed_keys: set[str]) -> bool:
+    """
+    Check whether a speculative response touches any changed component.
+
+    Calls whose footprint is unknown or global (barriers) conflict with
+    any change at all.
+    """
+    if not changed_keys:
+        return False
+
+    message = response.get("choices", [{}])[0].get("message", {})
+    for call in message.get("tool_calls") or []:
+        function_name = call.get("function", {}).get("name")
+        try:
+            params = json.loads(call.get("function", {}).get("arguments", "{}"))
+        except json.JSONDecodeError:
+            return True
+
+        keys: Optional[set[str]] = get_tool_call_keys(function_name, params)
+        if keys is None or keys & changed_keys:
+            return True
+
+    return False
+
+
+def placeholder_tool_messages(response: dict[str, Any]) -> list[dict[str, Any]]:
+    """Tool messages standing in for results of calls that are still running."""
+    message = response.get("choices", [{}])[0].get("message", {})
+    return [
+        {
+            "role": "tool",
+            "tool_call_id": call.get("id", ""),
+            "content": json.dumps({"status": "in progress"}),
+        }
+        for call in message.get("tool_calls") or []
+    ]
@@ -467,3 +467,8 @@ Use `edit_image` when the user wants to MODIFY an existing image (change face, a
 Remember: Every single element can be modified. Use the element keys exactly as listed.
 Every style change is possible through the style object. Be precise with your modifications.
 """
+
+
+# Compiled once at import: every call sends a byte-identical system message,
+# so provider-side prompt caching can reuse the static prefix.
+SYSTEM_PROMPT: str = get_system_prompt(generate_catalog_prompt())
@@ -0,0 +1,115 @@
+"""
+Dependency-aware scheduler for tool calls.
+
+GPT-4o often returns several tool calls in one response. Calls that touch
+disjoint components can run concurrently (e.g. three generate_image calls),
+while calls that share a component key keep their original relative order.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+
+# Default number of tool calls allowed to run at the same time
+DEFAULT_MAX_CONCURRENT_TOOLS = 4
+
+# Params that name the component(s) an action reads or writes
+KEY_PARAMS = ("componentKey", "targetComponent", "parentKey", "newParentKey")
+
+# Actions that restructure the tree or touch global state.
+# These run alone: after everything before them, before everything after them.
+BARRIER_ACTIONS = {
+    "add_component",
+    "remove_component",
+    "reorder_components",
+    "move_component",
+    "create_palette",
+    "validate_design",
+}
+
+
+def get_tool_call_keys(function_name: str, params: dict[str, Any]) -> Optional[set[str]]:
+    """
+    Get the component keys a tool call touches.
+
+    Returns:
+        Set of component keys, or None if the call must run as a barrier
+        (also when params isn't a JSON object)
+    """
+    if function_name in BARRIER_ACTIONS or not isinstance(params, dict):
+        return None
+
+    if function_name == "apply_theme":
+        if params.get("scope", "global") == "global":
+            return None
+        return set(params.get("targetComponents") or [])
+
+    keys = {params[name] for name in KEY_PARAMS if isinstance(params.get(name), str)}
+    if not keys and function_name != "track_event":
+        # Unknown footprint - be safe
+        return None
+    return keys
+
+
+class ToolCallScheduler:
+    """
+    Schedules tool calls as asyncio tasks with key-based dependencies.
+
+    Each call waits for every earlier call it conflicts with, then runs
+    under a shared semaphore. Tasks are returned in the original call order
+    so callers can await them one by one and keep output deterministic.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENT_TOOLS):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._last_by_key: dict[str, asyncio.Task] = {}
+        self._since_barrier: list[asyncio.Task] = []
+        self._last_barrier: Optional[asyncio.Task] = None
+
+    def submit(
+        self,
+        keys: Optional[set[str]],
+        run_fn: Callable[[], Awaitable[Any]],
+    ) -> asyncio.Task:
+        """
+        Start a task for one call, ordered after earlier conflicting calls.
+
+        Args:
+            keys: Component keys the call touches (None = barrier)
+            run_fn: Coroutine factory that executes the call
+
+        Returns:
+            The scheduled task
+        """
+        if keys is None:
+            deps = list(self._since_barrier)
+        else:
+            deps = [self._last_by_key[k] for k in keys if k in self._last_by_key]
+        if self._last_barrier:
+            deps.append(self._last_barrier)
+
+        task = asyncio.create_task(self._run_after(deps, run_fn, self._semaphore))
+
+        if keys is None:
+            self._last_barrier = task
+            self._since_barrier = []
+            self._last_by_key = {}
+        else:
+            self._since_barrier.append(task)
+            for k in keys:
+                self._last_by_key[k] = task
+
+        return task
+
+    @staticmethod
+    async def _run_after(
+        deps: list[asyncio.Task],
+        run_fn: Callable[[], Awaitable[Any]],
+        semaphore: asyncio.Semaphore,
+    ) -> Any:
+        """Wait for dependencies, then run under the concurrency limit."""
+        if deps:
+            # Failures in dependencies are reported by their own tasks
+            await asyncio.gather(*deps, return_exceptions=True)
+        async with semaphore:
+            return await run_fn()
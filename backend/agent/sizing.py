@@ -0,0 +1,49 @@
+"""
+Approximate memory sizing for session state.
+
+Sizes are estimated from the data itself (string and byte lengths plus a
+small per-container overhead) rather than sys.getsizeof, so they track
+what dominates a session in practice: image data URLs in the tree, long
+tool results in the history and accumulated patches.
+"""
+from typing import Any
+
+from pydantic import BaseModel
+
+from .tokens import MessageCounter
+
+
+# Rough per-object overhead for containers and scalars
+CONTAINER_OVERHEAD = 64
+SCALAR_SIZE = 16
+
+
+def deep_size(value: Any) -> int:
+    """Estimate the bytes held by a JSON-like value (dicts, lists, models, strings)."""
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (str, bytes, bytearray, memoryview)):
+            size += len(item)
+        elif isinstance(item, dict):
+            size += CONTAINER_OVERHEAD
+            for key, child in item.items():
+                size += len(key) if isinstance(key, str) else SCALAR_SIZE
+                stack.append(child)
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            size += CONTAINER_OVERHEAD
+            stack.extend(item)
+        elif isinstance(item, BaseModel):
+            size += CONTAINER_OVERHEAD
+            stack.extend(item.__dict__.values())
+        else:
+            size += SCALAR_SIZE
+    return size
+
+
+class SizeCounter(MessageCounter):
+    """Caches per-message size estimates."""
+
+    def __init__(self):
+        super().__init__(deep_size)
@@ -0,0 +1,109 @@
+"""
+Incremental assembly of streamed tool calls.
+
+OpenAI streams tool calls as deltas: the first delta for an index carries the
+id and function name, later deltas append fragments of the arguments JSON.
+The accumulator hands back each tool call as soon as its arguments are
+complete so it can be executed while the model is still generating.
+"""
+import json
+from typing import Any, Optional
+
+
+class ToolCallAccumulator:
+    """Rebuilds an assistant message from chat completion stream chunks."""
+
+    def __init__(self):
+        self.content_parts: list[str] = []
+        self.tool_calls: list[dict[str, Any]] = []
+        self.finish_reason: Optional[str] = None
+        self._released = 0  # Number of tool calls already handed out
+
+    def add_chunk(self, chunk: dict[str, Any]) -> list[dict[str, Any]]:
+        """
+        Apply one stream chunk.
+
+        Args:
+            chunk: A chunk from OpenAIClient.chat_completion_stream
+
+        Returns:
+            Tool calls whose arguments became complete with this chunk
+        """
+        choices = chunk.get("choices") or []
+        if not choices:
+            return []
+
+        choice = choices[0]
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+
+        delta = choice.get("delta") or {}
+        if delta.get("content"):
+            self.content_parts.append(delta["content"])
+
+        for tc_delta in delta.get("tool_calls") or []:
+            index = tc_delta.get("index", len(self.tool_calls))
+            while len(self.tool_calls) <= index:
+                self.tool_calls.append({
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+
+            call = self.tool_calls[index]
+            if tc_delta.get("id"):
+                call["id"] = tc_delta["id"]
+            function = tc_delta.get("function") or {}
+            if function.get("name"):
+                call["function"]["name"] += function["name"]
+            if function.get("arguments"):
+                call["function"]["arguments"] += function["arguments"]
+
+        # A call is complete once a later call has started...
+        ready = max(self._released, len(self.tool_calls) - 1)
+        # ...or once its own arguments parse as a JSON object
+        if ready < len(self.tool_calls) and self._arguments_complete(self.tool_calls[ready]):
+            ready += 1
+
+        return self._release(ready)
+
+    def finish(self) -> list[dict[str, Any]]:
+        """Release every tool call not handed out yet (call when the stream ends)."""
+        return self._release(len(self.tool_calls))
+
+    def to_message(self, max_tool_calls: Optional[int] = None) -> dict[str, Any]:
+        """
+        Build the assistant message in the same shape as a non-streamed response.
+
+        Args:
+            max_tool_calls: Only include the first N tool calls (e.g. when the
+                stream was interrupted and later calls were never answered)
+        """
+        tool_calls = self.tool_calls[:max_tool_calls] if max_tool_calls is not None else self.tool_calls
+        message: dict[str, Any] = {
+            "role": "assistant",
+            "content": "".join(self.content_parts) or None,
+        }
+        # Only include tool_calls if non-empty (OpenAI rejects empty arrays)
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return message
+
+    def _release(self, upto: int) -> list[dict[str, Any]]:
+        """Hand out tool calls in index order up to (not including) upto."""
+        if upto <= self._released:
+            return []
+        released = self.tool_calls[self._released:upto]
+        self._released = upto
+        return released
+
+    @staticmethod
+    def _arguments_complete(call: dict[str, Any]) -> bool:
+        """Check whether a call's accumulated arguments are a full JSON object."""
+        arguments = call["function"]["arguments"].rstrip()
+        if not call["id"] or not arguments.endswith("}"):
+            return False
+        try:
+            return isinstance(json.loads(arguments), dict)
+        except json.JSONDecodeError:
+            return False
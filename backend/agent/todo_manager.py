@@ -122,6 +122,10 @@ class TodoManager:
         """Convert todos to list of dicts for serialization."""
         return [t.model_dump() for t in self.todos]
 
+    def load_dict_list(self, items: list[dict[str, Any]]) -> None:
+        """Restore todos serialized with to_dict_list."""
+        self.todos = [TodoItem(**item) for item in items]
+
     def clear(self) -> None:
         """Clear all todos for a new request."""
         self.todos = []
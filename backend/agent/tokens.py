@@ -0,0 +1,94 @@
+"""
+Local token estimation for conversation trimming.
+
+Uses tiktoken when installed; otherwise falls back to a character-based
+estimate (~4 characters per token), which is close enough for budgeting.
+"""
+import json
+from typing import Any, Callable
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # GPT-4o tokenizer
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+
+# Fixed overhead per message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough cost of an image part in a vision message
+IMAGE_TOKENS = {"low": 85, "high": 1105, "auto": 1105}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a string."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def estimate_message_tokens(message: dict[str, Any]) -> int:
+    """Estimate the number of tokens an OpenAI chat message costs."""
+    tokens = MESSAGE_OVERHEAD_TOKENS
+
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += estimate_tokens(content)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                tokens += estimate_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                detail = (part.get("image_url") or {}).get("detail", "auto")
+                tokens += IMAGE_TOKENS.get(detail, IMAGE_TOKENS["high"])
+
+    for call in message.get("tool_calls") or []:
+        function = call.get("function", {})
+        tokens += estimate_tokens(function.get("name", ""))
+        arguments = function.get("arguments", "")
+        tokens += estimate_tokens(arguments if isinstance(arguments, str) else json.dumps(arguments))
+
+    return tokens
+
+
+class MessageCounter:
+    """
+    Caches a per-message measure (messages are not mutated once added).
+
+    Messages are plain dicts, so entries are keyed by identity and keep a
+    reference to the message to guard against id reuse.
+    """
+
+    def __init__(self, measure: Callable[[dict[str, Any]], int]):
+        self.measure = measure
+        self._cache: dict[int, tuple[dict[str, Any], int]] = {}
+
+    def count(self, message: dict[str, Any]) -> int:
+        """Get the (cached) measure of a message."""
+        entry = self._cache.get(id(message))
+        if entry is not None and entry[0] is message:
+            return entry[1]
+
+        value = self.measure(message)
+        self._cache[id(message)] = (message, value)
+        return value
+
+    def prune(self, live_messages: list[dict[str, Any]]) -> None:
+        """Drop cached entries for messages no longer in the history."""
+        live = {id(m) for m in live_messages}
+        self._cache = {k: v for k, v in self._cache.items() if k in live}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class TokenCounter(MessageCounter):
+    """Caches per-message token estimates."""
+
+    def __init__(self):
+        super().__init__(estimate_message_tokens)
@@ -1,10 +1,35 @@
 """
 Tool definitions for OpenAI function calling.
-Re-exports from catalog.actions for convenience.
+Built from catalog.actions once at import.
 """
+import copy
+import json
+from typing import Any
+
 from catalog.actions import AGENT_ACTIONS, ACTION_SCHEMAS
 
-# Re-export for convenience
-AGENT_TOOLS = AGENT_ACTIONS
 
-__all__ = ["AGENT_TOOLS", "ACTION_SCHEMAS"]
+def _with_step_param(tool: dict) -> dict:
+    """Copy an action tool, adding the optional plan step index used by fast mode."""
+    tool = copy.deepcopy(tool)
+    if tool["function"]["name"] != "create_plan":
+        parameters = tool["function"].setdefault("parameters", {"type": "object", "properties": {}})
+        parameters.setdefault("properties", {})["step"] = {
+            "type": "integer",
+            "description": "Optional: 0-based index of the create_plan step this action implements",
+        }
+    return tool
+
+
+# Tools for every call except fast mode's plan. Immutable tuples, so the
+# tools part of each mode's prompt is identical across calls and stays in
+# OpenAI's prompt cache.
+AGENT_TOOLS: tuple[dict[str, Any], ...] = tuple(copy.deepcopy(tool) for tool in AGENT_ACTIONS)
+
+# Fast mode's plan-with-actions call, whose actions carry the plan `step` they implement
+FAST_AGENT_TOOLS: tuple[dict[str, Any], ...] = tuple(_with_step_param(tool) for tool in AGENT_ACTIONS)
+
+# The definitions serialized once (cache keys)
+AGENT_TOOLS_JSON = json.dumps([AGENT_TOOLS, FAST_AGENT_TOOLS], sort_keys=True, separators=(",", ":"))
+
+__all__ = ["AGENT_TOOLS", "FAST_AGENT_TOOLS", "AGENT_TOOLS_JSON", "ACTION_SCHEMAS"]
@@ -0,0 +1,115 @@
+"""
+Server-authoritative tree versions.
+
+The server's copy of a session's tree gets a new version with every patch
+it streams. Clients send the version they last saw (base_version) plus any
+patches they made locally, instead of the full tree. Local patches made
+against an older version are rebased onto the current tree when they
+touch none of the components the server changed since, and the server
+patches the client missed are sent back to it.
+"""
+from collections import deque
+from typing import Optional
+
+from models.ui_tree import UITree
+from models.requests import PatchOperation
+from models.json_patch import parse_pointer
+
+
+# Server patches remembered for rebasing stale client versions
+MAX_PATCH_LOG = 500
+
+
+class StaleTreeError(Exception):
+    """The client's tree can't be reconciled; it must resend the full tree."""
+
+
+def patch_key(patch: PatchOperation) -> Optional[str]:
+    """Component key a patch touches (from /elements/{key}/...)."""
+    try:
+        parts = parse_pointer(patch.path)
+    except ValueError:
+        return None
+    return parts[1] if len(parts) > 1 and parts[0] == "elements" else None
+
+
+class TreeVersions:
+    """Version counter and recent patch log for one session's tree."""
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        # (version after the patch, patch), oldest first
+        self._log: deque[tuple[int, PatchOperation]] = deque(maxlen=MAX_PATCH_LOG)
+
+    def record(self, patch: PatchOperation) -> int:
+        """Record a server patch; returns the new version."""
+        self.version += 1
+        self._log.append((self.version, patch))
+        return self.version
+
+    def reset(self) -> int:
+        """Start over from a full tree sent by the client; returns the new version."""
+        self.version += 1
+        self._log.clear()
+        return self.version
+
+    def logged_patches(self) -> list[PatchOperation]:
+        """Every patch still in the log, oldest first."""
+        return [patch for _, patch in self._log]
+
+    def patches_since(self, base_version: int) -> Optional[list[PatchOperation]]:
+        """Server patches after base_version, or None if no longer in the log."""
+        if base_version == self.version:
+            return []
+        if base_version > self.version or not self._log or self._log[0][0] > base_version + 1:
+            return None
+        return [patch for version, patch in self._log if version > base_version]
+
+    def apply_client_patches(
+        self,
+        tree: UITree,
+        base_version: int,
+        patches: list[PatchOperation],
+    ) -> list[PatchOperation]:
+        """
+        Apply a client's local patches to the server tree.
+
+        Args:
+            tree: The server's tree (modified in place)
+            base_version: Version the client's patches were made against
+            patches: Client patches, in order
+
+        Returns:
+            Server patches made since base_version, which the client must
+            apply to catch up (the new version is self.version)
+
+        Raises:
+            StaleTreeError: If base_version is unknown or the client's patches
+                touch components the server changed since base_version
+        """
+        missed = self.patches_since(base_version)
+        if missed is None:
+            raise StaleTreeError(
+                f"Tree version {base_version} is not available (server is at {self.version})"
+            )
+
+        if missed and patches:
+            changed = {patch_key(p) for p in missed}
+            conflicts = sorted({patch_key(p) for p in patches} & changed - {None})
+            if conflicts:
+                raise StaleTreeError(
+                    f"Local changes conflict with newer server changes to: {', '.join(conflicts)}"
+                )
+
+        # Patches go to the live tree; restore its elements if one fails
+        elements = dict(tree.elements)
+        try:
+            for patch in patches:
+                tree.apply_patch(patch.op, patch.path, patch.value)
+        except Exception as e:
+            tree.elements = elements
+            raise StaleTreeError(f"Could not apply local changes: {e}") from e
+
+        for patch in patches:
+            self.record(patch)
+        return missed
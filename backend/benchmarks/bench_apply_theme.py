@@ -0,0 +1,66 @@
+"""
+Benchmark: global apply_theme on large trees, single pass with compiled
+theme maps vs one modify_component call per element (the previous approach).
+
+"first" applies a theme to a fresh tree; "reapply" applies the same theme
+again, where the single pass skips every element that already matches.
+
+Run from backend/:
+    python -m benchmarks.bench_apply_theme [--elements 10000]
+"""
+import argparse
+import asyncio
+import copy
+import time
+
+from catalog.handlers import ActionContext, ActionHandlers
+from catalog.themes import get_theme, map_theme_to_component_props
+from .bench_tree_index import build_tree
+
+
+async def per_element(tree, theme) -> ActionContext:
+    """The previous approach: map and merge the theme props element by element."""
+    ctx = ActionContext(tree=tree)
+    for key, element in list(tree.elements.items()):
+        theme_props = map_theme_to_component_props(element.type, theme)
+        if theme_props:
+            await ActionHandlers.modify_component({"componentKey": key, "props": theme_props}, ctx)
+    return ctx
+
+
+async def single_pass(tree, theme) -> ActionContext:
+    ctx = ActionContext(tree=tree)
+    await ActionHandlers.apply_theme({"themeName": theme["name"]}, ctx)
+    return ctx
+
+
+def timed(run, tree, theme) -> tuple[float, int]:
+    """Milliseconds for one run, and the number of patches it emitted."""
+    start = time.perf_counter()
+    ctx = asyncio.run(run(tree, theme))
+    return (time.perf_counter() - start) * 1000, len(ctx.patches)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--elements", type=int, default=10000)
+    parser.add_argument("--theme", default="default")
+    args = parser.parse_args()
+
+    theme = get_theme(args.theme)
+    base = build_tree(args.elements)
+    print(f"{len(base.elements)}-element tree, theme {args.theme!r}\n")
+    print(f"{'run':<10}{'per-element ms':>16}{'patches':>9}{'single pass ms':>16}{'patches':>9}{'speedup':>10}")
+
+    old_tree, new_tree = copy.deepcopy(base), copy.deepcopy(base)
+    for label in ("first", "reapply"):
+        old_ms, old_patches = timed(per_element, old_tree, theme)
+        new_ms, new_patches = timed(single_pass, new_tree, theme)
+        print(f"{label:<10}{old_ms:>16.1f}{old_patches:>9}{new_ms:>16.1f}{new_patches:>9}{old_ms / new_ms:>9.1f}x")
+
+    assert old_tree.model_dump() == new_tree.model_dump()
+    new_tree.elements.check_invariants()
+
+
+if __name__ == "__main__":
+    main()
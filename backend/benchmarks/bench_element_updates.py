@@ -0,0 +1,102 @@
+"""
+Benchmark: per-mutation cost of copy-on-write element updates vs full
+UIElement rebuilds (what the action handlers used to do).
+
+"element" times building the updated element alone; "in tree" includes
+storing it (and the index maintenance that comes with it).
+
+Run from backend/:
+    python -m benchmarks.bench_element_updates [--repeat 20000]
+"""
+import argparse
+import timeit
+
+from models.ui_tree import UITree, UIElement, _field_adapter
+
+
+def make_tree() -> UITree:
+    """A small tree whose target element has realistic props and an action."""
+    props = {
+        "title": "Summer Sale",
+        "subtitle": "Up to 50% off",
+        "imageUrl": "http://localhost:8000/api/blobs/" + "0" * 64,
+        "style": {"padding": 16, "borderRadius": 12, "backgroundColor": "#ffffff"},
+        "textStyle": {"fontSize": 18, "fontWeight": "600", "color": "#111111"},
+    }
+    children = [f"child-{i}" for i in range(12)]
+    elements = {
+        "root": {"key": "root", "type": "View", "children": ["target"]},
+        "target": {
+            "key": "target",
+            "type": "Banner",
+            "props": props,
+            "children": children,
+            "parentKey": "root",
+            "action": {"name": "navigate", "params": {"screen": "sale"}},
+            "trackEvent": {"eventName": "banner_view", "properties": {"slot": 1}},
+        },
+    }
+    for key in children:
+        elements[key] = {"key": key, "type": "Text", "props": {"text": key}, "parentKey": "target"}
+    return UITree(root="root", elements=elements)
+
+
+def rebuilt(element: UIElement, **changes) -> UIElement:
+    """The previous approach: construct a new UIElement from every field."""
+    return UIElement(
+        key=element.key,
+        type=element.type,
+        props=changes.get("props", element.props),
+        children=changes.get("children", element.children),
+        parentKey=changes.get("parentKey", element.parentKey),
+        action=element.action,
+        trackEvent=element.trackEvent,
+        visible=element.visible,
+    )
+
+
+def timed(fn, repeat: int) -> float:
+    """Microseconds per call (best of 5 runs)."""
+    number = max(1, repeat // 5)
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    tree = make_tree()
+    element = tree.elements["target"]
+    new_props = {**element.props, "title": "Winter Sale"}
+    new_children = list(reversed(element.children))
+
+    cases = [
+        ("props", {"props": new_props}),
+        ("children", {"children": new_children}),
+        ("parentKey", {"parentKey": "root"}),
+    ]
+
+    print(f"{'mutation':<12}{'':<10}{'rebuild µs':>12}{'copy-on-write µs':>18}{'speedup':>10}")
+    for name, changes in cases:
+        def rebuild_in_tree():
+            tree.elements["target"] = rebuilt(tree.elements["target"], **changes)
+
+        rows = [
+            (
+                "element",
+                lambda: rebuilt(element, **changes),
+                lambda: element.model_copy(update={n: _field_adapter(n).validate_python(v) for n, v in changes.items()}),
+            ),
+            ("in tree", rebuild_in_tree, lambda: tree.update_element("target", **changes)),
+        ]
+        for label, old, new in rows:
+            old_us = timed(old, args.repeat)
+            new_us = timed(new, args.repeat)
+            print(f"{name:<12}{label:<10}{old_us:>12.2f}{new_us:>18.2f}{old_us / new_us:>9.1f}x")
+
+    tree.elements.check_invariants()
+
+
+if __name__ == "__main__":
+    main()
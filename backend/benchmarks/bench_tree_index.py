@@ -0,0 +1,108 @@
+"""
+Benchmark: indexed UITree lookups vs what they replaced on large trees
+(linear scans, and the parentKey lookup for get_parent), and the cost the
+indexes add to every element store.
+
+Run from backend/:
+    python -m benchmarks.bench_tree_index [--elements 10000]
+"""
+import argparse
+import random
+import time
+
+from models.ui_tree import UITree
+
+TYPES = ["View", "Text", "Button", "Image", "Card", "ScrollView", "TextInput", "Badge"]
+COLORS = ["#ffffff", "#000000", "#1a1a1a", "#f5f5f5", "#22c55e", "#ef4444"]
+
+
+def build_tree(n: int, seed: int = 0) -> UITree:
+    """A random tree with n elements, about 30% with a backgroundColor."""
+    rng = random.Random(seed)
+    elements = {"root": {"key": "root", "type": "View", "children": []}}
+    keys = ["root"]
+    for i in range(1, n):
+        key = f"el-{i}"
+        parent = keys[rng.randrange(max(1, len(keys) // 8), len(keys))] if len(keys) > 8 else "root"
+        props = {"backgroundColor": rng.choice(COLORS)} if rng.random() < 0.3 else {}
+        if rng.random() < 0.5:
+            props["textColor"] = rng.choice(COLORS)
+        elements[key] = {"key": key, "type": rng.choice(TYPES), "props": props, "children": [], "parentKey": parent}
+        elements[parent]["children"].append(key)
+        keys.append(key)
+    return UITree(root="root", elements=elements)
+
+
+def timed(fn, repeat: int) -> float:
+    """Microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--elements", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tree = build_tree(args.elements)
+    print(f"Built {len(tree.elements)}-element tree in {(time.perf_counter() - start) * 1000:.1f} ms")
+    elements = dict(tree.elements)  # plain dict for the baselines
+    leaf = next(reversed(elements))
+
+    cases = [
+        (
+            "find_by_type('Text')",
+            lambda: tree.find_by_type("Text"),
+            lambda: [el for el in elements.values() if el.type == "Text"],
+        ),
+        (
+            "find_by_prop('backgroundColor')",
+            lambda: tree.find_by_prop("backgroundColor", "#ffffff"),
+            lambda: [el for el in elements.values() if el.props.get("backgroundColor") == "#ffffff"],
+        ),
+        (
+            "get_parent(leaf)",
+            lambda: tree.get_parent(leaf),
+            # The previous implementation: follow the element's parentKey
+            lambda: elements.get(elements[leaf].parentKey),
+        ),
+        (
+            "elements with backgroundColor",
+            lambda: tree.elements.keys_with_prop("backgroundColor"),
+            lambda: [k for k, el in elements.items() if "backgroundColor" in el.props],
+        ),
+    ]
+
+    print(f"\n{'lookup':<34}{'indexed µs':>12}{'before µs':>12}{'speedup':>10}")
+    for name, indexed, scan in cases:
+        assert (indexed() is None) == (scan() is None)
+        indexed_us = timed(indexed, args.repeat)
+        scan_us = timed(scan, args.repeat)
+        print(f"{name:<34}{indexed_us:>12.1f}{scan_us:>12.1f}{scan_us / indexed_us:>9.1f}x")
+
+    # Cost the indexes add to mutations
+    rng = random.Random(1)
+    keys = list(elements)
+    updates = [
+        (key, tree.elements[key].model_copy(update={"props": {"backgroundColor": rng.choice(COLORS)}}))
+        for key in rng.choices(keys, k=args.repeat * 10)
+    ]
+    start = time.perf_counter()
+    for key, element in updates:
+        tree.elements[key] = element
+    indexed_us = (time.perf_counter() - start) / len(updates) * 1e6
+    start = time.perf_counter()
+    for key, element in updates:
+        elements[key] = element
+    plain_us = (time.perf_counter() - start) / len(updates) * 1e6
+    print(f"\n{'element replace':<34}{indexed_us:>12.2f}{plain_us:>12.2f}{indexed_us / plain_us:>9.1f}x slower (indexed vs plain dict)")
+
+    tree.elements.check_invariants()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,9 @@ from datetime import datetime
 
 from models.ui_tree import UITree, UIElement
 from models.requests import PatchOperation
-from .themes import get_theme, map_theme_to_component_props
+from models.json_patch import diff, join_pointer
+from services.blob_store import BLOB_ROUTE
+from .themes import get_theme, compile_theme
 
 
 class ActionContext:
@@ -76,19 +78,11 @@ class ActionHandlers:
                     new_props[key] = value
 
         # Update the tree
-        ctx.tree.elements[component_key] = UIElement(
-            key=element.key,
-            type=element.type,
-            props=new_props,
-            children=element.children,
-            parentKey=element.parentKey,
-            action=element.action,
-            trackEvent=element.trackEvent,
-            visible=element.visible,
-        )
+        ctx.tree.update_element(component_key, props=new_props)
 
-        # Emit patch
-        ctx.emit_patch("replace", f"/elements/{component_key}/props", new_props)
+        # Emit only what changed, at the deepest changed path
+        for op, path, value in diff(element.props, new_props, join_pointer("elements", component_key, "props")):
+            ctx.emit_patch(op, path, value)
 
         return {
             "success": True,
@@ -115,37 +109,62 @@ class ActionHandlers:
             if not theme:
                 raise ValueError(f"Unknown theme: {theme_name}")
 
+        theme_map = compile_theme(theme)
         if scope == "global":
             # Apply globally
             ctx.theme = theme
             ctx.on_theme_change(theme)
 
-            # Also update components that depend on theme
-            for key, element in ctx.tree.elements.items():
-                theme_props = map_theme_to_component_props(element.type, theme)
-                if theme_props:
-                    await ActionHandlers.modify_component(
-                        {"componentKey": key, "props": theme_props},
-                        ctx
-                    )
+            # Also update every component that depends on theme (found by type)
+            keys = [key for component_type in theme_map for key in ctx.tree.elements.keys_of_type(component_type)]
         else:
             # Apply to specific components
-            for key in target_components:
-                element = ctx.tree.elements.get(key)
-                if element:
-                    theme_props = map_theme_to_component_props(element.type, theme)
-                    if theme_props:
-                        await ActionHandlers.modify_component(
-                            {"componentKey": key, "props": theme_props},
-                            ctx
-                        )
+            keys = [key for key in target_components if key in ctx.tree.elements]
+
+        updated = ActionHandlers._apply_theme_props(keys, theme_map, ctx)
 
         return {
             "success": True,
             "themeName": theme.get("name", theme_name),
             "scope": scope,
+            "updatedComponents": updated,
         }
 
+    @staticmethod
+    def _apply_theme_props(
+        keys: list[str],
+        theme_map: dict[str, dict[str, Any]],
+        ctx: ActionContext
+    ) -> int:
+        """
+        Merge compiled theme props into components in one pass.
+
+        Components that already have the theme's values are left alone.
+        Patches for all changed components are emitted together at the end.
+
+        Returns:
+            Number of components changed
+        """
+        changes: list[tuple[str, str, Any]] = []
+        updated = 0
+        for key in keys:
+            element = ctx.tree.elements[key]
+            theme_props = theme_map.get(element.type)
+            if not theme_props:
+                continue
+            props = element.props
+            if all(name in props and props[name] == value for name, value in theme_props.items()):
+                continue
+
+            new_props = {**props, **theme_props}
+            ctx.tree.update_element(key, props=new_props)
+            changes.extend(diff(props, new_props, join_pointer("elements", key, "props")))
+            updated += 1
+
+        for op, path, value in changes:
+            ctx.emit_patch(op, path, value)
+        return updated
+
     @staticmethod
     async def generate_image(
         params: dict[str, Any],
@@ -285,20 +304,11 @@ class ActionHandlers:
         else:
             parent_children.append(new_key)
 
-        ctx.tree.elements[parent_key] = UIElement(
-            key=parent.key,
-            type=parent.type,
-            props=parent.props,
-            children=parent_children,
-            parentKey=parent.parentKey,
-            action=parent.action,
-            trackEvent=parent.trackEvent,
-            visible=parent.visible,
-        )
+        ctx.tree.update_element(parent_key, children=parent_children)
 
         # Emit patches
-        ctx.emit_patch("add", f"/elements/{new_key}", new_element.model_dump())
-        ctx.emit_patch("replace", f"/elements/{parent_key}/children", parent_children)
+        ctx.emit_patch("add", join_pointer("elements", new_key), new_element.model_dump())
+        ctx.emit_patch("replace", join_pointer("elements", parent_key, "children"), parent_children)
 
         return {
             "success": True,
@@ -334,28 +344,19 @@ class ActionHandlers:
 
             collect_children(element.children)
 
-        # Remove from parent's children
-        if element.parentKey:
-            parent = ctx.tree.elements.get(element.parentKey)
-            if parent and parent.children:
-                new_children = [k for k in parent.children if k != component_key]
-                ctx.tree.elements[element.parentKey] = UIElement(
-                    key=parent.key,
-                    type=parent.type,
-                    props=parent.props,
-                    children=new_children,
-                    parentKey=parent.parentKey,
-                    action=parent.action,
-                    trackEvent=parent.trackEvent,
-                    visible=parent.visible,
-                )
-                ctx.emit_patch("replace", f"/elements/{element.parentKey}/children", new_children)
+        # Remove from parent's children (the parent index, not a possibly stale parentKey)
+        parent_key = ctx.tree.elements.parent_of(component_key)
+        if parent_key:
+            parent = ctx.tree.elements[parent_key]
+            new_children = [k for k in parent.children if k != component_key]
+            ctx.tree.update_element(parent_key, children=new_children)
+            ctx.emit_patch("replace", join_pointer("elements", parent_key, "children"), new_children)
 
         # Remove elements
         for key in keys_to_remove:
             if key in ctx.tree.elements:
                 del ctx.tree.elements[key]
-                ctx.emit_patch("remove", f"/elements/{key}")
+                ctx.emit_patch("remove", join_pointer("elements", key))
 
         return {
             "success": True,
@@ -388,18 +389,9 @@ class ActionHandlers:
         child_keys = unique_child_keys
 
         # Update parent
-        ctx.tree.elements[parent_key] = UIElement(
-            key=parent.key,
-            type=parent.type,
-            props=parent.props,
-            children=child_keys,
-            parentKey=parent.parentKey,
-            action=parent.action,
-            trackEvent=parent.trackEvent,
-            visible=parent.visible,
-        )
+        ctx.tree.update_element(parent_key, children=child_keys)
 
-        ctx.emit_patch("replace", f"/elements/{parent_key}/children", child_keys)
+        ctx.emit_patch("replace", join_pointer("elements", parent_key, "children"), child_keys)
 
         return {
             "success": True,
@@ -452,24 +444,14 @@ class ActionHandlers:
         if not new_parent:
             raise ValueError(f"New parent not found: {new_parent_key}")
 
-        # Remove from old parent
-        old_parent_key = element.parentKey
+        # Remove from old parent (found with the parent index)
+        old_parent_key = ctx.tree.elements.parent_of(component_key)
         if old_parent_key and old_parent_key != new_parent_key:
             # Only remove from old parent if moving to a DIFFERENT parent
-            old_parent = ctx.tree.elements.get(old_parent_key)
-            if old_parent:
-                new_children = [k for k in old_parent.children if k != component_key]
-                ctx.tree.elements[old_parent_key] = UIElement(
-                    key=old_parent.key,
-                    type=old_parent.type,
-                    props=old_parent.props,
-                    children=new_children,
-                    parentKey=old_parent.parentKey,
-                    action=old_parent.action,
-                    trackEvent=old_parent.trackEvent,
-                    visible=old_parent.visible,
-                )
-                ctx.emit_patch("replace", f"/elements/{old_parent_key}/children", new_children)
+            old_parent = ctx.tree.elements[old_parent_key]
+            new_children = [k for k in old_parent.children if k != component_key]
+            ctx.tree.update_element(old_parent_key, children=new_children)
+            ctx.emit_patch("replace", join_pointer("elements", old_parent_key, "children"), new_children)
 
         # Get fresh reference to new parent (may have been updated above if same as old)
         new_parent = ctx.tree.elements.get(new_parent_key)
@@ -481,31 +463,14 @@ class ActionHandlers:
         else:
             new_parent_children.append(component_key)
 
-        ctx.tree.elements[new_parent_key] = UIElement(
-            key=new_parent.key,
-            type=new_parent.type,
-            props=new_parent.props,
-            children=new_parent_children,
-            parentKey=new_parent.parentKey,
-            action=new_parent.action,
-            trackEvent=new_parent.trackEvent,
-            visible=new_parent.visible,
-        )
-
-        # Update element's parent reference
-        ctx.tree.elements[component_key] = UIElement(
-            key=element.key,
-            type=element.type,
-            props=element.props,
-            children=element.children,
-            parentKey=new_parent_key,
-            action=element.action,
-            trackEvent=element.trackEvent,
-            visible=element.visible,
-        )
+        ctx.tree.update_element(new_parent_key, children=new_parent_children)
+        ctx.emit_patch("replace", join_pointer("elements", new_parent_key, "children"), new_parent_children)
 
-        ctx.emit_patch("replace", f"/elements/{new_parent_key}/children", new_parent_children)
-        ctx.emit_patch("replace", f"/elements/{component_key}/parentKey", new_parent_key)
+        # parentKey mirrors the parent index
+        parent_key = ctx.tree.elements.parent_of(component_key)
+        if ctx.tree.elements[component_key].parentKey != parent_key:
+            ctx.tree.update_element(component_key, parentKey=parent_key)
+            ctx.emit_patch("replace", join_pointer("elements", component_key, "parentKey"), parent_key)
 
         return {
             "success": True,
@@ -560,11 +525,12 @@ class ActionHandlers:
             "error": params.get("error", "#ef4444"),
         }
         
-        # Store palette in context for other actions to use
-        ctx.theme["palette"] = palette
+        # Store palette in context for other actions to use (a new dict, so
+        # the theme snapshot taken for rollback and undo stays as it was)
+        ctx.theme = {**ctx.theme, "palette": palette}
         
         # Notify frontend about the palette
-        ctx.on_theme_change({"palette": palette})
+        ctx.on_theme_change(ctx.theme)
         
         return {
             "success": True,
@@ -591,8 +557,9 @@ class ActionHandlers:
         
         # Check contrast ratios
         if "contrast" in checks:
-            for key, element in ctx.tree.elements.items():
-                props = element.props
+            # Only elements with a background color can fail this check
+            for key in ctx.tree.elements.keys_with_prop("backgroundColor"):
+                props = ctx.tree.elements[key].props
                 bg_color = props.get("backgroundColor", "")
                 text_color = props.get("textColor", props.get("color", ""))
                 
@@ -630,7 +597,7 @@ class ActionHandlers:
                 bg_color = props.get("backgroundColor", "")
                 
                 # If there's a generated image but also a heavy overlay
-                if image_url.startswith("data:image") or image_url.startswith("http"):
+                if image_url.startswith(("data:image", "http", BLOB_ROUTE)):
                     if overlay and not overlay.startswith("rgba(0,0,0,0.") and overlay != "transparent":
                         issues.append("main-banner: Heavy overlay covering generated image")
                         if auto_fix:
@@ -651,12 +618,10 @@ class ActionHandlers:
         
         # Check readability
         if "readability" in checks:
-            for key, element in ctx.tree.elements.items():
-                if element.type == "Text":
-                    props = element.props
-                    font_size = props.get("fontSize", 14)
-                    if isinstance(font_size, int) and font_size < 12:
-                        issues.append(f"{key}: Font size too small ({font_size}px)")
+            for key in ctx.tree.elements.keys_of_type("Text"):
+                font_size = ctx.tree.elements[key].props.get("fontSize", 14)
+                if isinstance(font_size, int) and font_size < 12:
+                    issues.append(f"{key}: Font size too small ({font_size}px)")
         
         return {
             "success": True,
@@ -2,7 +2,9 @@
 Theme presets - Pre-defined themes for the e-commerce app.
 Copied and extended from EcommerceAyush/src/theme/presets.js
 """
-from typing import Any, Optional
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Optional
 
 
 # =============================================================================
@@ -256,65 +258,131 @@ def list_themes() -> list[str]:
     return list(THEME_PRESETS.keys())
 
 
+def _button_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {"color": colors.get("primary", "#000000")}
+
+
+def _header_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "backgroundColor": colors.get("background", "#ffffff"),
+        "textColor": colors.get("text", "#000000"),
+    }
+
+
+def _main_banner_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    props = {}
+    banner_config = components.get("banner") if components else None
+    if banner_config:
+        if banner_config.get("imageUrl"):
+            props["imageUrl"] = banner_config["imageUrl"]
+        if banner_config.get("title"):
+            props["title"] = banner_config["title"]
+        if banner_config.get("subtitle"):
+            props["subtitle"] = banner_config["subtitle"]
+        if banner_config.get("ctaText"):
+            props["ctaText"] = banner_config["ctaText"]
+        if banner_config.get("overlay"):
+            props["overlayColor"] = banner_config["overlay"]
+    props["titleBackgroundColor"] = colors.get("background", "#ffffff")
+    return props
+
+
+def _bottom_navigation_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "backgroundColor": colors.get("background", "#ffffff"),
+        "iconColor": colors.get("textSecondary", "#595959"),
+        "activeIndicatorColor": colors.get("primary", "#000000"),
+    }
+
+
+def _text_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {"color": colors.get("text", "#000000")}
+
+
+def _badge_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "backgroundColor": colors.get("primary", "#ff0000"),
+        "textColor": colors.get("textInverse", "#ffffff"),
+    }
+
+
+def _view_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {"backgroundColor": colors.get("background", "#ffffff")}
+
+
+def _filter_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    return {"activeColor": colors.get("primary", "#333333")}
+
+
+def _flicker_text_props(colors: dict[str, Any], components: dict[str, Any]) -> dict[str, Any]:
+    props = {}
+    flicker_config = components.get("flickerText") if components else None
+    if flicker_config:
+        if flicker_config.get("flickerColors"):
+            props["flickerColors"] = flicker_config["flickerColors"]
+        if flicker_config.get("speed"):
+            props["speed"] = flicker_config["speed"]
+    return props
+
+
+# Component type -> (colors, component configs) -> themed props
+_THEME_PROP_MAPPERS: dict[str, Callable[[dict[str, Any], dict[str, Any]], dict[str, Any]]] = {
+    "Button": _button_props,
+    "Header": _header_props,
+    "MainBanner": _main_banner_props,
+    "BottomNavigation": _bottom_navigation_props,
+    "Text": _text_props,
+    "Badge": _badge_props,
+    "View": _view_props,
+    "Filter": _filter_props,
+    "FlickerText": _flicker_text_props,
+}
+
+
 def map_theme_to_component_props(component_type: str, theme: dict[str, Any]) -> dict[str, Any]:
     """
     Map theme colors to component-specific props.
     Returns props that should be applied to the component.
     """
-    colors = theme.get("colors", {})
-    components = theme.get("components", {})
+    mapper = _THEME_PROP_MAPPERS.get(component_type)
+    if mapper is None:
+        return {}
+    return mapper(theme.get("colors", {}), theme.get("components", {}))
 
-    props = {}
 
-    if component_type == "Button":
-        props["color"] = colors.get("primary", "#000000")
-
-    elif component_type == "Header":
-        props["backgroundColor"] = colors.get("background", "#ffffff")
-        props["textColor"] = colors.get("text", "#000000")
-
-    elif component_type == "MainBanner":
-        banner_config = components.get("banner") if components else None
-        if banner_config:
-            if banner_config.get("imageUrl"):
-                props["imageUrl"] = banner_config["imageUrl"]
-            if banner_config.get("title"):
-                props["title"] = banner_config["title"]
-            if banner_config.get("subtitle"):
-                props["subtitle"] = banner_config["subtitle"]
-            if banner_config.get("ctaText"):
-                props["ctaText"] = banner_config["ctaText"]
-            if banner_config.get("overlay"):
-                props["overlayColor"] = banner_config["overlay"]
-        props["titleBackgroundColor"] = colors.get("background", "#ffffff")
-
-    elif component_type == "BottomNavigation":
-        props["backgroundColor"] = colors.get("background", "#ffffff")
-        props["iconColor"] = colors.get("textSecondary", "#595959")
-        props["activeIndicatorColor"] = colors.get("primary", "#000000")
-
-    elif component_type == "Text":
-        props["color"] = colors.get("text", "#000000")
-
-    elif component_type == "Badge":
-        props["backgroundColor"] = colors.get("primary", "#ff0000")
-        props["textColor"] = colors.get("textInverse", "#ffffff")
-
-    elif component_type == "View":
-        props["backgroundColor"] = colors.get("background", "#ffffff")
-
-    elif component_type == "Filter":
-        props["activeColor"] = colors.get("primary", "#333333")
-
-    elif component_type == "FlickerText":
-        flicker_config = components.get("flickerText") if components else None
-        if flicker_config:
-            if flicker_config.get("flickerColors"):
-                props["flickerColors"] = flicker_config["flickerColors"]
-            if flicker_config.get("speed"):
-                props["speed"] = flicker_config["speed"]
+# Component types map_theme_to_component_props sets props on
+THEMED_COMPONENT_TYPES = tuple(_THEME_PROP_MAPPERS)
 
-    return props
+# Compiled theme maps by theme content, least recently used first
+COMPILED_THEME_CACHE_SIZE = 32
+_compiled_themes: OrderedDict[str, dict[str, dict[str, Any]]] = OrderedDict()
+
+
+def compile_theme(theme: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """
+    Map a theme to the props it sets on each component type.
+
+    Compiled once per theme and cached by content, so equal custom themes
+    share an entry. The result is shared: don't mutate it.
+
+    Returns:
+        Component type -> props (types the theme sets nothing on are omitted)
+    """
+    fingerprint = json.dumps(theme, sort_keys=True, default=str)
+    compiled = _compiled_themes.get(fingerprint)
+    if compiled is not None:
+        _compiled_themes.move_to_end(fingerprint)
+        return compiled
+
+    compiled = {}
+    for component_type in THEMED_COMPONENT_TYPES:
+        props = map_theme_to_component_props(component_type, theme)
+        if props:
+            compiled[component_type] = props
+    _compiled_themes[fingerprint] = compiled
+    if len(_compiled_themes) > COMPILED_THEME_CACHE_SIZE:
+        _compiled_themes.popitem(last=False)
+    return compiled
 
 
 def create_custom_theme(
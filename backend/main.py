@@ -10,7 +10,12 @@ from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from routers import customize_router, themes_router, images_router
+from routers import customize_router, themes_router, images_router, blobs_router, admin_router
+from routers.customize import active_agents, session_persister, screenshot_broker, session_runs, blobs_in_use
+from agent.cache import get_response_cache
+from services.openai_client import get_openai_client
+from services.cancellation import get_cancellation_stats
+from services.blob_store import DEFAULT_MAX_AGE, get_blob_store
 
 # Load environment variables
 load_dotenv()
@@ -23,9 +28,17 @@ async def lifespan(app: FastAPI):
     print("Starting E-Commerce AI Agent Backend...")
     print(f"OpenAI API Key: {'Set' if os.getenv('OPENAI_API_KEY') else 'Not Set'}")
     print(f"Google API Key: {'Set' if os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY') else 'Not Set'}")
+    active_agents.start()
+    session_persister.start()
+    screenshot_broker.start()
+    get_blob_store().start(blobs_in_use, max_age=float(os.getenv("BLOB_MAX_AGE", str(DEFAULT_MAX_AGE))))
     yield
     # Shutdown
     print("Shutting down...")
+    await active_agents.stop()
+    await session_persister.stop()
+    await screenshot_broker.stop()
+    await get_blob_store().stop()
 
 
 # Create FastAPI app
@@ -49,6 +62,8 @@ app.add_middleware(
 app.include_router(customize_router)
 app.include_router(themes_router)
 app.include_router(images_router)
+app.include_router(blobs_router)
+app.include_router(admin_router)
 
 
 @app.get("/")
@@ -68,6 +83,14 @@ async def health():
         "status": "healthy",
         "openai": "configured" if os.getenv("OPENAI_API_KEY") else "not configured",
         "gemini": "configured" if os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY") else "not configured",
+        "sessions": active_agents.stats(),
+        "session_runs": session_runs.stats(),
+        "cancelled_calls": get_cancellation_stats().stats(),
+        "blobs": get_blob_store().stats(),
+        "session_persistence": session_persister.stats(),
+        "screenshots": screenshot_broker.stats(),
+        "response_cache": get_response_cache().stats(),
+        "prompt_tokens": get_openai_client().get_usage_stats() if os.getenv("OPENAI_API_KEY") else None,
     }
 
 
@@ -0,0 +1,138 @@
+"""
+JSON Pointer (RFC 6901) and minimal JSON Patch (RFC 6902) helpers.
+
+diff() compares two JSON values and returns add/replace/remove operations
+at the deepest changed path, so changing one style color sends one small
+op instead of the element's whole props object.
+"""
+from typing import Any
+
+
+def escape_token(token: str) -> str:
+    """Escape a key for use as a JSON Pointer reference token."""
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def unescape_token(token: str) -> str:
+    """Reverse escape_token."""
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def parse_pointer(path: str) -> list[str]:
+    """Split a JSON Pointer into unescaped reference tokens."""
+    if not path:
+        return []
+    if not path.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer: {path}")
+    return [unescape_token(token) for token in path[1:].split("/")]
+
+
+def join_pointer(*tokens: str) -> str:
+    """Build a JSON Pointer from unescaped reference tokens."""
+    return "".join(f"/{escape_token(str(token))}" for token in tokens)
+
+
+def diff(old: Any, new: Any, path: str = "") -> list[tuple[str, str, Any]]:
+    """
+    Minimal JSON Patch turning old into new.
+
+    Objects are compared key by key and recursed into; any other change
+    (including to arrays) replaces the value at that path.
+
+    Args:
+        old: Current value
+        new: Target value
+        path: JSON Pointer of the values within the document
+
+    Returns:
+        (op, path, value) tuples; value is None for remove
+    """
+    ops: list[tuple[str, str, Any]] = []
+    _diff(old, new, path, ops)
+    return ops
+
+
+def _diff(old: Any, new: Any, path: str, ops: list[tuple[str, str, Any]]) -> None:
+    if old is new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(("remove", f"{path}/{escape_token(key)}", None))
+        for key, value in new.items():
+            child = f"{path}/{escape_token(key)}"
+            if key in old:
+                _diff(old[key], value, child, ops)
+            else:
+                ops.append(("add", child, value))
+        return
+    # JSON tells true from 1, so compare types as well as values
+    if type(old) is type(new) and old == new:
+        return
+    ops.append(("replace", path, new))
+
+
+def apply_operation(document: Any, op: str, tokens: list[str], value: Any = None) -> Any:
+    """
+    Apply one add/replace/remove operation without mutating the document.
+
+    Containers along the path are copied; everything else is shared.
+
+    Args:
+        document: JSON value the tokens are relative to
+        op: "add", "replace" or "remove"
+        tokens: Unescaped reference tokens (at least one)
+        value: New value for add/replace
+
+    Returns:
+        The updated document
+
+    Raises:
+        ValueError: If the path doesn't exist (or, for add, its parent doesn't)
+    """
+    if not tokens:
+        raise ValueError("Cannot patch the whole document")
+    head, rest = tokens[0], tokens[1:]
+
+    if isinstance(document, dict):
+        updated = dict(document)
+        if rest:
+            if head not in document:
+                raise ValueError(f"Path not found: {head}")
+            updated[head] = apply_operation(document[head], op, rest, value)
+        elif op == "add":
+            updated[head] = value
+        elif head not in document:
+            raise ValueError(f"Path not found: {head}")
+        elif op == "replace":
+            updated[head] = value
+        elif op == "remove":
+            del updated[head]
+        else:
+            raise ValueError(f"Unknown patch operation: {op}")
+        return updated
+
+    if isinstance(document, list):
+        updated = list(document)
+        if head == "-" and not rest and op == "add":
+            updated.append(value)
+            return updated
+        if not head.isdigit() or (head != "0" and head.startswith("0")):
+            raise ValueError(f"Invalid array index: {head}")
+        index = int(head)
+        limit = len(document) + 1 if op == "add" and not rest else len(document)
+        if index >= limit:
+            raise ValueError(f"Array index out of range: {head}")
+        if rest:
+            updated[index] = apply_operation(document[index], op, rest, value)
+        elif op == "add":
+            updated.insert(index, value)
+        elif op == "replace":
+            updated[index] = value
+        elif op == "remove":
+            del updated[index]
+        else:
+            raise ValueError(f"Unknown patch operation: {op}")
+        return updated
+
+    raise ValueError(f"Cannot index into {type(document).__name__}")
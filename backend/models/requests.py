@@ -10,9 +10,18 @@ from .ui_tree import UITree
 class CustomizeRequest(BaseModel):
     """Request to customize the UI via AI agent."""
     prompt: str  # User's customization request
-    current_tree: UITree  # Current state of the UI
+    current_tree: Optional[UITree] = None  # Current state of the UI (omit to use the server's copy)
+    base_version: Optional[int] = None  # Server tree version the client has (with current_tree omitted)
+    patches: list["PatchOperation"] = Field(default_factory=list)  # Local changes since base_version
     theme: Optional[dict[str, Any]] = None  # Current theme
     session_id: Optional[str] = None  # Session ID for conversation persistence
+    stream_steps: bool = False  # Execute tool calls while each step's response streams
+    mode: Literal["standard", "fast"] = "standard"  # "fast" = plan + actions in one LLM call
+    pipeline_steps: bool = False  # Prefetch the next step's LLM call while actions run
+    use_cache: bool = True  # Replay cached responses for identical prompt + tree + theme
+    on_busy: Optional[Literal["serialize", "reject", "cancel"]] = None  # If the session has a run in progress
+    patch_batching: Optional[Literal["tool", "step", "time"]] = None  # Send patch_batch events flushed per tool call / step / interval
+    patch_batch_interval_ms: Optional[int] = Field(default=None, ge=10, le=5000)  # For "time" batching (default PATCH_BATCH_INTERVAL_MS)
 
 
 class TodoItem(BaseModel):
@@ -40,19 +49,26 @@ class CustomizeEvent(BaseModel):
         "plan",             # Initial plan with todos
         "todo_update",      # Todo status change
         "patch",            # UI tree patch
+        "patch_batch",      # Several UI tree patches (with patch_batching)
         "theme_update",     # Theme change
         "screenshot_request", # Request screenshot from frontend
+        "screenshot_diff",  # Visual diff between screenshots
         "validation_warning",  # Validation issue
         "error",            # Error occurred
+        "cancelled",        # Run cancelled (superseded by a newer prompt)
+        "resync_required",  # Server can't use base_version; resend current_tree
         "complete",         # Customization complete
     ]
     message: Optional[str] = None
     todos: Optional[list[TodoItem]] = None
     patch: Optional[PatchOperation] = None
+    patches: Optional[list[PatchOperation]] = None  # For patch batches, in order
     theme: Optional[dict[str, Any]] = None
     issues: Optional[list[str]] = None
     request_id: Optional[str] = None  # For screenshot requests
     session_id: Optional[str] = None  # Session ID for matching agent
+    diff: Optional[dict[str, Any]] = None  # For screenshot diffs (bbox, changed ratio)
+    version: Optional[int] = None  # Server tree version after a patch / at completion
 
 
 class GenerateImageRequest(BaseModel):
@@ -138,6 +154,16 @@ class ScreenshotResponse(BaseModel):
     height: int
 
 
+class UndoRequest(BaseModel):
+    """Undo or redo a session's latest customization request."""
+    session_id: str
+
+
 class ScreenshotUpload(BaseModel):
     """Screenshot upload from frontend to backend."""
     image_base64: str  # Base64 encoded PNG image
+    request_id: Optional[str] = None  # screenshot_request this answers
+
+
+# Update forward references
+CustomizeRequest.model_rebuild()
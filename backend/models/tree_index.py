@@ -0,0 +1,250 @@
+"""
+Incrementally maintained indexes over a UI tree's element map.
+
+IndexedElements is the dict behind UITree.elements. Every insert, replace
+and delete updates indexes by component type, by parent (derived from the
+children lists, so it never depends on parentKey being kept in sync) and
+by the values of a few commonly queried props. Elements are treated as
+immutable values: to change one, store a new element under its key.
+
+journal_changes() records the elements a block of code replaced, which is
+all an undo needs since elements are never changed in place.
+
+Set UITREE_DEBUG=1 to rebuild the indexes from scratch after every
+mutation and fail loudly if the incremental ones have drifted.
+"""
+import os
+from collections.abc import Hashable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator, Optional
+
+
+# Props with a value index (and a presence index)
+INDEXED_PROPS = ("backgroundColor", "textColor", "color", "variant")
+
+DEBUG_INVARIANTS = os.getenv("UITREE_DEBUG", "").lower() in ("1", "true", "yes")
+
+_MISSING = object()
+
+# (element map, key -> element before its first change) journaled by the current task
+_active_journal: ContextVar[Optional[tuple["IndexedElements", dict[str, Any]]]] = ContextVar("tree_journal", default=None)
+
+
+class TreeIndexError(AssertionError):
+    """The incremental indexes disagree with the elements (debug mode)."""
+
+
+class IndexedElements(dict):
+    """
+    Element map (key -> UIElement) with secondary indexes.
+
+    Key sets in the indexes are insertion-ordered dicts, so lookups return
+    elements in a stable order (that of a scan of the map, unless an
+    element's type or prop changed after it was added).
+    """
+
+    def __init__(self, elements: Optional[dict[str, Any]] = None):
+        super().__init__()
+        # Bumped on every mutation, so derived values can be cached per generation
+        self.generation = 0
+        # (generation, root, digest) of the last UITree.content_digest() over this map
+        self.digest_cache: Optional[tuple[int, str, str]] = None
+        self._reset_indexes()
+        for key, element in (elements or {}).items():
+            dict.__setitem__(self, key, element)
+            self._reindex(key, None, element)
+
+    def _reset_indexes(self) -> None:
+        self._by_type: dict[str, dict[str, None]] = {}
+        # child key -> keys of the elements listing it as a child
+        self._parents: dict[str, dict[str, None]] = {}
+        # prop -> value -> keys, and prop -> keys having the prop
+        self._by_prop: dict[str, dict[Hashable, dict[str, None]]] = {p: {} for p in INDEXED_PROPS}
+        self._with_prop: dict[str, dict[str, None]] = {p: {} for p in INDEXED_PROPS}
+
+    def __reduce__(self):
+        # Copies and pickles rebuild the indexes from the elements
+        return (type(self), (dict(self),))
+
+    # Mutation (every path goes through _reindex)
+
+    def __setitem__(self, key: str, element: Any) -> None:
+        previous = dict.get(self, key, _MISSING)
+        if previous is element:
+            return
+        previous = None if previous is _MISSING else previous
+        self._note_change(key, previous)
+        self.generation += 1
+        dict.__setitem__(self, key, element)
+        self._reindex(key, previous, element)
+        if DEBUG_INVARIANTS:
+            self.check_invariants()
+
+    def __delitem__(self, key: str) -> None:
+        element = dict.pop(self, key)
+        self._note_change(key, element)
+        self.generation += 1
+        self._reindex(key, element, None)
+        if DEBUG_INVARIANTS:
+            self.check_invariants()
+
+    def pop(self, key: str, *default: Any) -> Any:
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        element = dict.__getitem__(self, key)
+        del self[key]
+        return element
+
+    def popitem(self) -> tuple[str, Any]:
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, element in dict(*args, **kwargs).items():
+            self[key] = element
+
+    def clear(self) -> None:
+        for key, element in self.items():
+            self._note_change(key, element)
+        self.generation += 1
+        dict.clear(self)
+        self._reset_indexes()
+
+    # Lookups
+
+    def keys_of_type(self, component_type: str) -> list[str]:
+        """Keys of every element of a type."""
+        return list(self._by_type.get(component_type, ()))
+
+    def types(self) -> dict[str, list[str]]:
+        """Component type -> keys of that type."""
+        return {t: list(keys) for t, keys in self._by_type.items()}
+
+    def parent_of(self, key: str) -> Optional[str]:
+        """Key of the element whose children list contains key."""
+        return next(iter(self._parents.get(key, ())), None)
+
+    def keys_with_prop_value(self, prop: str, value: Any) -> Optional[list[str]]:
+        """Keys whose prop equals value, or None if that lookup isn't indexed."""
+        if prop not in self._by_prop or not _hashable(value):
+            return None
+        return list(self._by_prop[prop].get(value, ()))
+
+    def keys_with_prop(self, prop: str) -> Iterable[str]:
+        """Keys of elements that set a prop."""
+        if prop in self._with_prop:
+            return list(self._with_prop[prop])
+        return [key for key, element in self.items() if prop in element.props]
+
+    # Maintenance
+
+    def _note_change(self, key: str, previous: Optional[Any]) -> None:
+        """Note an element's value before its first change in a journal_changes block."""
+        journal = _active_journal.get()
+        if journal is not None and journal[0] is self and key not in journal[1]:
+            journal[1][key] = previous
+
+    def _reindex(self, key: str, old: Optional[Any], new: Optional[Any]) -> None:
+        """Move an element's index entries from old to new (either may be None)."""
+        old_type = old.type if old is not None else None
+        new_type = new.type if new is not None else None
+        if old_type != new_type:
+            if old is not None:
+                _discard(self._by_type, old_type, key)
+            if new is not None:
+                self._by_type.setdefault(new_type, {})[key] = None
+
+        old_children = old.children if old is not None else ()
+        new_children = new.children if new is not None else ()
+        if old_children is not new_children:
+            before, after = set(old_children), set(new_children)
+            for child in before - after:
+                _discard(self._parents, child, key)
+            for child in after - before:
+                self._parents.setdefault(child, {})[key] = None
+
+        old_props = old.props if old is not None else {}
+        new_props = new.props if new is not None else {}
+        if old_props is new_props:
+            return
+        for prop in INDEXED_PROPS:
+            before = old_props.get(prop, _MISSING)
+            after = new_props.get(prop, _MISSING)
+            if before is after or (_hashable(before) and _hashable(after) and before == after):
+                continue
+            if before is not _MISSING:
+                if after is _MISSING:
+                    self._with_prop[prop].pop(key, None)
+                if _hashable(before):
+                    _discard(self._by_prop[prop], before, key)
+            if after is not _MISSING:
+                self._with_prop[prop][key] = None
+                if _hashable(after):
+                    self._by_prop[prop].setdefault(after, {})[key] = None
+
+    def check_invariants(self) -> None:
+        """
+        Compare the indexes with ones rebuilt from scratch.
+
+        Raises:
+            TreeIndexError: If they differ
+        """
+        fresh = IndexedElements(dict(self))
+
+        def as_sets(index: dict[Any, dict[str, None]]) -> dict[Any, set[str]]:
+            return {bucket: set(keys) for bucket, keys in index.items() if keys}
+
+        if as_sets(self._by_type) != as_sets(fresh._by_type):
+            raise TreeIndexError("Type index out of sync")
+        if as_sets(self._parents) != as_sets(fresh._parents):
+            raise TreeIndexError("Parent index out of sync")
+        for prop in INDEXED_PROPS:
+            if as_sets(self._by_prop[prop]) != as_sets(fresh._by_prop[prop]):
+                raise TreeIndexError(f"Prop index out of sync for {prop}")
+            if set(self._with_prop[prop]) != set(fresh._with_prop[prop]):
+                raise TreeIndexError(f"Prop presence index out of sync for {prop}")
+
+
+@contextmanager
+def journal_changes(elements: IndexedElements) -> Iterator[dict[str, Any]]:
+    """
+    Record the elements replaced or removed within the block.
+
+    Only changes made by the current asyncio task are recorded, so
+    concurrent actions on one tree each get their own journal.
+
+    Args:
+        elements: Element map to watch
+
+    Yields:
+        Key -> element before its first change in the block (None if added)
+    """
+    before: dict[str, Any] = {}
+    token = _active_journal.set((elements, before))
+    try:
+        yield before
+    finally:
+        _active_journal.reset(token)
+
+
+def _hashable(value: Any) -> bool:
+    """Whether a prop value can be a value-index bucket (JSON scalars can)."""
+    return value is not _MISSING and isinstance(value, Hashable) and not isinstance(value, tuple)
+
+
+def _discard(index: dict[Any, dict[str, None]], bucket: Any, key: str) -> None:
+    """Remove a key from an index bucket, dropping the bucket once empty."""
+    keys = index.get(bucket)
+    if keys is None:
+        return
+    keys.pop(key, None)
+    if not keys:
+        del index[bucket]
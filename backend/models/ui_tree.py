@@ -2,8 +2,13 @@
 UI Tree models - Core data structures for the component tree.
 Mirrors the json-render TypeScript types.
 """
+import hashlib
+import json
 from typing import Any, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, field_validator
+
+from .tree_index import IndexedElements
+from .json_patch import apply_operation, parse_pointer
 
 
 class ConfirmDialog(BaseModel):
@@ -62,10 +67,37 @@ class UITree(BaseModel):
     """
     The complete UI tree structure.
     Uses a flat map with parent-child relationships via keys.
+
+    The element map keeps type, parent and prop indexes up to date on every
+    mutation (see tree_index.py), so lookups don't scan the tree.
     """
+    model_config = ConfigDict(validate_assignment=True)
+
     root: str  # Key of root element
     elements: dict[str, UIElement]  # Flat map of all elements by key
 
+    @field_validator("elements")
+    @classmethod
+    def _index_elements(cls, elements: dict[str, UIElement]) -> IndexedElements:
+        return elements if isinstance(elements, IndexedElements) else IndexedElements(elements)
+
+    def content_digest(self) -> str:
+        """
+        SHA-256 of the tree's canonical JSON.
+
+        Cached on the element map until the tree changes (its generation or
+        the root), so repeated lookups against the same tree don't dump it
+        again. The cache lives outside the model so it never affects ==.
+        """
+        elements = self.elements
+        cached = elements.digest_cache
+        if cached is not None and cached[0] == elements.generation and cached[1] == self.root:
+            return cached[2]
+        data = json.dumps(self.model_dump(), sort_keys=True, separators=(",", ":"), default=str)
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        elements.digest_cache = (elements.generation, self.root, digest)
+        return digest
+
     def get_element(self, key: str) -> Optional[UIElement]:
         """Get element by key."""
         return self.elements.get(key)
@@ -78,23 +110,122 @@ class UITree(BaseModel):
         return [self.elements[k] for k in element.children if k in self.elements]
 
     def get_parent(self, key: str) -> Optional[UIElement]:
-        """Get parent of an element."""
-        element = self.elements.get(key)
-        if not element or not element.parentKey:
-            return None
-        return self.elements.get(element.parentKey)
+        """Get parent of an element (the element listing it as a child)."""
+        parent_key = self.elements.parent_of(key)
+        return self.elements.get(parent_key) if parent_key else None
 
     def find_by_type(self, component_type: str) -> list[UIElement]:
         """Find all elements of a specific type."""
-        return [el for el in self.elements.values() if el.type == component_type]
+        return [self.elements[k] for k in self.elements.keys_of_type(component_type)]
 
     def find_by_prop(self, prop_name: str, prop_value: Any) -> list[UIElement]:
         """Find elements with a specific prop value."""
+        keys = self.elements.keys_with_prop_value(prop_name, prop_value)
+        if keys is not None:
+            return [self.elements[k] for k in keys]
         return [
             el for el in self.elements.values()
             if el.props.get(prop_name) == prop_value
         ]
 
+    def update_element(self, key: str, **changes: Any) -> UIElement:
+        """
+        Replace an element with a copy that has some fields changed.
+
+        Elements are copy-on-write: the copy shares every unchanged field with
+        the previous element, and only the changed fields are validated.
+
+        Args:
+            key: Element to update
+            **changes: New field values (e.g. props=..., children=...)
+
+        Returns:
+            The new element
+
+        Raises:
+            ValueError: If the element doesn't exist or a value is invalid
+        """
+        element = self.elements.get(key)
+        if element is None:
+            raise ValueError(f"Component not found: {key}")
+        if "key" in changes and changes["key"] != key:
+            raise ValueError(f"Cannot change the key of {key}")
+
+        values = {name: _field_adapter(name).validate_python(value) for name, value in changes.items()}
+        updated = element.model_copy(update=values)
+        self.elements[key] = updated
+        return updated
+
+    def apply_patch(self, op: str, path: str, value: Any = None) -> None:
+        """
+        Apply a patch operation in place, with the same semantics as the
+        frontend's applyPatch (UITreeContext.tsx).
+
+        Element-level paths add or remove whole elements. Field-level
+        replaces keep the frontend's legacy semantics (props are merged,
+        children deduplicated). Deeper paths such as
+        /elements/{key}/props/style/color are standard RFC 6902 operations.
+
+        Raises:
+            ValueError: If the path or operation is not supported
+        """
+        parts = parse_pointer(path)
+        if len(parts) < 2 or parts[0] != "elements":
+            raise ValueError(f"Unsupported patch path: {path}")
+        key = parts[1]
+        if op == "set":
+            op = "replace"
+        if op not in ("add", "remove", "replace"):
+            raise ValueError(f"Unknown patch operation: {op}")
+
+        if len(parts) == 2:
+            if op == "remove":
+                self.elements.pop(key, None)
+            else:
+                self.elements[key] = UIElement(**value)
+            return
+
+        element = self.elements.get(key)
+        if element is None:
+            raise ValueError(f"Component not found: {key}")
+        field = parts[2]
+        if field not in UIElement.model_fields or field == "key":
+            raise ValueError(f"Unsupported patch path: {path}")
+
+        if len(parts) > 3:
+            current = getattr(element, field)
+            if isinstance(current, BaseModel):
+                current = current.model_dump()
+            self.update_element(key, **{field: apply_operation(current, op, parts[3:], value)})
+        elif op == "remove":
+            raise ValueError(f"Unsupported patch path: {path}")
+        elif field == "props" and op == "replace":
+            new_props = {**element.props, **(value or {})}
+            for style_key in ("style", "textStyle"):
+                if isinstance((value or {}).get(style_key), dict):
+                    new_props[style_key] = {**(element.props.get(style_key) or {}), **value[style_key]}
+            self.update_element(key, props=new_props)
+        elif field == "children":
+            # Deduplicate, keeping first occurrence
+            self.update_element(key, children=list(dict.fromkeys(value or [])))
+        else:
+            self.update_element(key, **{field: value})
+
+
+# Validators for single UIElement fields, built on first use
+_FIELD_ADAPTERS: dict[str, TypeAdapter] = {}
+
+
+def _field_adapter(name: str) -> TypeAdapter:
+    """Validator for one UIElement field."""
+    adapter = _FIELD_ADAPTERS.get(name)
+    if adapter is None:
+        field = UIElement.model_fields.get(name)
+        if field is None:
+            raise ValueError(f"Unknown element field: {name}")
+        adapter = _FIELD_ADAPTERS[name] = TypeAdapter(field.annotation)
+    return adapter
+
 
 # Update forward references
 ActionCallback.model_rebuild()
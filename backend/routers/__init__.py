@@ -1,5 +1,7 @@
 from .customize import router as customize_router
 from .themes import router as themes_router
 from .images import router as images_router
+from .blobs import router as blobs_router
+from .admin import router as admin_router
 
-__all__ = ["customize_router", "themes_router", "images_router"]
+__all__ = ["customize_router", "themes_router", "images_router", "blobs_router", "admin_router"]
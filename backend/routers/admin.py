@@ -0,0 +1,84 @@
+"""
+Admin API endpoints - session memory introspection.
+
+Requests must send ADMIN_TOKEN in the X-Admin-Token header. Session ids
+are the only credential for the session endpoints, so the admin API is
+disabled (404) unless a token is configured.
+"""
+import os
+import secrets
+from typing import Any, Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from .customize import active_agents, session_runs
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """
+    Check the admin token.
+
+    Raises:
+        HTTPException: 404 if no ADMIN_TOKEN is configured, 401 if the header doesn't match
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin_token)])
+
+
+def _describe(entry: dict[str, Any]) -> dict[str, Any]:
+    """Per-session sizing (measured now) for an active_agents entry."""
+    agent = entry["value"]
+    breakdown = agent.memory_breakdown()
+    return {
+        "session_id": entry["session_id"],
+        "bytes": sum(breakdown.values()),
+        "breakdown": breakdown,
+        "stored_bytes": entry["bytes"],
+        "idle_seconds": entry["idle_seconds"],
+        "busy": session_runs.is_busy(entry["session_id"]),
+        "messages": len(agent.messages),
+        "patches": len(agent.patches),
+        "elements": len(agent.tree.elements),
+    }
+
+
+@router.get("/sessions")
+async def list_sessions(
+    limit: int = 50,
+    sort: Literal["bytes", "idle"] = "bytes",
+):
+    """
+    Live sessions with estimated memory by component, biggest first.
+
+    Args:
+        limit: Maximum number of sessions to list
+        sort: "bytes" (biggest first) or "idle" (longest idle first)
+    """
+    sessions = [_describe(entry) for entry in active_agents.entries()]
+    totals: dict[str, int] = {}
+    for session in sessions:
+        for component, size in session["breakdown"].items():
+            totals[component] = totals.get(component, 0) + size
+
+    key = "bytes" if sort == "bytes" else "idle_seconds"
+    sessions.sort(key=lambda session: session[key], reverse=True)
+    return {
+        "store": active_agents.stats(),
+        "totals": totals,
+        "sessions": sessions[:max(0, limit)],
+    }
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Estimated memory for one live session."""
+    for entry in active_agents.entries():
+        if entry["session_id"] == session_id:
+            return _describe(entry)
+    raise HTTPException(status_code=404, detail=f"No active agent for session {session_id}")
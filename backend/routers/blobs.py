@@ -0,0 +1,66 @@
+"""
+Blob API endpoint - serves content-addressed images.
+"""
+import re
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from services.blob_store import HASH_PATTERN, get_blob_store
+
+router = APIRouter(prefix="/api", tags=["blobs"])
+
+# Blobs never change, so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@router.get("/blobs/{digest}")
+async def get_blob(digest: str, request: Request):
+    """
+    Get a blob by its SHA-256 hash.
+
+    Supports If-None-Match (the ETag is the hash) and single byte ranges.
+    Unknown or malformed hashes are 404 even with If-None-Match.
+    """
+    blob = await get_blob_store().get_async(digest) if HASH_PATTERN.match(digest) else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail=f"Blob not found: {digest}")
+    data, content_type = blob
+
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    size = len(data)
+
+    range_header = request.headers.get("range")
+    if range_header:
+        match = RANGE_PATTERN.match(range_header.strip())
+        if not match or match.groups() == ("", ""):
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start_text, end_text = match.groups()
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(end_text))
+            end = size - 1
+        if start >= size or start > end:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        return Response(
+            content=data[start:end + 1],
+            status_code=206,
+            media_type=content_type,
+            headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"},
+        )
+
+    return Response(content=data, media_type=content_type, headers=headers)
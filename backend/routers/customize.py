@@ -2,19 +2,41 @@
 Customization API endpoint - Main agent interface.
 Uses Server-Sent Events (SSE) for real-time streaming.
 """
+import os
 import json
+import asyncio
 import uuid
-import time
 import base64
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Tuple
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
-from models.requests import CustomizeRequest, ScreenshotUpload
+from models.requests import CustomizeEvent, CustomizeRequest, PatchOperation, ScreenshotUpload, UndoRequest
 from models.ui_tree import UITree
 from agent.agent import EcommerceAgent
+from agent.patch_buffer import DEFAULT_BATCH_INTERVAL
+from agent.operation_log import UndoConflictError
+from agent.tree_versions import StaleTreeError
+from services.session_store import SessionStore, load_session_store_config
+from services.session_backends import SessionPersister, create_session_backend
+from services.screenshot_broker import create_screenshot_broker
+from services.blob_store import BlobStore
+from services.uploads import (
+    MAX_UPLOAD_BYTES,
+    UploadTooLargeError,
+    check_content_length,
+    iter_upload,
+    spool_stream,
+)
+from services.session_runs import (
+    SessionRun,
+    SessionRunQueue,
+    RunCancelled,
+    CLIENT_DISCONNECTED,
+    get_default_run_policy,
+)
 
 # Screenshots folder
 SCREENSHOTS_DIR = Path(__file__).parent.parent / "screenshots"
@@ -22,29 +44,77 @@ SCREENSHOTS_DIR.mkdir(exist_ok=True)
 
 router = APIRouter(prefix="/api", tags=["customize"])
 
-# Store active agents by session ID with last access time
-# Format: {session_id: (agent, last_access_timestamp)}
-active_agents: Dict[str, Tuple[EcommerceAgent, float]] = {}
+# How often a streaming run checks whether its client has gone away
+DISCONNECT_POLL_INTERVAL = 0.5
 
-# Session timeout in seconds (30 minutes)
-SESSION_TIMEOUT = 30 * 60
+# One run per session at a time; a busy session follows the run policy
+session_runs = SessionRunQueue(get_default_run_policy())
 
+# Active agents by session ID (expired by a background sweeper, see main.py);
+# sessions with a run in progress are never evicted
+active_agents = SessionStore(
+    size_fn=lambda agent: agent.estimate_size(),
+    busy_fn=session_runs.is_busy,
+    **load_session_store_config(),
+)
 
-def _cleanup_expired_sessions():
-    """Remove sessions that haven't been used in SESSION_TIMEOUT seconds."""
-    now = time.time()
-    expired = [
-        sid for sid, (_, last_access) in active_agents.items()
-        if now - last_access > SESSION_TIMEOUT
-    ]
-    for sid in expired:
-        del active_agents[sid]
-    if expired:
-        print(f"🧹 Cleaned up {len(expired)} expired sessions")
+# Durable copy of session state, written behind each request (see main.py)
+session_persister = SessionPersister(
+    create_session_backend(),
+    serialize=lambda agent: agent.to_state(),
+    flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0")),
+)
+
+# Routes screenshot uploads to the worker running the session (see main.py)
+screenshot_broker = create_screenshot_broker()
+
+
+def blobs_in_use() -> set[str]:
+    """Hashes of the blobs live sessions refer to (trees, undo logs and history)."""
+    values = []
+    for entry in active_agents.entries():
+        agent = entry["value"]
+        elements = [*agent.tree.elements.values(), *agent.operation_log.retained(agent.tree)]
+        values.extend(element.props for element in elements)
+        values.extend(agent.messages)
+        values.append(agent.theme)
+    return BlobStore.digests_in(values)
+
+
+async def _get_agent(session_id: str) -> Optional[EcommerceAgent]:
+    """
+    Get the live agent for a session, rehydrating it from the backend.
+
+    With a shared backend another worker may have handled the session since,
+    so a newer stored revision replaces the local copy.
+    """
+    agent = active_agents.get(session_id)
+    if agent is not None and not session_persister.backend.shared:
+        return agent
+
+    if agent is not None:
+        stored = await session_persister.revision(session_id)
+        if stored is None or stored <= agent.state_revision:
+            return agent
+
+    loaded = await session_persister.load(session_id)
+    if loaded is None:
+        return agent
+
+    state, revision = loaded
+    try:
+        restored = EcommerceAgent.from_state(state)
+    except Exception as e:
+        print(f"⚠️ Failed to restore session {session_id}: {e}")
+        return agent
+    restored.state_revision = revision
+    active_agents.put(session_id, restored)
+    print(f"💾 Rehydrated session {session_id} (history: {len(restored.messages)} messages)")
+    return restored
 
 
 @router.post("/customize")
-async def customize(request: CustomizeRequest):
+async def customize(request: CustomizeRequest, http_request: Request):
     """
     Customize the UI based on natural language prompt.
 
@@ -52,61 +122,134 @@ async def customize(request: CustomizeRequest):
     - status: Progress updates
     - plan: Initial plan with todos
     - todo_update: Todo status changes
-    - patch: UI tree patches
+    - patch: UI tree patches (with the new tree version)
+    - patch_batch: Several merged patches at once (with patch_batching)
     - theme_update: Theme changes
+    - screenshot_request: Screenshot needed (before changes and for verification)
+    - screenshot_diff: Visual diff between screenshots
     - error: Error messages
+    - cancelled: Run was cancelled (superseded by a newer prompt)
+    - resync_required: base_version can't be used; resend with current_tree
     - complete: Customization complete
 
     Request body:
     - prompt: Natural language customization request
-    - current_tree: Current UI tree state
+    - current_tree: Current UI tree state (optional once the session has a tree)
+    - base_version: Server tree version the client last saw, instead of current_tree
+    - patches: Optional local changes made since base_version
     - theme: Optional current theme
     - session_id: Optional session ID for conversation persistence
+    - stream_steps: Optional, execute actions while the model is still responding
+    - mode: Optional, "fast" plans and executes in a single LLM call
+    - pipeline_steps: Optional, request the next step while the current one runs
+    - use_cache: Optional, set false to bypass the response replay cache
+    - on_busy: Optional, "serialize", "reject" or "cancel" when the session
+      already has a request in progress (default: SESSION_RUN_POLICY)
+    - patch_batching: Optional, "tool", "step" or "time" to receive patch_batch
+      events flushed per tool call, per step or every patch_batch_interval_ms
     """
+    if request.current_tree is None and request.base_version is None:
+        raise HTTPException(status_code=422, detail="Either current_tree or base_version is required")
+
+    # Use provided session_id or generate new one
+    session_id = request.session_id or str(uuid.uuid4())
+    policy = request.on_busy or session_runs.policy
+    if policy == "reject" and session_runs.is_busy(session_id):
+        raise HTTPException(status_code=409, detail=f"Session {session_id} is busy with another request")
+
     async def event_stream():
-        # Clean up expired sessions periodically
-        _cleanup_expired_sessions()
-        
-        # Use provided session_id or generate new one
-        session_id = request.session_id or str(uuid.uuid4())
-        
+        # Stop paying for LLM and image calls as soon as the client goes away
+        run = SessionRun(session_id)
+        watcher = asyncio.create_task(_watch_disconnect(http_request, run))
+
         try:
-            # Check if we have an existing agent for this session
-            if session_id in active_agents:
-                # Reuse existing agent - update its tree with current state
-                agent, _ = active_agents[session_id]
-                agent.tree = request.current_tree
-                if request.theme:
-                    agent.theme = request.theme
-                # Reset todo manager for new request
-                agent.todo_manager.clear()
-                agent.patches.clear()
-                print(f"♻️ Reusing session {session_id} (history: {len(agent.messages)} messages)")
-            else:
-                # Create new agent
-                agent = EcommerceAgent(
-                    tree=request.current_tree,
-                    theme=request.theme,
-                    session_id=session_id,
+            # One run per session at a time (see SESSION_RUN_POLICY)
+            async with session_runs.slot(session_id, policy, run):
+                # Check if we have an existing agent for this session
+                agent = await _get_agent(session_id)
+                missed: list[PatchOperation] = []
+                if agent is not None:
+                    # Reuse existing agent - bring its tree up to date with the client
+                    if request.current_tree is not None:
+                        # An unchanged tree keeps the server's elements, so undo still applies
+                        if request.current_tree != agent.tree:
+                            agent.tree = request.current_tree
+                            agent.tree_versions.reset()
+                            agent.operation_log.clear()
+                    else:
+                        missed = agent.tree_versions.apply_client_patches(
+                            agent.tree, request.base_version, request.patches
+                        )
+                    if request.theme:
+                        agent.theme = request.theme
+                    agent.stream_steps = request.stream_steps
+                    agent.mode = request.mode
+                    agent.pipeline_steps = request.pipeline_steps
+                    agent.use_cache = request.use_cache
+                    # Reset todo manager for new request
+                    agent.todo_manager.clear()
+                    agent.patches.clear()
+                    print(f"♻️ Reusing session {session_id} (history: {len(agent.messages)} messages, tree v{agent.tree_versions.version})")
+                elif request.current_tree is None:
+                    raise StaleTreeError(f"No tree for session {session_id}")
+                else:
+                    # Create new agent
+                    agent = EcommerceAgent(
+                        tree=request.current_tree,
+                        theme=request.theme,
+                        session_id=session_id,
+                        stream_steps=request.stream_steps,
+                        mode=request.mode,
+                        pipeline_steps=request.pipeline_steps,
+                        use_cache=request.use_cache,
+                    )
+                    print(f"🆕 New session {session_id}")
+                
+                # Update session with current timestamp
+                active_agents.put(session_id, agent)
+
+                # Screenshots for this session now come to this worker
+                run_agent = agent
+                await screenshot_broker.claim(
+                    session_id,
+                    lambda image, request_id: _deliver_screenshot(run_agent, image, request_id),
                 )
-                print(f"🆕 New session {session_id}")
-            
-            # Update session with current timestamp
-            active_agents[session_id] = (agent, time.time())
 
-            # Execute and stream events
-            async for event in agent.execute(request.prompt):
-                event_data = event.model_dump(exclude_none=True)
-                yield f"data: {json.dumps(event_data)}\n\n"
+                try:
+                    # Server changes the client hasn't seen (e.g. from a cancelled run)
+                    for event in _catch_up_events(missed, agent.tree_versions.version, request.patch_batching):
+                        yield f"data: {json.dumps(event.model_dump(exclude_none=True))}\n\n"
 
+                    # Execute in the run's task and stream events
+                    interval_ms = request.patch_batch_interval_ms
+                    events = agent.execute(
+                        request.prompt,
+                        patch_batching=request.patch_batching,
+                        patch_batch_interval=interval_ms / 1000 if interval_ms else DEFAULT_BATCH_INTERVAL,
+                    )
+                    async for event in run.stream(events):
+                        event_data = event.model_dump(exclude_none=True)
+                        yield f"data: {json.dumps(event_data)}\n\n"
+                finally:
+                    await screenshot_broker.release(session_id)
+
+                    # Update last access time (and size), then persist
+                    active_agents.touch(session_id)
+                    agent.state_revision = session_persister.mark_dirty(session_id, agent)
+
+        except StaleTreeError as e:
+            print(f"🔄 Session {session_id} needs a full tree: {e}")
+            resync_event = {"type": "resync_required", "message": str(e), "session_id": session_id}
+            yield f"data: {json.dumps(resync_event)}\n\n"
+        except RunCancelled as e:
+            print(f"🛑 Run for session {session_id} cancelled: {e}")
+            cancelled_event = {"type": "cancelled", "message": str(e), "session_id": session_id}
+            yield f"data: {json.dumps(cancelled_event)}\n\n"
         except Exception as e:
             error_event = {"type": "error", "message": str(e)}
             yield f"data: {json.dumps(error_event)}\n\n"
-        
-        # Update last access time after completion
-        if session_id in active_agents:
-            agent, _ = active_agents[session_id]
-            active_agents[session_id] = (agent, time.time())
+        finally:
+            watcher.cancel()
 
     return StreamingResponse(
         event_stream(),
@@ -119,6 +262,34 @@ async def customize(request: CustomizeRequest):
     )
 
 
+def _catch_up_events(
+    patches: list[PatchOperation],
+    version: int,
+    patch_batching: Optional[str],
+) -> list[CustomizeEvent]:
+    """Events bringing a client's tree up to the server's version."""
+    if not patches:
+        return []
+    if patch_batching:
+        return [CustomizeEvent(type="patch_batch", patches=patches, version=version)]
+    return [CustomizeEvent(type="patch", patch=patch, version=version) for patch in patches]
+
+
+async def _watch_disconnect(http_request: Request, run: SessionRun) -> None:
+    """
+    Cancel a run (queued or in progress) when the SSE client disconnects.
+
+    Polls is_disconnected() rather than awaiting receive(), which would
+    compete with StreamingResponse for the request's messages.
+    """
+    while not run.cancelled:
+        if await http_request.is_disconnected():
+            print(f"🔌 Client disconnected from session {run.session_id}, cancelling run")
+            run.cancel(CLIENT_DISCONNECTED)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
 @router.post("/customize/sync")
 async def customize_sync(request: CustomizeRequest):
     """
@@ -126,14 +297,18 @@ async def customize_sync(request: CustomizeRequest):
     Returns all events at once instead of streaming.
     Note: Screenshot verification is skipped in sync mode.
     """
+    if request.current_tree is None:
+        raise HTTPException(status_code=422, detail="current_tree is required")
+
     try:
         agent = EcommerceAgent(
             tree=request.current_tree,
             theme=request.theme,
+            mode=request.mode,
         )
 
         events = []
-        async for event in agent.execute(request.prompt):
+        async for event in agent.execute(request.prompt, patch_batching=request.patch_batching):
             # Skip screenshot requests in sync mode (no frontend to capture)
             if event.type == "screenshot_request":
                 continue
@@ -145,42 +320,156 @@ async def customize_sync(request: CustomizeRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/undo")
+async def undo(request: UndoRequest):
+    """
+    Undo the session's latest customization request.
+
+    Only the components the request changed are restored, plus the theme
+    if the request changed it. Returns the patches that revert it on the
+    client, the new tree version and, for theme changes, a theme_update
+    event.
+    Responds 409 if the session is busy, there is nothing to undo, or those
+    components were changed since (e.g. by local edits sent as patches).
+    """
+    return await _undo_or_redo(request.session_id, redo=False)
+
+
+@router.post("/redo")
+async def redo(request: UndoRequest):
+    """Redo the latest undone request (same response as /api/undo)."""
+    return await _undo_or_redo(request.session_id, redo=True)
+
+
+async def _undo_or_redo(session_id: str, redo: bool) -> dict:
+    """Move a session one request back or forward in its operation log."""
+    action = "redo" if redo else "undo"
+    agent = await _get_agent(session_id)
+    if agent is None:
+        raise HTTPException(status_code=404, detail=f"No active agent for session {session_id}")
+    if session_runs.is_busy(session_id):
+        raise HTTPException(status_code=409, detail=f"Session {session_id} is busy with another request")
+
+    try:
+        outcome = agent.undo(redo=redo)
+    except UndoConflictError as e:
+        raise HTTPException(status_code=409, detail=f"Cannot {action}: {e}")
+    if outcome is None:
+        raise HTTPException(status_code=409, detail=f"Nothing to {action}")
+
+    changes, patches = outcome
+    for patch in patches:
+        agent.tree_versions.record(patch)
+    active_agents.touch(session_id)
+    agent.state_revision = session_persister.mark_dirty(session_id, agent)
+    print(f"↩️ {action.capitalize()} in session {session_id}: {changes.label[:60]!r} ({len(patches)} patches)")
+
+    response = {
+        "success": True,
+        "session_id": session_id,
+        "label": changes.label,
+        "patches": [patch.model_dump(exclude_none=True) for patch in patches],
+        "version": agent.tree_versions.version,
+        **agent.operation_log.stats(),
+    }
+    if changes.theme_change is not None:
+        # Same payload as a theme_update event
+        response["theme_update"] = {"type": "theme_update", "theme": agent.theme}
+    return response
+
+
 @router.post("/screenshot/{session_id}")
 async def receive_screenshot(session_id: str, request: ScreenshotUpload):
     """
-    Receive a screenshot from the frontend for verification.
+    Receive a base64 screenshot from the frontend for verification.
     
-    The frontend captures a screenshot when it receives a screenshot_request event,
-    then POSTs the base64-encoded image here.
+    Compatibility route; prefer the binary upload (POST
+    /api/screenshot/{session_id}/raw), which skips base64 and JSON parsing.
     """
-    session_data = active_agents.get(session_id)
-    
-    if not session_data:
+    return await _route_screenshot(session_id, request.image_base64, request.request_id)
+
+
+@router.post("/screenshot/{session_id}/raw")
+async def receive_screenshot_raw(session_id: str, http_request: Request, request_id: Optional[str] = None):
+    """
+    Receive a binary screenshot from the frontend for verification.
+
+    The body is the image itself (e.g. Content-Type: image/png) or
+    multipart/form-data with the image in a "file" field. It is read into
+    one buffer, with the size limit enforced either way, rather than parsed
+    as JSON.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    try:
+        check_content_length(http_request.headers.get("content-length"))
+        if content_type.startswith("multipart/form-data"):
+            # Starlette spools file parts to disk; check the size before reading it back
+            form = await http_request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=422, detail="Missing file field")
+            if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+                raise UploadTooLargeError(f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+            request_id = request_id or form.get("request_id")
+            image = await spool_stream(iter_upload(upload))
+        else:
+            image = await spool_stream(http_request.stream())
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if not image:
+        raise HTTPException(status_code=422, detail="Empty screenshot")
+    return await _route_screenshot(session_id, image, request_id)
+
+
+async def _route_screenshot(session_id: str, image: str | bytes, request_id: Optional[str]) -> dict:
+    """Deliver a screenshot to whichever worker is running the session."""
+    response = await screenshot_broker.deliver(session_id, image, request_id)
+    if response is not None:
+        return response
+
+    # No run in progress anywhere; a live agent here still takes it
+    agent = active_agents.get(session_id)
+    if agent is None:
         raise HTTPException(status_code=404, detail=f"No active agent for session {session_id}")
+    return _deliver_screenshot(agent, image, request_id)
+
+
+def _deliver_screenshot(agent: EcommerceAgent, image: str | bytes, request_id: Optional[str]) -> dict:
+    """
+    Hand a screenshot to an agent (runs in the worker that owns the session).
+
+    `image` is base64 / a data URL from the JSON route, or raw bytes from the
+    binary route; the agent accepts both.
+    """
+    session_id = agent.session_id
+
+    # Pre-change baseline: keep it aside instead of waking the verification loop
+    if request_id and request_id == agent.baseline_request_id:
+        agent.baseline_screenshot = image
+        return {"status": "received", "session_id": session_id, "baseline": True}
+    
+    # Save screenshot to file for debugging (off the event loop)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filepath = SCREENSHOTS_DIR / f"{timestamp}_{session_id[:8]}.png"
+    asyncio.get_running_loop().run_in_executor(None, _save_screenshot, filepath, image)
     
-    agent, _ = session_data
+    # Provide screenshot data to the waiting agent
+    agent.screenshot_data = image
+    agent.screenshot_event.set()
     
-    # Save screenshot to file for debugging
+    return {"status": "received", "session_id": session_id, "saved_to": str(filepath)}
+
+
+def _save_screenshot(filepath: Path, image: str | bytes) -> None:
+    """Write a debug copy of a screenshot (runs in a worker thread)."""
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{session_id[:8]}.png"
-        filepath = SCREENSHOTS_DIR / filename
-        
-        # Strip data URL prefix if present
-        image_b64 = request.image_base64
-        if image_b64.startswith('data:'):
-            # Extract base64 part after the comma
-            image_b64 = image_b64.split(',', 1)[1]
-        
-        # Decode and save
-        image_data = base64.b64decode(image_b64)
-        filepath.write_bytes(image_data)
+        if isinstance(image, str):
+            # Strip data URL prefix if present
+            if image.startswith('data:'):
+                image = image.split(',', 1)[1]
+            image = base64.b64decode(image)
+        filepath.write_bytes(image)
         print(f"📸 Screenshot saved: {filepath}")
     except Exception as e:
         print(f"⚠️ Failed to save screenshot: {e}")
-    
-    # Provide screenshot data to the waiting agent
-    agent.screenshot_data = request.image_base64
-    agent.screenshot_event.set()
-    
-    return {"status": "received", "session_id": session_id, "saved_to": str(filepath) if 'filepath' in locals() else None}
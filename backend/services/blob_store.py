@@ -0,0 +1,287 @@
+"""
+Content-addressed blob store for generated and edited images.
+
+Images are stored once on disk under their SHA-256 hash, with a bounded
+in-memory LRU of recently used blobs, and referenced everywhere else
+(tree props, patches, history) by a short URL served from
+GET /api/blobs/{hash}. URLs are relative ("/api/blobs/<hash>") unless
+PUBLIC_BASE_URL is set, so they stay valid whatever host serves the API.
+
+Blobs nothing live refers to are deleted once unused for BLOB_MAX_AGE
+(see collect_garbage).
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+
+DEFAULT_BLOB_DIR = Path(__file__).parent.parent / "blobs"
+
+# In-memory LRU budget
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+BLOB_ROUTE = "/api/blobs/"
+
+# File extension by content type (the extension records the type on disk)
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+CONTENT_TYPES = {ext: mime for mime, ext in EXTENSIONS.items()}
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Blob URLs inside arbitrary text (props, tool results)
+URL_DIGEST_PATTERN = re.compile(re.escape(BLOB_ROUTE) + r"([0-9a-f]{64})")
+
+# Unreferenced blobs unused this long are deleted (30 days, longer than
+# persisted sessions are kept, so resumable sessions keep their images)
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+# Seconds between garbage collections
+GC_INTERVAL = 60 * 60
+
+
+class BlobStore:
+    """SHA-256 keyed blobs on local disk with an in-memory LRU."""
+
+    def __init__(
+        self,
+        directory: Path = DEFAULT_BLOB_DIR,
+        memory_bytes: int = DEFAULT_MEMORY_BYTES,
+        base_url: str = "",
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.memory_bytes = memory_bytes
+        self.base_url = base_url.rstrip("/")
+        # hash -> (data, content type), least recently used first
+        self._memory: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._memory_used = 0
+        # hash -> last put/get in this process (disk mtimes cover earlier use)
+        self._used_at: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.collected = 0
+        self._collector: Optional[asyncio.Task] = None
+
+    def url(self, digest: str) -> str:
+        """Public URL of a blob."""
+        return f"{self.base_url}{BLOB_ROUTE}{digest}"
+
+    def digest_from_url(self, url: str) -> Optional[str]:
+        """Hash of a blob URL produced by this store, or None."""
+        index = url.find(BLOB_ROUTE)
+        if index < 0:
+            return None
+        digest = url[index + len(BLOB_ROUTE):].split("?", 1)[0]
+        return digest if HASH_PATTERN.match(digest) else None
+
+    def put(self, data: bytes, content_type: str = "image/png") -> str:
+        """
+        Store a blob (blocking; writes to disk only if new).
+
+        Returns:
+            The blob's SHA-256 hex digest
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        self._used_at[digest] = time.time()
+        path = self._path(digest, content_type)
+        if not path.exists():
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        self._remember(digest, data, content_type)
+        return digest
+
+    def get(self, digest: str) -> Optional[tuple[bytes, str]]:
+        """Get (data, content type) for a blob (blocking on a memory miss)."""
+        if not HASH_PATTERN.match(digest):
+            return None
+
+        entry = self._memory.get(digest)
+        if entry is not None:
+            self._memory.move_to_end(digest)
+            self._used_at[digest] = time.time()
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        for ext, content_type in CONTENT_TYPES.items():
+            path = self.directory / f"{digest}.{ext}"
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            self._remember(digest, data, content_type)
+            self._used_at[digest] = time.time()
+            return data, content_type
+        return None
+
+    async def put_image(self, data: bytes, content_type: str = "image/png") -> str:
+        """
+        Store an image off the event loop and return its URL.
+
+        Falls back to a data URL if the blob can't be written.
+        """
+        try:
+            digest = await asyncio.to_thread(self.put, data, content_type)
+        except OSError as e:
+            print(f"⚠️ Failed to store blob, using data URL: {e}")
+            return f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+        return self.url(digest)
+
+    async def get_async(self, digest: str) -> Optional[tuple[bytes, str]]:
+        """get() without blocking the event loop on disk reads."""
+        entry = self._memory.get(digest)
+        if entry is not None:
+            self._memory.move_to_end(digest)
+            self._used_at[digest] = time.time()
+            self.hits += 1
+            return entry
+        return await asyncio.to_thread(self.get, digest)
+
+    @staticmethod
+    def digests_in(values: Iterable[Any]) -> set[str]:
+        """Hashes of every blob URL found in strings nested in values."""
+        digests: set[str] = set()
+        stack = list(values)
+        while stack:
+            value = stack.pop()
+            if isinstance(value, str):
+                if BLOB_ROUTE in value:
+                    digests.update(URL_DIGEST_PATTERN.findall(value))
+            elif isinstance(value, dict):
+                stack.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+        return digests
+
+    def collect_garbage(self, in_use: set[str], max_age: float = DEFAULT_MAX_AGE) -> list[str]:
+        """
+        Delete blobs that are not in use and haven't been used for max_age (blocking).
+
+        Blobs in use get their file time refreshed, so a session persisted
+        while they were live keeps them for max_age after that.
+
+        Args:
+            in_use: Hashes referenced by live sessions
+            max_age: Seconds since last use (file time or in-process use)
+
+        Returns:
+            Hashes of the deleted blobs
+        """
+        now = time.time()
+        deleted = []
+        for path in self.directory.iterdir():
+            digest, _, ext = path.name.partition(".")
+            if ext not in CONTENT_TYPES or not HASH_PATTERN.match(digest):
+                continue
+            try:
+                if digest in in_use:
+                    os.utime(path)
+                    continue
+                last_used = max(path.stat().st_mtime, self._used_at.get(digest, 0.0))
+                if now - last_used > max_age:
+                    path.unlink()
+                    deleted.append(digest)
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def start(self, in_use: Callable[[], set[str]], max_age: float = DEFAULT_MAX_AGE) -> None:
+        """
+        Start collecting garbage every GC_INTERVAL on the running event loop.
+
+        Args:
+            in_use: Returns the hashes live sessions refer to (called on the loop)
+            max_age: See collect_garbage
+        """
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self._collect_periodically(in_use, max_age))
+
+    async def stop(self) -> None:
+        """Stop the garbage collector."""
+        if self._collector is None:
+            return
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        self._collector = None
+
+    async def _collect_periodically(self, in_use: Callable[[], set[str]], max_age: float) -> None:
+        """Collect garbage, then sleep for GC_INTERVAL."""
+        while True:
+            try:
+                started = time.time()
+                deleted = await asyncio.to_thread(self.collect_garbage, in_use(), max_age)
+                collected = 0
+                for digest in deleted:
+                    entry = self._memory.get(digest)
+                    if entry is not None and self._used_at.get(digest, 0.0) >= started:
+                        # Stored or served again while being collected: keep it
+                        await asyncio.to_thread(self.put, *entry)
+                        continue
+                    if entry is not None:
+                        del self._memory[digest]
+                        self._memory_used -= len(entry[0])
+                    self._used_at.pop(digest, None)
+                    collected += 1
+                if collected:
+                    self.collected += collected
+                    print(f"🧹 Deleted {collected} unused blobs")
+            except Exception as e:
+                print(f"⚠️ Blob garbage collection failed: {e}")
+            await asyncio.sleep(GC_INTERVAL)
+
+    def stats(self) -> dict[str, int]:
+        """Get memory cache and garbage collection counters."""
+        return {
+            "cached_blobs": len(self._memory),
+            "cached_bytes": self._memory_used,
+            "hits": self.hits,
+            "misses": self.misses,
+            "collected": self.collected,
+        }
+
+    def _path(self, digest: str, content_type: str) -> Path:
+        return self.directory / f"{digest}.{EXTENSIONS.get(content_type, 'png')}"
+
+    def _remember(self, digest: str, data: bytes, content_type: str) -> None:
+        """Add a blob to the memory LRU, evicting the least recently used."""
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(digest, None)
+        if previous is not None:
+            self._memory_used -= len(previous[0])
+        self._memory[digest] = (data, content_type)
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, (old, _) = self._memory.popitem(last=False)
+            self._memory_used -= len(old)
+
+
+# Singleton instance
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Get or create the blob store singleton (configured from env)."""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = BlobStore(
+            directory=Path(os.getenv("BLOB_DIR") or DEFAULT_BLOB_DIR),
+            memory_bytes=int(float(os.getenv("BLOB_CACHE_MB", "64")) * 1024 * 1024),
+            base_url=os.getenv("PUBLIC_BASE_URL", ""),
+        )
+    return _blob_store
@@ -0,0 +1,42 @@
+"""
+Cancellation metrics for LLM and image calls.
+
+Runs are cancelled when the SSE client disconnects or a newer prompt
+supersedes them; each external call aborted that way is counted here.
+"""
+import asyncio
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class CancellationStats:
+    """Counts of aborted calls by kind."""
+
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+
+    @contextmanager
+    def track(self, kind: str) -> Iterator[None]:
+        """Count the wrapped await if it is cancelled (re-raises)."""
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            print(f"🛑 Cancelled {kind}")
+            raise
+
+    def stats(self) -> dict[str, int]:
+        """Get cancelled call counts."""
+        return dict(self.counts)
+
+
+# Singleton instance
+_cancellation_stats: Optional[CancellationStats] = None
+
+
+def get_cancellation_stats() -> CancellationStats:
+    """Get or create the cancellation stats singleton."""
+    global _cancellation_stats
+    if _cancellation_stats is None:
+        _cancellation_stats = CancellationStats()
+    return _cancellation_stats
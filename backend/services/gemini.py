@@ -6,6 +6,9 @@ import os
 import base64
 from typing import Optional
 
+from .blob_store import get_blob_store
+from .cancellation import get_cancellation_stats
+
 try:
     from google import genai
     from google.genai import types
@@ -43,7 +46,7 @@ class GeminiImageService:
         """
         Generate image from prompt. Agent controls the prompt content.
         
-        Returns base64 data URL or placeholder.
+        Returns a blob URL (see services/blob_store.py) or placeholder.
         """
         if not self.client:
             return self._placeholder(width, height)
@@ -53,22 +56,24 @@ class GeminiImageService:
         try:
             print(f"🎨 Generating: {prompt[:80]}...")
             
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash-image",
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_modalities=['TEXT', 'IMAGE'],
-                    image_config=types.ImageConfig(aspect_ratio=aspect),
-            )
-            )
+            # Async client, so cancelling the run aborts the request
+            with get_cancellation_stats().track("generate_image"):
+                response = await self.client.aio.models.generate_content(
+                    model="gemini-2.5-flash-image",
+                    contents=[prompt],
+                    config=types.GenerateContentConfig(
+                        response_modalities=['TEXT', 'IMAGE'],
+                        image_config=types.ImageConfig(aspect_ratio=aspect),
+                )
+                )
 
             for part in response.parts:
                 if part.inline_data is not None:
                     data = part.inline_data.data
                     mime = part.inline_data.mime_type or "image/png"
-                    b64 = data if isinstance(data, str) else base64.b64encode(data).decode("utf-8")
-                    print(f"✅ Generated ({len(b64)} bytes)")
-                    return f"data:{mime};base64,{b64}"
+                    raw = base64.b64decode(data) if isinstance(data, str) else data
+                    print(f"✅ Generated ({len(raw)} bytes)")
+                    return await get_blob_store().put_image(raw, mime)
 
             print("⚠️ No image in response")
             return self._placeholder(width, height)
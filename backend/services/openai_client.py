@@ -2,13 +2,19 @@
 OpenAI GPT-4o client for the AI agent.
 """
 import os
+import asyncio
 import base64
 import io
-from typing import Any, AsyncIterator, Optional
+from typing import Any, AsyncIterator, Optional, Sequence
 from openai import AsyncOpenAI
 from PIL import Image
 import httpx
 
+from .blob_store import get_blob_store
+from .cancellation import get_cancellation_stats
+from .screenshot_diff import ScreenshotDiff
+from .screenshot_prep import PreparedScreenshot, prepare_screenshot
+
 
 class OpenAIClient:
     """Async OpenAI client wrapper for GPT-4o."""
@@ -21,10 +27,25 @@ class OpenAIClient:
         self.client = AsyncOpenAI(api_key=self.api_key)
         self.model = "gpt-4o"
 
+        # Prompt caching instrumentation (cached vs uncached prompt tokens)
+        self.usage_stats = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+        }
+        # Savings from screenshot preprocessing
+        self.vision_stats = {
+            "calls": 0,
+            "low_detail_calls": 0,
+            "bytes_saved": 0,
+            "tokens_saved": 0,
+        }
+
     async def chat_completion(
         self,
         messages: list[dict[str, Any]],
-        tools: Optional[list[dict[str, Any]]] = None,
+        tools: Optional[Sequence[dict[str, Any]]] = None,
         tool_choice: Optional[dict[str, Any] | str] = None,
         temperature: float = 0.7,
     ) -> dict[str, Any]:
@@ -51,13 +72,16 @@ class OpenAIClient:
         if tool_choice:
             kwargs["tool_choice"] = tool_choice
 
-        response = await self.client.chat.completions.create(**kwargs)
-        return response.model_dump()
+        with get_cancellation_stats().track("chat_completion"):
+            response = await self.client.chat.completions.create(**kwargs)
+        result = response.model_dump()
+        self._record_usage(result.get("usage"))
+        return result
 
     async def chat_completion_stream(
         self,
         messages: list[dict[str, Any]],
-        tools: Optional[list[dict[str, Any]]] = None,
+        tools: Optional[Sequence[dict[str, Any]]] = None,
         temperature: float = 0.7,
     ) -> AsyncIterator[dict[str, Any]]:
         """
@@ -76,22 +100,69 @@ class OpenAIClient:
             "messages": messages,
             "temperature": temperature,
             "stream": True,
+            # Final chunk carries token usage (incl. cached prompt tokens)
+            "stream_options": {"include_usage": True},
         }
 
         if tools:
             kwargs["tools"] = tools
 
-        response = await self.client.chat.completions.create(**kwargs)
+        with get_cancellation_stats().track("chat_completion_stream"):
+            response = await self.client.chat.completions.create(**kwargs)
+
+            async for chunk in response:
+                data = chunk.model_dump()
+                if data.get("usage"):
+                    self._record_usage(data["usage"])
+                yield data
+
+    def _record_usage(self, usage: Optional[dict[str, Any]]) -> None:
+        """Record cached vs uncached prompt tokens for one call."""
+        if not usage:
+            return
+
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = details.get("cached_tokens") or 0
+
+        self.usage_stats["calls"] += 1
+        self.usage_stats["prompt_tokens"] += prompt_tokens
+        self.usage_stats["cached_tokens"] += cached_tokens
+        self.usage_stats["completion_tokens"] += usage.get("completion_tokens") or 0
+
+        print(f"🧮 Prompt tokens: {prompt_tokens} ({cached_tokens} cached, {prompt_tokens - cached_tokens} uncached)")
+
+    def _record_vision_savings(self, prepared: PreparedScreenshot) -> None:
+        """Record bytes and tokens saved by screenshot preprocessing."""
+        savings = prepared.to_dict()
+        self.vision_stats["calls"] += 1
+        self.vision_stats["bytes_saved"] += savings["bytesSaved"]
+        self.vision_stats["tokens_saved"] += savings["tokensSaved"]
+        if prepared.detail == "low":
+            self.vision_stats["low_detail_calls"] += 1
+
+        print(
+            f"🖼️ Screenshot prepared ({prepared.detail}): "
+            f"{savings['originalBytes']} -> {savings['bytes']} bytes, "
+            f"~{savings['originalTokens']} -> ~{savings['tokens']} tokens"
+        )
 
-        async for chunk in response:
-            yield chunk.model_dump()
+    def get_usage_stats(self) -> dict[str, Any]:
+        """Get cumulative token usage, including the prompt cache hit ratio."""
+        prompt_tokens = self.usage_stats["prompt_tokens"]
+        return {
+            **self.usage_stats,
+            "uncached_tokens": prompt_tokens - self.usage_stats["cached_tokens"],
+            "cached_ratio": (self.usage_stats["cached_tokens"] / prompt_tokens) if prompt_tokens else 0,
+            "vision": dict(self.vision_stats),
+        }
 
     async def generate_plan(
         self,
         user_prompt: str,
         current_tree: dict[str, Any],
         system_prompt: str,
-        tools: list[dict[str, Any]],
+        tools: Sequence[dict[str, Any]],
         conversation_history: list[dict[str, Any]] | None = None,
     ) -> dict[str, Any]:
         """
@@ -107,6 +178,74 @@ class OpenAIClient:
         Returns:
             The plan (tool call result)
         """
+        messages = self._build_plan_messages(
+            user_prompt,
+            current_tree,
+            system_prompt,
+            conversation_history,
+            instructions="""Think carefully about design principles and create a cohesive plan.
+Use the create_plan tool to outline specific steps.""",
+        )
+
+        response = await self.chat_completion(
+            messages=messages,
+            tools=tools,
+            tool_choice={"type": "function", "function": {"name": "create_plan"}},
+            temperature=0.3,  # Low for deterministic plans
+        )
+
+        return response
+
+    async def generate_plan_with_actions(
+        self,
+        user_prompt: str,
+        current_tree: dict[str, Any],
+        system_prompt: str,
+        tools: Sequence[dict[str, Any]],
+        conversation_history: list[dict[str, Any]] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Generate a plan and every action that implements it in one response.
+
+        Args:
+            user_prompt: The user's customization request
+            current_tree: Current UI tree state
+            system_prompt: System prompt with catalog info
+            tools: Available tools (actions accept a `step` index)
+            conversation_history: Previous messages for context (optional)
+
+        Returns:
+            The completion response with create_plan and action tool calls
+        """
+        messages = self._build_plan_messages(
+            user_prompt,
+            current_tree,
+            system_prompt,
+            conversation_history,
+            instructions="""Think carefully about design principles and create a cohesive plan.
+First call create_plan to outline specific steps.
+Then, in the SAME response, call the tools that implement every step, in step order.
+Set `step` on each action to the 0-based index of the plan step it implements.""",
+        )
+
+        response = await self.chat_completion(
+            messages=messages,
+            tools=tools,
+            tool_choice="required",
+            temperature=0.3,  # Low for deterministic plans
+        )
+
+        return response
+
+    def _build_plan_messages(
+        self,
+        user_prompt: str,
+        current_tree: dict[str, Any],
+        system_prompt: str,
+        conversation_history: list[dict[str, Any]] | None,
+        instructions: str,
+    ) -> list[dict[str, Any]]:
+        """Build the planning messages: system + optional history + request."""
         # Build the new user message
         new_user_message = {
             "role": "user",
@@ -115,8 +254,7 @@ class OpenAIClient:
 Current UI tree structure:
 {self._summarize_tree(current_tree)}
 
-Think carefully about design principles and create a cohesive plan.
-Use the create_plan tool to outline specific steps."""
+{instructions}"""
         }
         
         # Use conversation history if provided, otherwise start fresh
@@ -134,21 +272,14 @@ Use the create_plan tool to outline specific steps."""
                 new_user_message,
             ]
 
-        response = await self.chat_completion(
-            messages=messages,
-            tools=tools,
-            tool_choice={"type": "function", "function": {"name": "create_plan"}},
-            temperature=0.3,  # Low for deterministic plans
-        )
-
-        return response
+        return messages
 
     async def execute_step(
         self,
         step_description: str,
         current_tree: dict[str, Any],
         system_prompt: str,
-        tools: list[dict[str, Any]],
+        tools: Sequence[dict[str, Any]],
         context: Optional[str] = None,
         palette: Optional[dict[str, str]] = None,
     ) -> dict[str, Any]:
@@ -192,19 +323,21 @@ Current UI tree:
 
     async def analyze_screenshot(
         self,
-        base64_image: str,
+        base64_image: str | bytes,
         original_prompt: str,
         messages: list[dict[str, Any]],
-        tools: list[dict[str, Any]],
+        tools: Sequence[dict[str, Any]],
+        diff: Optional[ScreenshotDiff] = None,
     ) -> dict[str, Any]:
         """
         Analyze a screenshot using GPT-4o vision to verify UI changes.
 
         Args:
-            base64_image: Base64 encoded PNG screenshot
+            base64_image: PNG screenshot (raw bytes, base64 or a data URL)
             original_prompt: The original user customization request
             messages: Conversation history for context
             tools: Available tools for making fixes
+            diff: What changed since the previous screenshot (picks detail level and crop)
 
         Returns:
             The completion response with potential fix actions
@@ -277,12 +410,32 @@ Be HARSH. Find issues. Make it PERFECT.
 
 For each issue, call modify_component with specific fixes."""
 
-        # Create vision message with image
-        # Handle both raw base64 and full data URL formats
-        if base64_image.startswith('data:'):
-            image_url = base64_image
-        else:
-            image_url = f"data:image/png;base64,{base64_image}"
+        # Crop, downsize to the tile budget and re-encode before sending
+        image_url = None
+        detail = "high"
+        try:
+            prepared = await asyncio.to_thread(prepare_screenshot, base64_image, diff)
+            image_url = prepared.data_url
+            detail = prepared.detail
+            self._record_vision_savings(prepared)
+            if prepared.region:
+                left, top, right, bottom = prepared.region
+                analysis_prompt += (
+                    f"\n\nThe screenshot is cropped to the area that changed: "
+                    f"({left}, {top}) to ({right}, {bottom}) of a {prepared.size[0]}x{prepared.size[1]} screen. "
+                    "Judge the rest of the screen from the conversation."
+                )
+        except Exception as e:
+            print(f"⚠️ Screenshot preprocessing failed, sending original: {e}")
+
+        if image_url is None:
+            # Send the original: raw bytes, raw base64 or a full data URL
+            if not isinstance(base64_image, str):
+                image_url = f"data:image/png;base64,{base64.b64encode(base64_image).decode('utf-8')}"
+            elif base64_image.startswith('data:'):
+                image_url = base64_image
+            else:
+                image_url = f"data:image/png;base64,{base64_image}"
         
         vision_message = {
             "role": "user",
@@ -292,7 +445,7 @@ For each issue, call modify_component with specific fixes."""
                     "type": "image_url",
                     "image_url": {
                         "url": image_url,
-                        "detail": "high"
+                        "detail": detail
                     }
                 }
             ]
@@ -331,10 +484,15 @@ For each issue, call modify_component with specific fixes."""
             size: Output size (default 1024x1024)
 
         Returns:
-            Edited image as base64 data URL
+            Edited image as a blob URL
         """
         print(f"🎨 OpenAI edit_image called: prompt={prompt[:50]}...")
         
+        with get_cancellation_stats().track("edit_image"):
+            return await self._edit_image(image_source, prompt, size)
+
+    async def _edit_image(self, image_source: str, prompt: str, size: str) -> str:
+        """Fetch, prepare and edit an image (see edit_image)."""
         # Get the raw image bytes
         image_bytes = await self._fetch_image_bytes(image_source)
         print(f"🎨 Fetched {len(image_bytes)} bytes from source")
@@ -360,10 +518,17 @@ For each issue, call modify_component with specific fixes."""
         # Extract base64 from response
         edited_b64 = response.data[0].b64_json
         print(f"🎨 Edit successful, got {len(edited_b64)} chars of base64")
-        return f"data:image/png;base64,{edited_b64}"
+        return await get_blob_store().put_image(base64.b64decode(edited_b64), "image/png")
 
     async def _fetch_image_bytes(self, image_source: str) -> bytes:
-        """Fetch image bytes from URL or decode from base64."""
+        """Fetch image bytes from a blob URL, URL or base64."""
+        store = get_blob_store()
+        digest = store.digest_from_url(image_source)
+        if digest:
+            blob = await store.get_async(digest)
+            if blob is not None:
+                return blob[0]
+
         if image_source.startswith("data:"):
             # Extract base64 from data URL
             # Format: data:image/png;base64,<data>
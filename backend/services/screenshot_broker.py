@@ -0,0 +1,291 @@
+"""
+Screenshot rendezvous between workers.
+
+A customization run waits for the frontend to POST screenshots to
+/api/screenshot/{session_id}, but with several uvicorn workers that POST
+can land on any of them. The worker running a session claims it here;
+uploads for a session claimed in-process are handed over directly (the
+payload is passed by reference, never copied, and nothing is polled),
+and uploads for a session claimed by another worker go through a shared
+SQLite table that the owner polls while it has sessions running. A poll
+only opens a transaction when another process has written to the
+database since the last one.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+# (image as base64 or raw bytes, request_id) -> response for the upload
+ScreenshotHandler = Callable[[str | bytes, Optional[str]], dict[str, Any]]
+
+# How often the owner checks the shared table for forwarded screenshots
+# (only while it has sessions claimed)
+POLL_INTERVAL = 0.1
+
+# Claims not refreshed for this long belong to a dead worker
+CLAIM_TIMEOUT = 30.0
+
+# Forwarded screenshots nobody picked up are dropped after this long
+PAYLOAD_TTL = 60.0
+
+
+class ScreenshotBroker:
+    """
+    In-process rendezvous (single worker; the default).
+
+    Subclasses add cross-process delivery.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self._handlers: dict[str, ScreenshotHandler] = {}
+        self.delivered_local = 0
+        self.delivered_remote = 0
+        self.forwarded = 0
+
+    async def claim(self, session_id: str, handler: ScreenshotHandler) -> None:
+        """Route screenshots for a session to this process while it runs."""
+        self._handlers[session_id] = handler
+
+    async def release(self, session_id: str) -> None:
+        """Stop receiving screenshots for a session."""
+        self._handlers.pop(session_id, None)
+
+    async def deliver(
+        self,
+        session_id: str,
+        image: str | bytes,
+        request_id: Optional[str] = None,
+    ) -> Optional[dict[str, Any]]:
+        """
+        Deliver an uploaded screenshot to the worker running the session.
+
+        Returns:
+            The owner's response, a forwarding notice, or None if no worker
+            is running the session
+        """
+        handler = self._handlers.get(session_id)
+        if handler is not None:
+            self.delivered_local += 1
+            return handler(image, request_id)
+        return await self._forward(session_id, image, request_id)
+
+    async def _forward(
+        self,
+        session_id: str,
+        image: str | bytes,
+        request_id: Optional[str],
+    ) -> Optional[dict[str, Any]]:
+        """Hand a screenshot to another worker (no other workers locally)."""
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        """Get delivery counters."""
+        return {
+            "broker": self.name,
+            "claimed": len(self._handlers),
+            "delivered_local": self.delivered_local,
+            "delivered_remote": self.delivered_remote,
+            "forwarded": self.forwarded,
+        }
+
+    def start(self) -> None:
+        """Start background work (none for the local broker)."""
+
+    async def stop(self) -> None:
+        """Stop background work."""
+
+
+class SQLiteScreenshotBroker(ScreenshotBroker):
+    """Rendezvous through a shared SQLite database (WAL mode)."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS screenshot_owners ("
+            "session_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL, claimed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS screenshot_payloads ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "request_id TEXT, payload BLOB NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS screenshot_payloads_session ON screenshot_payloads (session_id)"
+        )
+        self._poller: Optional[asyncio.Task] = None
+        # Set when a session is claimed, so an idle poller wakes up
+        self._claimed = asyncio.Event()
+        # Database version (changes on other processes' commits) at the last take
+        self._data_version: Optional[int] = None
+        self._claims_refreshed = 0.0
+
+    async def claim(self, session_id: str, handler: ScreenshotHandler) -> None:
+        await super().claim(session_id, handler)
+        await asyncio.to_thread(self._claim_sync, session_id)
+        self._claimed.set()
+
+    def _claim_sync(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO screenshot_owners (session_id, worker_id, claimed_at) VALUES (?, ?, ?)",
+                (session_id, self.worker_id, time.time()),
+            )
+
+    async def release(self, session_id: str) -> None:
+        await super().release(session_id)
+        await asyncio.to_thread(self._release_sync, session_id)
+
+    def _release_sync(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM screenshot_owners WHERE session_id = ? AND worker_id = ?",
+                (session_id, self.worker_id),
+            )
+
+    async def _forward(
+        self,
+        session_id: str,
+        image: str | bytes,
+        request_id: Optional[str],
+    ) -> Optional[dict[str, Any]]:
+        return await asyncio.to_thread(self._forward_sync, session_id, image, request_id)
+
+    def _forward_sync(
+        self,
+        session_id: str,
+        image: str | bytes,
+        request_id: Optional[str],
+    ) -> Optional[dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT worker_id FROM screenshot_owners WHERE session_id = ? AND claimed_at > ?",
+                (session_id, time.time() - CLAIM_TIMEOUT),
+            ).fetchone()
+            if row is None:
+                return None
+            # The one copy: the payload as stored for the owner to read (text stays TEXT)
+            self._conn.execute(
+                "INSERT INTO screenshot_payloads (session_id, request_id, payload, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (session_id, request_id, image, time.time()),
+            )
+        self.forwarded += 1
+        return {"status": "received", "session_id": session_id, "forwarded_to": row[0]}
+
+    def _take_payloads(self, session_ids: list[str]) -> list[tuple[str, Optional[str], str | bytes]]:
+        """
+        Remove and return forwarded screenshots for local sessions; refresh claims.
+
+        Skipped (no write transaction) if no other process has committed
+        since the last take and the claims are still fresh.
+        """
+        now = time.time()
+        placeholders = ",".join("?" * len(session_ids))
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version and now - self._claims_refreshed < CLAIM_TIMEOUT / 3:
+                return []
+            self._data_version = data_version
+            self._claims_refreshed = now
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT id, session_id, request_id, payload FROM screenshot_payloads "
+                    f"WHERE session_id IN ({placeholders}) ORDER BY id",
+                    session_ids,
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        f"DELETE FROM screenshot_payloads WHERE id IN ({','.join('?' * len(rows))})",
+                        [r[0] for r in rows],
+                    )
+                self._conn.execute(
+                    "DELETE FROM screenshot_payloads WHERE created_at < ?", (now - PAYLOAD_TTL,)
+                )
+                self._conn.execute(
+                    f"UPDATE screenshot_owners SET claimed_at = ? "
+                    f"WHERE worker_id = ? AND session_id IN ({placeholders})",
+                    [now, self.worker_id, *session_ids],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        # Blobs come back as bytes and text as str, handed on as is
+        return [(r[1], r[2], r[3]) for r in rows]
+
+    async def _poll(self) -> None:
+        """Deliver forwarded screenshots to sessions claimed by this worker."""
+        while True:
+            if not self._handlers:
+                # Nothing to poll for until a run claims a session
+                self._claimed.clear()
+                await self._claimed.wait()
+            await asyncio.sleep(POLL_INTERVAL)
+            session_ids = list(self._handlers)
+            if not session_ids:
+                continue
+            try:
+                payloads = await asyncio.to_thread(self._take_payloads, session_ids)
+            except Exception as e:
+                print(f"⚠️ Screenshot broker poll failed: {e}")
+                continue
+
+            for session_id, request_id, payload in payloads:
+                handler = self._handlers.get(session_id)
+                if handler is None:
+                    continue
+                self.delivered_remote += 1
+                try:
+                    handler(payload, request_id)
+                except Exception as e:
+                    print(f"⚠️ Failed to deliver forwarded screenshot: {e}")
+
+    def start(self) -> None:
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        with self._lock:
+            self._conn.execute("DELETE FROM screenshot_owners WHERE worker_id = ?", (self.worker_id,))
+            self._conn.close()
+
+
+def create_screenshot_broker(kind: Optional[str] = None, path: Optional[str] = None) -> ScreenshotBroker:
+    """
+    Create a screenshot broker.
+
+    Args:
+        kind: "local" or "sqlite" (default from SCREENSHOT_BROKER)
+        path: Shared database file (default from SCREENSHOT_BROKER_PATH)
+    """
+    kind = (kind or os.getenv("SCREENSHOT_BROKER", "local")).lower()
+    if kind == "sqlite":
+        return SQLiteScreenshotBroker(path or os.getenv("SCREENSHOT_BROKER_PATH") or "cache/screenshots.db")
+    if kind != "local":
+        print(f"⚠️ Unknown screenshot broker '{kind}', using local")
+    return ScreenshotBroker()
@@ -0,0 +1,117 @@
+"""
+Perceptual screenshot diffing.
+
+Compares two screenshots with a perceptual hash and a downscaled pixel
+diff, so the verification loop can skip GPT-4o vision calls when nothing
+visible changed and report where the UI did change.
+"""
+import base64
+import io
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+
+# Screenshots are compared at this width (aspect ratio preserved)
+DIFF_WIDTH = 256
+
+# Per-pixel grayscale difference (0-255) that counts as a change
+PIXEL_THRESHOLD = 24
+
+# Below this fraction of changed pixels (and hash distance) images are "unchanged"
+UNCHANGED_RATIO = 0.001
+UNCHANGED_HASH_DISTANCE = 2
+
+
+class ScreenshotDiff:
+    """Result of comparing two screenshots."""
+
+    def __init__(
+        self,
+        hash_distance: int,
+        changed_ratio: float,
+        bbox: Optional[tuple[int, int, int, int]],
+        size: tuple[int, int],
+    ):
+        self.hash_distance = hash_distance  # Hamming distance of the 64-bit dHashes
+        self.changed_ratio = changed_ratio  # Fraction of pixels that changed
+        self.bbox = bbox  # (left, top, right, bottom) in pixels of the newer image
+        self.size = size  # (width, height) of the newer image
+
+    @property
+    def unchanged(self) -> bool:
+        """Whether the screenshots are visually identical."""
+        return self.hash_distance <= UNCHANGED_HASH_DISTANCE and self.changed_ratio < UNCHANGED_RATIO
+
+    def to_dict(self) -> dict[str, Any]:
+        """Serialize for events and logging."""
+        return {
+            "unchanged": self.unchanged,
+            "hashDistance": self.hash_distance,
+            "changedRatio": round(self.changed_ratio, 4),
+            "bbox": list(self.bbox) if self.bbox else None,
+            "width": self.size[0],
+            "height": self.size[1],
+        }
+
+
+def decode_screenshot(data: str | bytes) -> Image.Image:
+    """Decode a screenshot from raw bytes, base64 or a data URL."""
+    if isinstance(data, str):
+        if data.startswith("data:"):
+            data = data.split(",", 1)[1]
+        data = base64.b64decode(data)
+    return Image.open(io.BytesIO(data))
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash (horizontal gradients of a tiny grayscale image)."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _grayscale(image: Image.Image, size: tuple[int, int]) -> np.ndarray:
+    """Downscale to a common size and convert to a grayscale array."""
+    return np.asarray(image.convert("L").resize(size, Image.BILINEAR), dtype=np.int16)
+
+
+def compare_screenshots(before: str | bytes, after: str | bytes) -> ScreenshotDiff:
+    """
+    Compare two screenshots.
+
+    Args:
+        before: Earlier screenshot (bytes, base64 or data URL)
+        after: Newer screenshot
+
+    Returns:
+        ScreenshotDiff with hash distance, changed ratio and bounding box
+    """
+    img_before = decode_screenshot(before)
+    img_after = decode_screenshot(after)
+    width, height = img_after.size
+
+    distance = bin(dhash(img_before) ^ dhash(img_after)).count("1")
+
+    # Pixel diff on a downscaled copy (both images scaled to the newer one's aspect)
+    diff_height = max(1, round(height * DIFF_WIDTH / width))
+    size = (DIFF_WIDTH, diff_height)
+    mask = np.abs(_grayscale(img_before, size) - _grayscale(img_after, size)) > PIXEL_THRESHOLD
+    changed_ratio = float(mask.mean())
+
+    bbox = None
+    if mask.any():
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        scale_x = width / DIFF_WIDTH
+        scale_y = height / diff_height
+        bbox = (
+            int(cols[0] * scale_x),
+            int(rows[0] * scale_y),
+            min(width, int((cols[-1] + 1) * scale_x)),
+            min(height, int((rows[-1] + 1) * scale_y)),
+        )
+
+    return ScreenshotDiff(distance, changed_ratio, bbox, (width, height))
@@ -0,0 +1,206 @@
+"""
+Screenshot preprocessing for GPT-4o vision.
+
+Retina captures are millions of pixels and many vision tiles. Before a
+screenshot is analyzed it is cropped to its content, downsized to a tile
+budget and re-encoded as a compact JPEG/WebP. When the diff against the
+previous screenshot is known, a screen where almost nothing changed is
+sent at low detail, and a localized change is cropped to the area around
+it and sent at high detail.
+"""
+import base64
+import io
+import math
+from typing import Any, Optional
+
+from PIL import Image, ImageChops
+
+from .screenshot_diff import ScreenshotDiff, decode_screenshot
+
+
+# Max 512px tiles sent at high detail (85 + 170 tokens per tile)
+DEFAULT_MAX_TILES = 6
+
+# Below this fraction of changed pixels almost nothing changed, and a low
+# detail look is enough to confirm the screen is intact
+LOW_DETAIL_MAX_CHANGED_RATIO = 0.005
+
+# Changes whose bounding box (plus padding) covers at most this fraction of
+# the screen are localized: only that region is sent, at high detail
+CROP_MAX_AREA_RATIO = 0.5
+CROP_PADDING = 48
+
+# Channel difference from the border color that counts as content when cropping
+MARGIN_TOLERANCE = 8
+
+JPEG_QUALITY = 80
+
+# Low detail images are seen at 512x512 by the model, so larger is wasted
+LOW_DETAIL_SIZE = 512
+
+
+def vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Estimate the vision tokens OpenAI charges for an image."""
+    if detail == "low":
+        return 85
+
+    # Fit within 2048x2048, then shortest side to 768 (images are not upscaled)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def crop_uniform_margins(image: Image.Image) -> Image.Image:
+    """Crop away borders that are a single uniform color."""
+    rgb = image.convert("RGB")
+    background = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert("L")
+    mask = diff.point(lambda v: 255 if v > MARGIN_TOLERANCE else 0)
+    bbox = mask.getbbox()
+    if not bbox or bbox == (0, 0, *rgb.size):
+        return rgb
+    return rgb.crop(bbox)
+
+
+def change_region(
+    bbox: tuple[int, int, int, int],
+    size: tuple[int, int],
+) -> Optional[tuple[int, int, int, int]]:
+    """Padded crop box around a change, or None if it isn't localized."""
+    width, height = size
+    left, top, right, bottom = bbox
+    region = (
+        max(0, left - CROP_PADDING),
+        max(0, top - CROP_PADDING),
+        min(width, right + CROP_PADDING),
+        min(height, bottom + CROP_PADDING),
+    )
+    area = (region[2] - region[0]) * (region[3] - region[1])
+    if area <= 0 or area > CROP_MAX_AREA_RATIO * width * height:
+        return None
+    return region
+
+
+def fit_tile_budget(image: Image.Image, max_tiles: int = DEFAULT_MAX_TILES) -> Image.Image:
+    """Downscale until the image needs at most max_tiles high-detail tiles."""
+    max_tokens = 85 + 170 * max_tiles
+    width, height = image.size
+    scale = 1.0
+    while vision_tokens(int(width * scale), int(height * scale)) > max_tokens and scale > 0.05:
+        scale *= 0.9
+    if scale == 1.0:
+        return image
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+
+class PreparedScreenshot:
+    """A screenshot ready to send to the vision model."""
+
+    def __init__(
+        self,
+        data_url: str,
+        detail: str,
+        original_bytes: int,
+        prepared_bytes: int,
+        original_tokens: int,
+        prepared_tokens: int,
+        region: Optional[tuple[int, int, int, int]] = None,
+        size: Optional[tuple[int, int]] = None,
+    ):
+        self.data_url = data_url
+        self.detail = detail
+        self.original_bytes = original_bytes
+        self.prepared_bytes = prepared_bytes
+        self.original_tokens = original_tokens  # At detail=high, as uploaded
+        self.prepared_tokens = prepared_tokens
+        self.region = region  # Crop box in the original, if only the changed area is sent
+        self.size = size  # (width, height) of the original
+
+    def to_dict(self) -> dict[str, Any]:
+        """Savings summary for logging and stats."""
+        return {
+            "detail": self.detail,
+            "originalBytes": self.original_bytes,
+            "bytes": self.prepared_bytes,
+            "bytesSaved": self.original_bytes - self.prepared_bytes,
+            "originalTokens": self.original_tokens,
+            "tokens": self.prepared_tokens,
+            "tokensSaved": self.original_tokens - self.prepared_tokens,
+            "region": list(self.region) if self.region else None,
+        }
+
+
+def prepare_screenshot(
+    data: str | bytes,
+    diff: Optional[ScreenshotDiff] = None,
+    max_tiles: int = DEFAULT_MAX_TILES,
+    image_format: str = "JPEG",
+) -> PreparedScreenshot:
+    """
+    Crop, downsize and re-encode a screenshot for vision analysis.
+
+    Args:
+        data: Screenshot as bytes, base64 or data URL
+        diff: What changed since the reference screenshot, if known
+        max_tiles: High-detail tile budget
+        image_format: "JPEG" or "WEBP"
+
+    Returns:
+        PreparedScreenshot with the data URL, detail level and savings
+    """
+    if isinstance(data, str):
+        raw = data.split(",", 1)[1] if data.startswith("data:") else data
+        original_bytes = len(base64.b64decode(raw))
+    else:
+        original_bytes = len(data)
+
+    image = decode_screenshot(data)
+    size = image.size
+    original_tokens = vision_tokens(*size)
+
+    detail = "high"
+    region = None
+    if diff is not None and diff.changed_ratio < LOW_DETAIL_MAX_CHANGED_RATIO:
+        detail = "low"
+    elif diff is not None and diff.bbox and diff.size == size:
+        region = change_region(diff.bbox, size)
+
+    if region is not None:
+        image = image.convert("RGB").crop(region)
+    else:
+        image = crop_uniform_margins(image)
+    if detail == "low":
+        image.thumbnail((LOW_DETAIL_SIZE, LOW_DETAIL_SIZE), Image.LANCZOS)
+    else:
+        image = fit_tile_budget(image, max_tiles)
+
+    output = io.BytesIO()
+    if image_format.upper() == "WEBP":
+        image.save(output, format="WEBP", quality=JPEG_QUALITY)
+        mime = "image/webp"
+    else:
+        image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        mime = "image/jpeg"
+    encoded = output.getvalue()
+
+    # Flat UI screenshots often compress better losslessly
+    png = io.BytesIO()
+    image.save(png, format="PNG", optimize=True)
+    if png.tell() < len(encoded):
+        encoded = png.getvalue()
+        mime = "image/png"
+
+    return PreparedScreenshot(
+        data_url=f"data:{mime};base64,{base64.b64encode(encoded).decode('utf-8')}",
+        detail=detail,
+        original_bytes=original_bytes,
+        prepared_bytes=len(encoded),
+        original_tokens=original_tokens,
+        prepared_tokens=vision_tokens(*image.size, detail=detail),
+        region=region,
+        size=size,
+    )
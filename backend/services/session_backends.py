@@ -0,0 +1,422 @@
+"""
+Durable session persistence.
+
+Agent state is serialized to a compact binary blob (zlib-compressed JSON)
+and kept in a pluggable backend, so conversations survive restarts and
+any worker can rehydrate a session. Writes are deferred: a session's
+state is snapshotted when it is marked dirty after a request, and encoded
+and saved in the background, off the event loop.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+# Blob header: format marker + version
+BLOB_MAGIC = b"ECS1"
+
+# Seconds between write-behind flushes
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Persisted sessions older than this are purged (7 days)
+DEFAULT_RETENTION = 7 * 24 * 60 * 60
+
+# Memory backend bounds: blob count, total blob bytes and age (1 day)
+DEFAULT_MEMORY_MAX_ENTRIES = 10000
+DEFAULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MEMORY_RETENTION = 24 * 60 * 60
+
+
+def encode_state(state: dict[str, Any]) -> bytes:
+    """Encode agent state as a compressed blob."""
+    data = json.dumps(state, separators=(",", ":"), default=str).encode("utf-8")
+    return BLOB_MAGIC + zlib.compress(data, 6)
+
+
+def decode_state(blob: bytes) -> dict[str, Any]:
+    """Decode a blob produced by encode_state."""
+    if not blob.startswith(BLOB_MAGIC):
+        raise ValueError("Unknown session blob format")
+    return json.loads(zlib.decompress(blob[len(BLOB_MAGIC):]))
+
+
+class SessionBackend:
+    """
+    Base class for session persistence backends.
+
+    Methods are blocking; SessionPersister calls them in a worker thread.
+    Each stored blob carries a revision so workers can tell whether their
+    in-memory copy is stale.
+    """
+
+    name = "base"
+    # Whether other processes may write to the same store
+    shared = True
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        """Get (blob, revision) for a session, or None."""
+        raise NotImplementedError
+
+    def revision(self, session_id: str) -> Optional[int]:
+        """Get the stored revision for a session, or None."""
+        entry = self.load(session_id)
+        return entry[1] if entry else None
+
+    def save(self, session_id: str, blob: bytes, revision: int) -> None:
+        """Store a session blob."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        """Remove a session."""
+        raise NotImplementedError
+
+    def purge(self, older_than: float) -> int:
+        """Remove sessions last saved before a timestamp; returns count."""
+        return 0
+
+    def close(self) -> None:
+        """Release resources."""
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Process-local backend (the default).
+
+    Not durable, but sessions evicted from the live store stay resumable
+    as compressed blobs. Bounded by blob count and total bytes (least
+    recently saved evicted first) and by age (max_age seconds, also applied
+    on load).
+    """
+
+    name = "memory"
+    shared = False
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MEMORY_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MEMORY_MAX_BYTES,
+        max_age: float = DEFAULT_MEMORY_RETENTION,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.total_bytes = 0
+        # Saves and deletes come from worker threads
+        self._lock = threading.Lock()
+        self._blobs: OrderedDict[str, tuple[bytes, int, float]] = OrderedDict()
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        with self._lock:
+            entry = self._blobs.get(session_id)
+            if entry is None:
+                return None
+            if entry[2] < time.time() - self.max_age:
+                self._remove(session_id)
+                return None
+            return entry[0], entry[1]
+
+    def save(self, session_id: str, blob: bytes, revision: int) -> None:
+        with self._lock:
+            self._remove(session_id)
+            self._blobs[session_id] = (blob, revision, time.time())
+            self.total_bytes += len(blob)
+            while self._blobs and (len(self._blobs) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._blobs)))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._remove(session_id)
+
+    def purge(self, older_than: float) -> int:
+        older_than = max(older_than, time.time() - self.max_age)
+        with self._lock:
+            stale = [sid for sid, (_, _, saved_at) in self._blobs.items() if saved_at < older_than]
+            for sid in stale:
+                self._remove(sid)
+        return len(stale)
+
+    def _remove(self, session_id: str) -> None:
+        entry = self._blobs.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[0])
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite backend in WAL mode, shareable by workers on one host."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, blob BLOB NOT NULL, "
+            "revision INTEGER NOT NULL, saved_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_saved_at ON sessions (saved_at)")
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob, revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def revision(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id: str, blob: bytes, revision: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, blob, revision, saved_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "blob = excluded.blob, revision = excluded.revision, saved_at = excluded.saved_at "
+                "WHERE excluded.revision >= sessions.revision",
+                (session_id, sqlite3.Binary(blob), revision, time.time()),
+            )
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM sessions WHERE saved_at < ?", (older_than,)
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class FileSessionBackend(SessionBackend):
+    """One file per session (revision header + blob), replaced atomically."""
+
+    name = "file"
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, session_id: str) -> Path:
+        safe = "".join(c for c in session_id if c.isalnum() or c in "-_")
+        return self.directory / f"{safe}.session"
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        try:
+            data = self._path(session_id).read_bytes()
+        except FileNotFoundError:
+            return None
+        return data[8:], int.from_bytes(data[:8], "big")
+
+    def revision(self, session_id: str) -> Optional[int]:
+        try:
+            with self._path(session_id).open("rb") as f:
+                return int.from_bytes(f.read(8), "big")
+        except FileNotFoundError:
+            return None
+
+    def save(self, session_id: str, blob: bytes, revision: int) -> None:
+        path = self._path(session_id)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(revision.to_bytes(8, "big") + blob)
+        tmp.replace(path)
+
+    def delete(self, session_id: str) -> None:
+        self._path(session_id).unlink(missing_ok=True)
+
+    def purge(self, older_than: float) -> int:
+        removed = 0
+        for path in self.directory.glob("*.session"):
+            try:
+                if path.stat().st_mtime < older_than:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def create_session_backend(kind: Optional[str] = None, path: Optional[str] = None) -> SessionBackend:
+    """
+    Create a session backend.
+
+    Args:
+        kind: "memory", "sqlite" or "file" (default from SESSION_BACKEND)
+        path: Database file or directory (default from SESSION_BACKEND_PATH)
+    """
+    kind = (kind or os.getenv("SESSION_BACKEND", "memory")).lower()
+    path = path or os.getenv("SESSION_BACKEND_PATH")
+
+    if kind == "sqlite":
+        return SQLiteSessionBackend(path or "cache/sessions.db")
+    if kind == "file":
+        return FileSessionBackend(path or "cache/sessions")
+    if kind != "memory":
+        print(f"⚠️ Unknown session backend '{kind}', using memory")
+    return MemorySessionBackend(
+        max_bytes=int(float(os.getenv("SESSION_MEMORY_BACKEND_MB", "64")) * 1024 * 1024),
+        max_age=float(os.getenv("SESSION_MEMORY_BACKEND_TTL", str(DEFAULT_MEMORY_RETENTION))),
+    )
+
+
+class SessionPersister:
+    """
+    Write-behind persistence for live session objects.
+
+    mark_dirty snapshots a session's state (serialize must return data the
+    live object won't change later) and assigns it a new revision; a
+    background task encodes and saves dirty snapshots every flush_interval
+    seconds, in a worker thread.
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        serialize: Callable[[Any], dict[str, Any]],
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        retention_seconds: float = DEFAULT_RETENTION,
+    ):
+        self.backend = backend
+        self.serialize = serialize
+        self.flush_interval = flush_interval
+        self.retention_seconds = retention_seconds
+        # session_id -> (state snapshot, revision)
+        self._dirty: dict[str, tuple[dict[str, Any], int]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.saves = 0
+        self.loads = 0
+        self.bytes_written = 0
+        self.failures = 0
+
+    @staticmethod
+    def new_revision() -> int:
+        """Revision numbers are nanosecond timestamps (comparable across workers)."""
+        return time.time_ns()
+
+    def mark_dirty(self, session_id: str, value: Any) -> int:
+        """
+        Snapshot a session and queue it to be saved.
+
+        Call this when the session is at rest (after a request), so a save
+        never captures a run halfway through.
+
+        Returns:
+            The snapshot's revision
+        """
+        revision = self.new_revision()
+        try:
+            self._dirty[session_id] = (self.serialize(value), revision)
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Failed to snapshot session {session_id}: {e}")
+        return revision
+
+    async def load(self, session_id: str) -> Optional[tuple[dict[str, Any], int]]:
+        """Load (state, revision) for a session, or None."""
+        try:
+            entry = await asyncio.to_thread(self.backend.load, session_id)
+            if entry is None:
+                return None
+            blob, revision = entry
+            self.loads += 1
+            return decode_state(blob), revision
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Failed to load session {session_id}: {e}")
+            return None
+
+    async def revision(self, session_id: str) -> Optional[int]:
+        """Get the stored revision for a session, or None."""
+        try:
+            return await asyncio.to_thread(self.backend.revision, session_id)
+        except Exception as e:
+            print(f"⚠️ Failed to read session revision: {e}")
+            return None
+
+    async def delete(self, session_id: str) -> None:
+        """Remove a session from the backend."""
+        self._dirty.pop(session_id, None)
+        await asyncio.to_thread(self.backend.delete, session_id)
+
+    async def flush(self) -> int:
+        """Save every dirty session now; returns the number saved."""
+        dirty, self._dirty = self._dirty, {}
+        saved = 0
+        for session_id, (state, revision) in dirty.items():
+            try:
+                blob = await asyncio.to_thread(self._encode_and_save, session_id, state, revision)
+                saved += 1
+                self.bytes_written += len(blob)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Failed to save session {session_id}: {e}")
+        self.saves += saved
+        return saved
+
+    def _encode_and_save(self, session_id: str, state: dict[str, Any], revision: int) -> bytes:
+        """Encode and store a snapshot (runs in a worker thread); returns the blob."""
+        blob = encode_state(state)
+        self.backend.save(session_id, blob, revision)
+        return blob
+
+    def stats(self) -> dict[str, Any]:
+        """Get persistence counters."""
+        return {
+            "backend": self.backend.name,
+            "dirty": len(self._dirty),
+            "saves": self.saves,
+            "loads": self.loads,
+            "bytes_written": self.bytes_written,
+            "failures": self.failures,
+        }
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop."""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher and save anything still dirty."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        self.backend.close()
+
+    async def _run(self) -> None:
+        """Flush periodically and purge old sessions about once an hour."""
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+            now = time.time()
+            if now - last_purge > 60 * 60:
+                last_purge = now
+                try:
+                    purged = await asyncio.to_thread(self.backend.purge, now - self.retention_seconds)
+                    if purged:
+                        print(f"🧹 Purged {purged} persisted sessions")
+                except Exception as e:
+                    print(f"⚠️ Failed to purge sessions: {e}")
@@ -0,0 +1,210 @@
+"""
+Per-session run queue.
+
+Overlapping /api/customize calls for one session would mutate the same
+agent concurrently. Runs for a session hold a per-session slot, and a new
+prompt for a busy session follows a policy:
+
+- serialize: wait for the in-flight run to finish
+- reject: fail immediately
+- cancel: cancel the in-flight (and any queued) run, then start
+
+Each run drives its event stream in its own task, so cancelling it (on
+supersede or client disconnect) aborts whatever the agent is awaiting
+(OpenAI, Gemini, image edits). Events pass through a bounded buffer, so
+a stalled client pauses the run instead of having it buffered in memory.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional, TypeVar
+
+
+RUN_POLICIES = ("serialize", "reject", "cancel")
+DEFAULT_RUN_POLICY = "serialize"
+
+# Why a run was cancelled
+SUPERSEDED = "Superseded by a newer prompt"
+CLIENT_DISCONNECTED = "Client disconnected"
+STREAM_CLOSED = "Stream closed"
+
+# Events a run may get ahead of its client before it waits
+EVENT_BUFFER_SIZE = 64
+
+T = TypeVar("T")
+
+# Marks the end of a run's event stream
+_DONE = object()
+
+
+class SessionBusyError(Exception):
+    """A run is already in progress and the policy is reject."""
+
+
+class RunCancelled(Exception):
+    """The run was cancelled (e.g. superseded by a newer prompt)."""
+
+
+class SessionRun:
+    """One queued or running customization request for a session."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def cancel(self, reason: str) -> None:
+        """Cancel the run (before it starts, or while its task runs)."""
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    async def stream(self, events: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        Drive an event stream in a separate task and yield its events.
+
+        The task waits whenever EVENT_BUFFER_SIZE events are unread.
+
+        Raises:
+            RunCancelled: If the run was cancelled before finishing
+        """
+        if self.cancelled:
+            await events.aclose()
+            raise RunCancelled(self.cancel_reason)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        # Free buffer slots; the end marker never waits for one
+        room = asyncio.Semaphore(EVENT_BUFFER_SIZE)
+
+        async def pump() -> None:
+            try:
+                async for event in events:
+                    await room.acquire()
+                    queue.put_nowait(event)
+            finally:
+                queue.put_nowait(_DONE)
+
+        self.task = asyncio.create_task(pump())
+        try:
+            while True:
+                event = await queue.get()
+                if event is _DONE:
+                    break
+                room.release()
+                yield event
+
+            if self.task.cancelled():
+                raise RunCancelled(self.cancel_reason or "Run cancelled")
+            # Re-raise errors from the event stream
+            self.task.result()
+        finally:
+            # The consumer went away (or failed): stop the work too
+            if not self.task.done():
+                self.cancel(self.cancel_reason or STREAM_CLOSED)
+
+    async def wait_finished(self) -> None:
+        """Wait for the run's task to finish its cleanup."""
+        if self.task is None or self.task.done():
+            return
+        try:
+            await asyncio.shield(asyncio.wait({self.task}))
+        except asyncio.CancelledError:
+            pass
+
+
+class SessionRunQueue:
+    """Serializes runs per session according to a busy policy."""
+
+    def __init__(self, policy: str = DEFAULT_RUN_POLICY):
+        if policy not in RUN_POLICIES:
+            print(f"⚠️ Unknown run policy '{policy}', using {DEFAULT_RUN_POLICY}")
+            policy = DEFAULT_RUN_POLICY
+        self.policy = policy
+        self._locks: dict[str, asyncio.Lock] = {}
+        # Runs holding or waiting for each session's slot, oldest first
+        self._runs: dict[str, list[SessionRun]] = {}
+
+        self.started = 0
+        self.queued = 0
+        self.rejected = 0
+        # Cancellation reason -> count
+        self.cancelled: dict[str, int] = {}
+
+    def is_busy(self, session_id: str) -> bool:
+        """Check whether a session has a run in progress or queued."""
+        return bool(self._runs.get(session_id))
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        session_id: str,
+        policy: Optional[str] = None,
+        run: Optional[SessionRun] = None,
+    ) -> AsyncIterator[SessionRun]:
+        """
+        Hold a session's slot for the duration of a run.
+
+        Args:
+            session_id: Session to run in
+            policy: Busy policy for this request (default: the queue's)
+            run: Run to enqueue, if the caller needs it before the slot is free
+
+        Raises:
+            SessionBusyError: If the session is busy and the policy is reject
+            RunCancelled: If a newer run superseded this one while it waited
+        """
+        policy = policy or self.policy
+        runs = self._runs.setdefault(session_id, [])
+
+        if runs:
+            if policy == "reject":
+                self.rejected += 1
+                raise SessionBusyError(f"Session {session_id} is busy with another request")
+            if policy == "cancel":
+                for other in runs:
+                    if not other.cancelled:
+                        other.cancel(SUPERSEDED)
+            else:
+                self.queued += 1
+
+        run = run or SessionRun(session_id)
+        runs.append(run)
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                if run.cancelled:
+                    raise RunCancelled(run.cancel_reason)
+                self.started += 1
+                try:
+                    yield run
+                finally:
+                    # Let the cancelled work clean up before the next run starts
+                    await run.wait_finished()
+        finally:
+            if run.cancelled:
+                self.cancelled[run.cancel_reason] = self.cancelled.get(run.cancel_reason, 0) + 1
+            runs.remove(run)
+            if not runs:
+                self._runs.pop(session_id, None)
+                self._locks.pop(session_id, None)
+
+    def stats(self) -> dict[str, Any]:
+        """Get run counters."""
+        return {
+            "policy": self.policy,
+            "busy_sessions": len(self._runs),
+            "started": self.started,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "cancelled": dict(self.cancelled),
+        }
+
+
+def get_default_run_policy() -> str:
+    """Busy policy from SESSION_RUN_POLICY."""
+    return os.getenv("SESSION_RUN_POLICY", DEFAULT_RUN_POLICY).lower()
@@ -0,0 +1,263 @@
+"""
+In-process session store with TTL expiry and LRU eviction.
+
+Expiry deadlines live in a min-heap, so a background sweeper removes
+expired sessions in O(log n) each instead of scanning every session on
+each request. Past the session count cap the least recently used
+sessions are evicted; under memory pressure the biggest idle sessions go
+first, since they free the most for the fewest users disturbed.
+"""
+import asyncio
+import heapq
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+# Sessions idle longer than this expire (30 minutes)
+DEFAULT_SESSION_TIMEOUT = 30 * 60
+
+# Hard caps (LRU eviction past either)
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Longest the sweeper sleeps between checks
+SWEEP_INTERVAL = 30.0
+
+
+class SessionStore:
+    """
+    Sessions keyed by ID with a deadline heap and LRU order.
+
+    Touching a session pushes a new heap entry rather than updating the old
+    one; stale entries are recognized by their version and skipped.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_SESSION_TIMEOUT,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        size_fn: Optional[Callable[[Any], int]] = None,
+        busy_fn: Optional[Callable[[str], bool]] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn or (lambda value: 0)
+        # Sessions with a request in progress are never evicted
+        self.busy_fn = busy_fn or (lambda session_id: False)
+
+        # session_id -> (value, version, size, last used), least recently used first
+        self._sessions: OrderedDict[str, tuple[Any, int, int, float]] = OrderedDict()
+        # (deadline, version, session_id)
+        self._deadlines: list[tuple[float, int, str]] = []
+        self._version = 0
+        self.total_bytes = 0
+
+        self.expirations = 0
+        self.evictions = 0
+        self.memory_evictions = 0
+        self._sweeper: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Get a session and mark it as recently used."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        self._schedule(session_id, entry[0], entry[2])
+        return entry[0]
+
+    def put(self, session_id: str, value: Any) -> None:
+        """Add or replace a session, evicting others if over a cap."""
+        self._schedule(session_id, value, self._measure(value))
+        self._enforce_caps(keep=session_id)
+
+    def touch(self, session_id: str) -> None:
+        """Refresh a session's deadline and re-measure its size."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return
+        self._schedule(session_id, entry[0], self._measure(entry[0]))
+        self._enforce_caps(keep=session_id)
+
+    def entries(self) -> list[dict[str, Any]]:
+        """Every session with its measured size and idle time, without touching them."""
+        now = time.time()
+        return [
+            {
+                "session_id": session_id,
+                "value": value,
+                "bytes": size,
+                "idle_seconds": round(now - last_used, 1),
+            }
+            for session_id, (value, _, size, last_used) in self._sessions.items()
+        ]
+
+    def remove(self, session_id: str) -> Optional[Any]:
+        """Remove a session; its heap entry is dropped lazily."""
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        self.total_bytes -= entry[2]
+        return entry[0]
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """
+        Remove every session whose deadline has passed.
+
+        Busy sessions are kept and get a fresh deadline.
+
+        Returns:
+            Number of sessions expired
+        """
+        now = time.time() if now is None else now
+        expired = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, version, session_id = heapq.heappop(self._deadlines)
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] != version:
+                continue
+            if self._is_busy(session_id):
+                heapq.heappush(self._deadlines, (now + self.ttl_seconds, version, session_id))
+                continue
+            self.remove(session_id)
+            expired += 1
+
+        if expired:
+            self.expirations += expired
+            print(f"🧹 Cleaned up {expired} expired sessions")
+        return expired
+
+    def stats(self) -> dict[str, Any]:
+        """Get session gauges."""
+        return {
+            "live_sessions": len(self._sessions),
+            "total_bytes": self.total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "memory_evictions": self.memory_evictions,
+        }
+
+    def start(self) -> None:
+        """Start the background sweeper on the running event loop."""
+        if self._sweeper is None or self._sweeper.done():
+            self._wakeup = asyncio.Event()
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        """Stop the background sweeper."""
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+    async def _sweep(self) -> None:
+        """Sleep until the next deadline (or SWEEP_INTERVAL), then expire."""
+        while True:
+            self.expire()
+            delay = SWEEP_INTERVAL
+            if self._deadlines:
+                delay = min(delay, max(0.0, self._deadlines[0][0] - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _schedule(self, session_id: str, value: Any, size: int) -> None:
+        """Record a session as most recently used with a fresh deadline."""
+        previous = self._sessions.pop(session_id, None)
+        if previous is not None:
+            self.total_bytes -= previous[2]
+
+        self._version += 1
+        now = time.time()
+        self._sessions[session_id] = (value, self._version, size, now)
+        self.total_bytes += size
+        deadline = now + self.ttl_seconds
+        if not self._deadlines or deadline < self._deadlines[0][0]:
+            # Earlier than anything the sweeper is sleeping towards
+            self._wakeup.set()
+        heapq.heappush(self._deadlines, (deadline, self._version, session_id))
+
+        # Rebuild once stale entries dominate the heap
+        if len(self._deadlines) > 2 * len(self._sessions) + 64:
+            self._deadlines = [
+                (deadline, version, sid)
+                for deadline, version, sid in self._deadlines
+                if sid in self._sessions and self._sessions[sid][1] == version
+            ]
+            heapq.heapify(self._deadlines)
+
+    def _enforce_caps(self, keep: Optional[str] = None) -> None:
+        """Evict sessions until under both caps (never `keep` or busy sessions)."""
+        evicted = 0
+        if len(self._sessions) > self.max_sessions:
+            # Count cap: least recently used first
+            for session_id in list(self._sessions):
+                if len(self._sessions) <= self.max_sessions:
+                    break
+                if session_id != keep and not self._is_busy(session_id):
+                    self.remove(session_id)
+                    evicted += 1
+
+        freed = 0
+        if self.total_bytes > self.max_bytes:
+            # Memory cap: biggest idle sessions first
+            candidates = sorted(
+                (
+                    (size, session_id)
+                    for session_id, (_, _, size, _) in self._sessions.items()
+                    if session_id != keep and not self._is_busy(session_id)
+                ),
+                reverse=True,
+            )
+            for size, session_id in candidates:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.remove(session_id)
+                evicted += 1
+                freed += 1
+
+        if evicted:
+            self.evictions += evicted
+            self.memory_evictions += freed
+            print(f"🧹 Evicted {evicted} sessions ({freed} for memory)")
+
+    def _is_busy(self, session_id: str) -> bool:
+        try:
+            return bool(self.busy_fn(session_id))
+        except Exception:
+            return False
+
+    def _measure(self, value: Any) -> int:
+        """Estimate a session's memory, treating failures as zero."""
+        try:
+            return int(self.size_fn(value))
+        except Exception as e:
+            print(f"⚠️ Failed to measure session size: {e}")
+            return 0
+
+
+def load_session_store_config() -> dict[str, Any]:
+    """Read session store limits from the environment."""
+    return {
+        "ttl_seconds": float(os.getenv("SESSION_TIMEOUT", str(DEFAULT_SESSION_TIMEOUT))),
+        "max_sessions": int(os.getenv("MAX_SESSIONS", str(DEFAULT_MAX_SESSIONS))),
+        "max_bytes": int(float(os.getenv("MAX_SESSION_MEMORY_MB", str(DEFAULT_MAX_BYTES // (1024 * 1024)))) * 1024 * 1024),
+    }
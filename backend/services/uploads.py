@@ -0,0 +1,67 @@
+"""
+Streaming upload helpers.
+
+Request bodies are read into a single buffer as they arrive, with the size
+limit checked per chunk, so large binary uploads never need base64 or JSON
+parsing and are held in memory once.
+"""
+import os
+from typing import AsyncIterator, Optional
+
+from starlette.datastructures import UploadFile
+
+
+# Largest screenshot accepted
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_SCREENSHOT_MB", "25")) * 1024 * 1024)
+
+# Multipart uploads are read back from Starlette's spool file in chunks this size
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """The upload exceeded the size limit."""
+
+
+def check_content_length(value: Optional[str], max_bytes: int = MAX_UPLOAD_BYTES) -> None:
+    """
+    Reject a body up front from its Content-Length header, if given.
+
+    Raises:
+        UploadTooLargeError: If the declared size is larger than max_bytes
+    """
+    if value and value.isdigit() and int(value) > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+
+
+async def spool_stream(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int = MAX_UPLOAD_BYTES,
+) -> bytearray:
+    """
+    Read a streamed body into one buffer.
+
+    The chunks are appended to a bytearray that is returned as is, so the
+    body is never copied into a second buffer.
+
+    Args:
+        chunks: Body chunks (e.g. Request.stream())
+        max_bytes: Size limit
+
+    Returns:
+        The body
+
+    Raises:
+        UploadTooLargeError: If the body is larger than max_bytes
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+        buffer += chunk
+    return buffer
+
+
+async def iter_upload(upload: UploadFile) -> AsyncIterator[bytes]:
+    """Chunks of a Starlette UploadFile, for spool_stream."""
+    while chunk := await upload.read(READ_CHUNK_BYTES):
+        yield chunk
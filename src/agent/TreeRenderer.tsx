@@ -12,6 +12,14 @@ import React from 'react';
 import { View, Text } from 'react-native';
 import { useUITree } from './UITreeContext';
 import useRegister from '../register/hooks/useRegister';
+import { API_ENDPOINT } from '../lib/api';
+
+// Generated images are stored by the backend and referenced by relative URLs
+const BLOB_ROUTE = '/api/blobs/';
+
+function resolveBlobUrl(value: unknown): unknown {
+  return typeof value === 'string' && value.startsWith(BLOB_ROUTE) ? `${API_ENDPOINT}${value}` : value;
+}
 
 interface TreeRendererProps {
   elementKey: string;
@@ -89,7 +97,7 @@ export function TreeRenderer({ elementKey, fallback = null }: TreeRendererProps)
         return false;
       }
       return true;
-    })
+    }).map(([key, value]) => [key, resolveBlobUrl(value)])
   );
   
   
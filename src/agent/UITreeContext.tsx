@@ -24,6 +24,152 @@ const UITreeContext = createContext<UITreeContextValue>({
   applyPatch: () => {},
 });
 
+// RFC 6901: "~1" is "/" and "~0" is "~" inside a path token
+function unescapePointerToken(token: string): string {
+  return token.replace(/~1/g, '/').replace(/~0/g, '~');
+}
+
+// Apply an RFC 6902 add/replace/remove at a path inside a value,
+// copying the containers along the path
+function applyPointerOp(target: any, tokens: string[], op: string, value: any): any {
+  const [head, ...rest] = tokens;
+  if (Array.isArray(target)) {
+    const copy = [...target];
+    const index = head === '-' ? copy.length : Number(head);
+    if (rest.length) {
+      copy[index] = applyPointerOp(copy[index], rest, op, value);
+    } else if (op === 'add') {
+      copy.splice(index, 0, value);
+    } else if (op === 'remove') {
+      copy.splice(index, 1);
+    } else {
+      copy[index] = value;
+    }
+    return copy;
+  }
+  const copy = { ...(target || {}) };
+  if (rest.length) {
+    copy[head] = applyPointerOp(copy[head], rest, op, value);
+  } else if (op === 'remove') {
+    delete copy[head];
+  } else {
+    copy[head] = value;
+  }
+  return copy;
+}
+
+/**
+ * Apply one server patch to a tree without mutating it (same semantics as
+ * the backend's UITree.apply_patch). Returns prev if the patch doesn't apply.
+ */
+export function applyTreePatch(prev: UITree, patch: { op: string; path: string; value?: any }): UITree {
+  // Parse path like "/elements/main-banner/props" (RFC 6901 tokens)
+  const pathParts = patch.path.split('/').slice(1).map(unescapePointerToken);
+
+  if (pathParts[0] !== 'elements' || pathParts.length < 2) {
+    return prev;
+  }
+  
+  const elementKey = pathParts[1];
+  const property = pathParts[2];
+  const newElements = { ...prev.elements };
+  
+  // Deeper paths (e.g. /elements/hero/props/style/color) are plain RFC 6902 ops
+  if (pathParts.length > 3) {
+    const element = newElements[elementKey];
+    if (!element) {
+      console.warn('Element not found for patch:', elementKey);
+      return prev;
+    }
+    newElements[elementKey] = {
+      ...element,
+      [property]: applyPointerOp((element as any)[property], pathParts.slice(3), patch.op, patch.value),
+    };
+    return { ...prev, elements: newElements };
+  }
+  
+  switch (patch.op) {
+    case 'replace':
+      if (!newElements[elementKey]) {
+        console.warn('Element not found for replace:', elementKey);
+        return prev;
+      }
+      
+      if (property === 'props') {
+        // Deep merge props - especially important for style objects
+        const currentElement = newElements[elementKey];
+        const currentProps = currentElement.props || {};
+        const newProps = patch.value || {};
+        
+        // Deep merge style objects
+        let mergedStyle = currentProps.style;
+        if (newProps.style) {
+          mergedStyle = { ...currentProps.style, ...newProps.style };
+        }
+        
+        // Deep merge textStyle objects
+        let mergedTextStyle = currentProps.textStyle;
+        if (newProps.textStyle) {
+          mergedTextStyle = { ...currentProps.textStyle, ...newProps.textStyle };
+        }
+        
+        // Merge all props, with deep-merged style objects
+        const mergedProps = {
+          ...currentProps,
+          ...newProps,
+          ...(mergedStyle ? { style: mergedStyle } : {}),
+          ...(mergedTextStyle ? { textStyle: mergedTextStyle } : {}),
+        };
+        
+        newElements[elementKey] = { 
+          ...currentElement,
+          props: mergedProps
+        };
+      } else if (property === 'children') {
+        // Update children array (for reorder/move)
+        // Deduplicate to prevent React key errors
+        const rawChildren = patch.value || [];
+        const seen = new Set<string>();
+        const uniqueChildren = rawChildren.filter((key: string) => {
+          if (seen.has(key)) return false;
+          seen.add(key);
+          return true;
+        });
+        newElements[elementKey] = { 
+          ...newElements[elementKey], 
+          children: uniqueChildren 
+        };
+      } else if (property === 'parentKey') {
+        // Update parent reference
+        newElements[elementKey] = { 
+          ...newElements[elementKey], 
+          parentKey: patch.value 
+        };
+      }
+      break;
+      
+    case 'add':
+      // Add new element (path is /elements/{key}, value is full element)
+      // NOTE: Backend sends a separate 'replace children' patch, so we DON'T 
+      // auto-add to parent here - that would cause duplicates
+      console.log('➕ Adding new element:', elementKey);
+      newElements[elementKey] = patch.value;
+      break;
+      
+    case 'remove':
+      // Remove element
+      console.log('➖ Removing element:', elementKey);
+      delete newElements[elementKey];
+      break;
+      
+    default:
+      console.warn('Unknown patch operation:', patch.op);
+      return prev;
+  }
+  
+  return { ...prev, elements: newElements };
+}
+
 interface UITreeProviderProps {
   children: ReactNode;
 }
@@ -63,99 +209,7 @@ export function UITreeProvider({ children }: UITreeProviderProps) {
     // Minimal logging - just op and path
     console.log(`📦 Patch: ${patch.op} ${patch.path}`);
     
-    // Parse path like "/elements/main-banner/props"
-    const pathParts = patch.path.split('/').filter(Boolean);
-    
-    setTreeState(prev => {
-      if (pathParts[0] !== 'elements' || pathParts.length < 2) {
-        return prev;
-      }
-      
-      const elementKey = pathParts[1];
-      const property = pathParts[2];
-      const newElements = { ...prev.elements };
-      
-      switch (patch.op) {
-        case 'replace':
-          if (!newElements[elementKey]) {
-            console.warn('Element not found for replace:', elementKey);
-            return prev;
-          }
-          
-          if (property === 'props') {
-            // Deep merge props - especially important for style objects
-            const currentElement = newElements[elementKey];
-            const currentProps = currentElement.props || {};
-            const newProps = patch.value || {};
-            
-            // Deep merge style objects
-            let mergedStyle = currentProps.style;
-            if (newProps.style) {
-              mergedStyle = { ...currentProps.style, ...newProps.style };
-            }
-            
-            // Deep merge textStyle objects
-            let mergedTextStyle = currentProps.textStyle;
-            if (newProps.textStyle) {
-              mergedTextStyle = { ...currentProps.textStyle, ...newProps.textStyle };
-            }
-            
-            // Merge all props, with deep-merged style objects
-            const mergedProps = {
-              ...currentProps,
-              ...newProps,
-              ...(mergedStyle ? { style: mergedStyle } : {}),
-              ...(mergedTextStyle ? { textStyle: mergedTextStyle } : {}),
-            };
-            
-            newElements[elementKey] = { 
-              ...currentElement,
-              props: mergedProps
-            };
-          } else if (property === 'children') {
-            // Update children array (for reorder/move)
-            // Deduplicate to prevent React key errors
-            const rawChildren = patch.value || [];
-            const seen = new Set<string>();
-            const uniqueChildren = rawChildren.filter((key: string) => {
-              if (seen.has(key)) return false;
-              seen.add(key);
-              return true;
-            });
-            newElements[elementKey] = { 
-              ...newElements[elementKey], 
-              children: uniqueChildren 
-            };
-          } else if (property === 'parentKey') {
-            // Update parent reference
-            newElements[elementKey] = { 
-              ...newElements[elementKey], 
-              parentKey: patch.value 
-            };
-          }
-          break;
-          
-        case 'add':
-          // Add new element (path is /elements/{key}, value is full element)
-          // NOTE: Backend sends a separate 'replace children' patch, so we DON'T 
-          // auto-add to parent here - that would cause duplicates
-          console.log('➕ Adding new element:', elementKey);
-          newElements[elementKey] = patch.value;
-          break;
-          
-        case 'remove':
-          // Remove element
-          console.log('➖ Removing element:', elementKey);
-          delete newElements[elementKey];
-          break;
-          
-        default:
-          console.warn('Unknown patch operation:', patch.op);
-          return prev;
-      }
-      
-      return { ...prev, elements: newElements };
-    });
+    setTreeState(prev => applyTreePatch(prev, patch));
     
     // Increment render version after state update to force re-renders
     setRenderVersion(v => v + 1);
@@ -4,6 +4,7 @@
  */
 import { useState, useCallback, useRef } from 'react';
 import { UITree } from '../catalog';
+import { applyTreePatch } from '../UITreeContext';
 
 // Simple theme type (themes removed, keeping for API compatibility)
 export interface Theme {
@@ -31,18 +32,23 @@ export interface CustomizeEvent {
     | 'plan'
     | 'todo_update'
     | 'patch'
+    | 'patch_batch'
     | 'theme_update'
     | 'screenshot_request'
     | 'validation_warning'
     | 'error'
+    | 'cancelled'
+    | 'resync_required'
     | 'complete';
   message?: string;
   todos?: TodoItem[];
   patch?: PatchOperation;
+  patches?: PatchOperation[];  // For patch batches, in order
   theme?: Theme;
   issues?: string[];
   request_id?: string;  // For screenshot requests
   session_id?: string;  // Session ID for matching agent
+  version?: number;  // Server tree version after a patch / at completion
 }
 
 export interface UseAgentCustomizationOptions {
@@ -63,6 +69,19 @@ export interface UseAgentCustomizationResult {
   statusMessage: string | null;
   customize: (prompt: string, currentTree: UITree, currentTheme?: Theme) => Promise<void>;
   cancel: () => void;
+  undo: () => Promise<void>;  // Revert the session's latest request
+  redo: () => Promise<void>;  // Reapply the latest undone request
+}
+
+// Structural equality for JSON values (trees from the app vs our mirror)
+function jsonEqual(a: unknown, b: unknown): boolean {
+  if (a === b) return true;
+  if (typeof a !== 'object' || typeof b !== 'object' || a === null || b === null) return false;
+  if (Array.isArray(a) !== Array.isArray(b)) return false;
+  const aKeys = Object.keys(a as object).filter((k) => (a as any)[k] !== undefined);
+  const bKeys = Object.keys(b as object).filter((k) => (b as any)[k] !== undefined);
+  if (aKeys.length !== bKeys.length) return false;
+  return aKeys.every((k) => jsonEqual((a as any)[k], (b as any)[k]));
 }
 
 /**
@@ -89,6 +108,22 @@ export function useAgentCustomization(
 
   const abortControllerRef = useRef<AbortController | null>(null);
 
+  // Server tree version and our copy of the tree at that version. While the
+  // app's tree still equals the copy, requests send base_version instead of
+  // the whole tree.
+  const versionRef = useRef<number | null>(null);
+  const serverTreeRef = useRef<UITree | null>(null);
+  const resyncRef = useRef(false);
+
+  const trackPatches = (patches: PatchOperation[], version?: number) => {
+    if (serverTreeRef.current) {
+      serverTreeRef.current = patches.reduce(applyTreePatch, serverTreeRef.current);
+    }
+    if (version !== undefined) {
+      versionRef.current = version;
+    }
+  };
+
   // Process SSE events - using ref to avoid stale closures
   const processEventRef = useRef<(event: CustomizeEvent) => void>(() => {});
 
@@ -108,10 +143,20 @@ export function useAgentCustomization(
       case 'patch':
         if (event.patch) {
           console.log('🔧 Applying patch:', event.patch.op, event.patch.path);
+          trackPatches([event.patch], event.version);
           onPatch?.(event.patch);
         }
         break;
 
+      case 'patch_batch':
+        if (event.patches) {
+          console.log(`🔧 Applying ${event.patches.length} batched patches`);
+          trackPatches(event.patches, event.version);
+          // Applied in one synchronous pass, so React renders once
+          event.patches.forEach((patch) => onPatch?.(patch));
+        }
+        break;
+
       case 'theme_update':
         if (event.theme) {
           onThemeChange?.(event.theme);
@@ -123,6 +168,7 @@ export function useAgentCustomization(
         // Handle asynchronously - don't block event processing
         if (onScreenshotRequest && event.session_id) {
           const sessionId = event.session_id;
+          const requestId = event.request_id;
           (async () => {
             try {
               console.log('📸 Capturing screenshot...');
@@ -136,12 +182,25 @@ export function useAgentCustomization(
               
               console.log('📸 Screenshot captured, length:', screenshot.length);
               
-              // Send screenshot back to backend
-              const response = await fetch(`${apiEndpoint}/api/screenshot/${sessionId}`, {
+              // Send screenshot back to backend as binary (no base64 JSON body)
+              const dataUrl = screenshot.startsWith('data:')
+                ? screenshot
+                : `data:image/png;base64,${screenshot}`;
+              const image = await (await fetch(dataUrl)).blob();
+              const query = requestId ? `?request_id=${encodeURIComponent(requestId)}` : '';
+              let response = await fetch(`${apiEndpoint}/api/screenshot/${sessionId}/raw${query}`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ image_base64: screenshot }),
+                headers: { 'Content-Type': image.type || 'image/png' },
+                body: image,
               });
+              if (response.status === 404 || response.status === 405) {
+                // Older backend without the binary route
+                response = await fetch(`${apiEndpoint}/api/screenshot/${sessionId}`, {
+                  method: 'POST',
+                  headers: { 'Content-Type': 'application/json' },
+                  body: JSON.stringify({ image_base64: screenshot, request_id: requestId }),
+                });
+              }
               console.log('📸 Screenshot sent, response:', response.status);
             } catch (e) {
               console.error('Failed to capture/send screenshot:', e);
@@ -161,7 +220,22 @@ export function useAgentCustomization(
         onError?.(event.message || 'Unknown error');
         break;
 
+      case 'resync_required':
+        // Retried with the full tree once this stream ends
+        console.log('🔄 Server needs the full tree:', event.message);
+        resyncRef.current = true;
+        versionRef.current = null;
+        serverTreeRef.current = null;
+        break;
+
+      case 'cancelled':
+        setStatusMessage(event.message || 'Cancelled');
+        break;
+
       case 'complete':
+        if (event.version !== undefined) {
+          versionRef.current = event.version;
+        }
         setStatusMessage(event.message || 'Complete');
         if (event.todos) {
           setTodos(event.todos);
@@ -187,57 +261,76 @@ export function useAgentCustomization(
       setStatusMessage('Starting customization...');
 
       try {
-        const response = await fetch(`${apiEndpoint}/api/customize`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            prompt,
-            current_tree: currentTree,
-            theme: currentTheme,
-            session_id: sessionId,
-          }),
-          signal: abortControllerRef.current.signal,
-        });
-
-        if (!response.ok) {
-          throw new Error(`HTTP error: ${response.status}`);
-        }
+        for (let attempt = 0; attempt < 2; attempt++) {
+          // The server already has this tree: send its version, not the tree
+          const inSync =
+            attempt === 0 &&
+            !!sessionId &&
+            versionRef.current !== null &&
+            serverTreeRef.current !== null &&
+            jsonEqual(currentTree, serverTreeRef.current);
+          if (!inSync) {
+            serverTreeRef.current = currentTree;
+            versionRef.current = null;
+          }
+          resyncRef.current = false;
+
+          const response = await fetch(`${apiEndpoint}/api/customize`, {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+              prompt,
+              ...(inSync ? { base_version: versionRef.current } : { current_tree: currentTree }),
+              theme: currentTheme,
+              session_id: sessionId,
+              patch_batching: 'step',
+            }),
+            signal: abortControllerRef.current.signal,
+          });
+
+          if (!response.ok) {
+            throw new Error(`HTTP error: ${response.status}`);
+          }
 
-        if (!response.body) {
-          throw new Error('No response body');
-        }
+          if (!response.body) {
+            throw new Error('No response body');
+          }
 
-        // Read SSE stream
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = '';
+          // Read SSE stream
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = '';
 
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
+          while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
 
-          buffer += decoder.decode(value, { stream: true });
+            buffer += decoder.decode(value, { stream: true });
 
-          // Process complete events (lines ending with \n\n)
-          const lines = buffer.split('\n\n');
-          buffer = lines.pop() || '';
+            // Process complete events (lines ending with \n\n)
+            const lines = buffer.split('\n\n');
+            buffer = lines.pop() || '';
 
-          for (const line of lines) {
-            if (!line.trim()) continue;
+            for (const line of lines) {
+              if (!line.trim()) continue;
 
-            // Parse SSE data
-            const dataMatch = line.match(/^data: (.+)$/m);
-            if (!dataMatch) continue;
+              // Parse SSE data
+              const dataMatch = line.match(/^data: (.+)$/m);
+              if (!dataMatch) continue;
 
-            try {
-              const event: CustomizeEvent = JSON.parse(dataMatch[1]);
-              processEventRef.current(event);
-            } catch (e) {
-              console.error('Failed to parse event:', e);
+              try {
+                const event: CustomizeEvent = JSON.parse(dataMatch[1]);
+                processEventRef.current(event);
+              } catch (e) {
+                console.error('Failed to parse event:', e);
+              }
             }
           }
+
+          if (!resyncRef.current) break;
+          setStatusMessage('Resyncing UI tree...');
         }
       } catch (e) {
         if ((e as Error).name === 'AbortError') {
@@ -264,6 +357,38 @@ export function useAgentCustomization(
     setStatusMessage('Cancelled');
   }, []);
 
+  // Undo/redo on the server, then apply the returned patches locally
+  const stepHistory = useCallback(
+    async (action: 'undo' | 'redo') => {
+      if (!sessionId) return;
+      try {
+        const response = await fetch(`${apiEndpoint}/api/${action}`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ session_id: sessionId }),
+        });
+        const data = await response.json();
+        if (!response.ok) {
+          throw new Error(data.detail || `HTTP error: ${response.status}`);
+        }
+        trackPatches(data.patches, data.version);
+        (data.patches as PatchOperation[]).forEach((patch) => onPatch?.(patch));
+        if (data.theme_update?.theme) {
+          onThemeChange?.(data.theme_update.theme);
+        }
+        setStatusMessage(action === 'undo' ? 'Undone' : 'Redone');
+      } catch (e) {
+        const errorMsg = (e as Error).message;
+        setError(errorMsg);
+        onError?.(errorMsg);
+      }
+    },
+    [apiEndpoint, sessionId, onPatch, onThemeChange, onError]
+  );
+
+  const undo = useCallback(() => stepHistory('undo'), [stepHistory]);
+  const redo = useCallback(() => stepHistory('redo'), [stepHistory]);
+
   return {
     todos,
     isCustomizing,
@@ -271,6 +396,8 @@ export function useAgentCustomization(
     statusMessage,
     customize,
     cancel,
+    undo,
+    redo,
   };
 }
 